@@ -2,8 +2,43 @@ import dash
 from dash import html, dcc, Input, Output, no_update, State
 import dash_bootstrap_components as dbc
 import os
-from jupyter_dash import JupyterDash
-import time
+import functools
+import gzip
+import hashlib
+import json
+import mimetypes
+import sqlite3
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing
+from urllib.parse import urlencode
+from flask import Response, abort, request, send_file
+from werkzeug.utils import safe_join
+
+# Show maps from the per-scenario/per-pair bundle HTMLs. Switching metric or time period then only
+# changes the URL fragment, so the iframe switches layers in place instead of loading a new file.
+use_map_bundles = True
+# Show maps from the vector tile viewers instead (write_map_tiles in the run script). The tiles are
+# served from the MBTiles files in the assets folder by the /tiles route below, with no tile server.
+use_map_tiles = False
+# Compute maps on request from the scenario cache the run script keeps (its scenario_cache_db) instead of showing
+# pre-rendered files: any scenario, and any pair of scenarios, can be shown without building its HTMLs first.
+# The cache is read into memory at startup, so the run script must not be writing to it then.
+use_live_maps = False
+scenario_cache_db = "c:/Data/Network_HTMLs/_SCENARIO_CACHE.duckdb"
+# Memory for computed live map layers, most recently used kept; hit/miss/eviction counts are served on /metrics.
+# Under gunicorn each worker process has its own cache, so /metrics shows the counters of the worker that answered.
+live_layer_cache_mb = 256
+# Prefetch the maps of the time periods and years either side of the selection while the user looks at it
+prefetch_adjacent_maps = True
+# Assets are served with their content hash as ETag. Map URLs carry the same hash as `?v=`, so a versioned
+# URL always has the same content and is cached for a year; unversioned requests revalidate with the ETag.
+# The shared base network assets are named after their content and are cached the same way.
+versioned_asset_max_age = 365 * 24 * 60 * 60
+content_named_asset_prefixes = ("_BASE_NETWORK_",)
+# Precompressed copies written by the run script (write_precompressed), in order of preference
+precompressed_encodings = {"br": ".br", "gzip": ".gz"}
+# sha256 of the file the copies were compressed from, written next to them by the run script
+precompressed_digest_suffix = ".sha256"
 
 time_periods = ["AM", "IP", "PM", "OP", "WD"]
 year_options = ["2018", "2026", "2031", "2036", "2041", "2046", "2051", "2056"]
@@ -90,7 +125,193 @@ label_style = {'text-align': 'left', 'font-family': 'VIC', 'vertical-align': 'bo
                'color': '#f7f8fa', 'width': '200px'}
 option_style = {'font-family': 'VIC', 'font-size': '12px'}
 
-app = JupyterDash(external_stylesheets=[dbc.themes.BOOTSTRAP])
+app = dash.Dash(__name__, external_stylesheets=[dbc.themes.BOOTSTRAP])
+# the Flask app, for WSGI servers (Serve_Dashboard.py, gunicorn.conf.py)
+server = app.server
+
+scenario_store = None
+if use_live_maps:
+    from Deploy_Display_Dashboard_live import LIVE_HTML, LIVE_SCRIPT, LayerCache, layer_payload, load_scenario_store
+    from Generate_Network_HTML_bundles import VIEWER_SCRIPT
+    scenario_store = load_scenario_store(scenario_cache_db)
+    layer_cache = LayerCache(int(live_layer_cache_mb * 1024 ** 2))
+    # computes prefetched layers into the layer cache, one at a time so requests keep priority
+    prefetch_executor = ThreadPoolExecutor(max_workers=1)
+    live_map_html = LIVE_HTML.format(viewer_script=VIEWER_SCRIPT, live_script=LIVE_SCRIPT)
+
+
+@functools.lru_cache(maxsize=4096)
+def file_content_hash(file_path, mtime_ns, size):
+    # keyed on mtime and size so a rebuilt file is hashed again
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def asset_version(file_path):
+    stat = os.stat(file_path)
+    return file_content_hash(file_path, stat.st_mtime_ns, stat.st_size)[:16]
+
+
+@functools.lru_cache(maxsize=4096)
+def recorded_digest(digest_path, mtime_ns):
+    with open(digest_path, 'r', encoding='utf-8') as f:
+        return f.read().strip()
+
+
+@functools.lru_cache(maxsize=4096)
+def warn_ignored_variant(variant_path, source_mtime_ns):
+    # cached so each stale copy is logged once per version of its source
+    server.logger.warning(
+        "Not serving %s: it does not match its source (rerun the run script to recompress it)", variant_path
+    )
+
+
+def is_variant_current(file_path, variant_path):
+    # A copy is current while it carries the mtime of the file it was compressed from or, when the mtimes moved
+    # (e.g. the outputs were copied into the assets folder with a plain cp), while the file has the recorded digest
+    source_stat = os.stat(file_path)
+    if os.stat(variant_path).st_mtime_ns == source_stat.st_mtime_ns:
+        return True
+    digest_path = file_path + precompressed_digest_suffix
+    if os.path.isfile(digest_path) and recorded_digest(digest_path, os.stat(digest_path).st_mtime_ns) == (
+        file_content_hash(file_path, source_stat.st_mtime_ns, source_stat.st_size)
+    ):
+        return True
+    warn_ignored_variant(variant_path, source_stat.st_mtime_ns)
+    return False
+
+
+def versioned_asset_url(file_name, fragment=""):
+    file_path = os.path.join(app.config.assets_folder, file_name)
+    url = f"/assets/{file_name}"
+    if os.path.isfile(file_path):
+        url += f"?v={asset_version(file_path)}"
+    return url + (f"#{fragment}" if fragment else "")
+
+
+@app.server.before_request
+def serve_asset():
+    if not request.path.startswith("/assets/"):
+        return None
+    file_path = safe_join(app.config.assets_folder, request.path[len("/assets/"):])
+    if file_path is None or not os.path.isfile(file_path):
+        return None
+    version = asset_version(file_path)
+    available_encodings = [
+        encoding for encoding, suffix in precompressed_encodings.items()
+        if os.path.isfile(file_path + suffix) and is_variant_current(file_path, file_path + suffix)
+    ]
+    encoding = request.accept_encodings.best_match(available_encodings) if available_encodings else None
+    if encoding is not None:
+        response = send_file(
+            file_path + precompressed_encodings[encoding],
+            mimetype=mimetypes.guess_type(file_path)[0] or "application/octet-stream",
+            etag=f"{version}-{encoding}",
+            conditional=True,
+        )
+        response.headers["Content-Encoding"] = encoding
+    else:
+        response = send_file(file_path, etag=version, conditional=True)
+    if available_encodings:
+        response.headers["Vary"] = "Accept-Encoding"
+    if request.args.get("v") == version or os.path.basename(file_path).startswith(content_named_asset_prefixes):
+        response.headers["Cache-Control"] = f"public, max-age={versioned_asset_max_age}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response
+
+
+@app.server.route("/tiles/<tile_name>/<int:z>/<int:x>/<int:y>.pbf")
+def serve_tile(tile_name, z, x, y):
+    tiles_path = os.path.join(app.config.assets_folder, f"{tile_name}.mbtiles")
+    if not os.path.exists(tiles_path):
+        abort(404)
+    with closing(sqlite3.connect(f"file:{tiles_path}?mode=ro", uri=True)) as db:
+        # MBTiles rows count from the bottom of the world (TMS)
+        row = db.execute(
+            "SELECT tile_data FROM tiles WHERE zoom_level = ? AND tile_column = ? AND tile_row = ?",
+            (z, x, 2 ** z - 1 - y)
+        ).fetchone()
+    if row is None:
+        # no links in this tile
+        return Response(status=204)
+    return Response(row[0], mimetype="application/x-protobuf", headers={"Content-Encoding": "gzip"})
+
+
+def gzipped_response(data, etag, immutable=False):
+    # live map payloads are kept gzipped and only inflated for the rare client that does not accept gzip
+    if "gzip" in request.accept_encodings:
+        response = Response(data, mimetype="application/json", headers={"Content-Encoding": "gzip"})
+    else:
+        response = Response(gzip.decompress(data), mimetype="application/json")
+    response.headers["Vary"] = "Accept-Encoding"
+    response.set_etag(etag)
+    if immutable:
+        response.headers["Cache-Control"] = f"public, max-age={versioned_asset_max_age}, immutable"
+    else:
+        response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@app.server.route("/live/map.html")
+def serve_live_map():
+    if scenario_store is None:
+        abort(404)
+    response = Response(live_map_html, mimetype="text/html")
+    response.set_etag(scenario_store.version)
+    response.headers["Cache-Control"] = "no-cache"
+    return response.make_conditional(request)
+
+
+@app.server.route("/live/links")
+def serve_live_links():
+    # ?level=i is a finer geometry level of the links, fetched by the live viewer as the zoom needs it
+    if scenario_store is None:
+        abort(404)
+    level = request.args.get("level", 0, type=int)
+    if not 0 <= level < len(scenario_store.links_payloads):
+        abort(404)
+    return gzipped_response(
+        scenario_store.links_payloads[level], f"{scenario_store.version}-{level}",
+        immutable=level > 0 and request.args.get("v") == scenario_store.version
+    )
+
+
+@app.server.route("/live/layer")
+def serve_live_layer():
+    if scenario_store is None:
+        abort(404)
+    try:
+        selection = (request.args["scenario"], request.args.get("base"), request.args["layer"])
+        payload = layer_cache.get_or_compute(
+            selection, lambda: layer_payload(scenario_store, selection[0], selection[2], selection[1])
+        )
+    except KeyError:
+        return Response("No map for this selection", status=404, mimetype="text/plain")
+    # layer URLs carry the store version, so a layer is only cached while the store is unchanged
+    etag = hashlib.sha256(f"{scenario_store.version}|{request.query_string.decode()}".encode()).hexdigest()[:16]
+    return gzipped_response(payload, etag, immutable=request.args.get("v") == scenario_store.version)
+
+
+@app.server.route("/metrics")
+def serve_metrics():
+    if scenario_store is None:
+        abort(404)
+    metrics = {
+        "pid": os.getpid(),
+        "store": {
+            "version": scenario_store.version,
+            "scenarios": len(scenario_store.scenarios),
+            "links": len(scenario_store.links["A"]),
+        },
+        "layer_cache": layer_cache.metrics(),
+    }
+    return Response(json.dumps(metrics), mimetype="application/json", headers={"Cache-Control": "no-store"})
+
+
 sidebar = html.Div([
     html.Br(),
     html.H3("User Settings", style={'width': '100%', 'text-align': 'center', 'font-family': 'VIC', 'color': '#f7f8fa',
@@ -180,6 +401,7 @@ map_content = html.Div([
         height="100%"
     ),
     html.Div(id="legend-container"),
+    html.Div(id="prefetch-links", style={"display": "none"}),
 ], style=CONTENT_STYLE)
 
 app.layout = html.Div([
@@ -213,9 +435,90 @@ app.layout = html.Div([
 ])
 
 
+def live_selection(s1y, s1, s2y, s2, metric, tp):
+    selection = {"scenario": f"Y{s1y}_{scenario_options_to_scenario_name[s1]}"}
+    if (metric == "Volumes" or metric == "Capacity" or metric == "Lanes") and (s2 != "None"):
+        selection["base"] = f"Y{s2y}_{scenario_options_to_scenario_name[s2]}"
+        selection["layer"] = f"{metric_options_to_metric_code[metric]}_{tp}_DIFF"
+    else:
+        selection["layer"] = f"{metric_options_to_metric_code[metric]}_{tp}"
+    return selection
+
+
+def selected_map_url(s1y, s1, s2y, s2, metric, tp):
+    # Versioned URLs change only when the file is rebuilt, so unchanged maps come from the browser cache
+    if use_live_maps:
+        # the live map stays loaded and fetches the selection in its fragment
+        return "/live/map.html#" + urlencode(live_selection(s1y, s1, s2y, s2, metric, tp))
+    elif use_map_tiles or use_map_bundles:
+        viewer = "TILES" if use_map_tiles else "BUNDLE"
+        if (metric == "Volumes" or metric == "Capacity" or metric == "Lanes") and (s2 != "None"):
+            return versioned_asset_url(f"Y{s1y}_{scenario_options_to_scenario_name[s1]}_vs_Y{s2y}_{scenario_options_to_scenario_name[s2]}_{viewer}.html", f"{metric_options_to_metric_code[metric]}_{tp}_DIFF")
+        else:
+            return versioned_asset_url(f"Y{s1y}_{scenario_options_to_scenario_name[s1]}_{viewer}.html", f"{metric_options_to_metric_code[metric]}_{tp}")
+    elif (metric == "Volumes" or metric == "Capacity" or metric == "Lanes") and (s2 != "None"):
+        return versioned_asset_url(f"Y{s1y}_{scenario_options_to_scenario_name[s1]}_vs_Y{s2y}_{scenario_options_to_scenario_name[s2]}_{metric_options_to_metric_code[metric]}_{tp}_DIFF.html")
+    #elif metric == "V/C" or metric == "Congested Speed":
+    #    map_output = f"/assets/Y{s1y}_{scenario_options_to_scenario_name[s1]}_{tp}_{metric_options_to_metric_code[metric]}.html?t={int(time.time())}"
+    else:
+        return versioned_asset_url(f"Y{s1y}_{scenario_options_to_scenario_name[s1]}_{metric_options_to_metric_code[metric]}_{tp}.html")
+
+
+def adjacent_selections(s1y, s1, s2y, s2, metric, tp):
+    # The time periods either side of the current one and the years either side of scenario 1's,
+    # for the same metric: the steps users most often take next
+    selections = []
+    periods = metric_restrictions_to_tp.get(metric, [])
+    if tp in periods:
+        position = periods.index(tp)
+        for neighbour in periods[max(position - 1, 0):position + 2]:
+            if neighbour != tp:
+                selections.append((s1y, s1, s2y, s2, metric, neighbour))
+    years = scenario_restrictions.get(s1, [])
+    if s1y in years:
+        position = years.index(s1y)
+        for neighbour in years[max(position - 1, 0):position + 2]:
+            # a scenario is never compared with itself
+            if neighbour != s1y and (s1, neighbour) != (s2, s2y):
+                selections.append((neighbour, s1, s2y, s2, metric, tp))
+    return selections
+
+
+def prefetch_links(s1y, s1, s2y, s2, metric, tp):
+    # <link rel="prefetch"> of the maps of the adjacent selections, or of their layers for the live map, so the
+    # browser loads them while idle; versioned URLs are cached as immutable and are then used as they are.
+    # Live map layers are also computed into the server's layer cache straight away.
+    current_url = selected_map_url(s1y, s1, s2y, s2, metric, tp).split("#")[0]
+    urls = []
+    for selection in adjacent_selections(s1y, s1, s2y, s2, metric, tp):
+        if use_live_maps:
+            selection = live_selection(*selection)
+            scenario_names = [selection["scenario"], selection.get("base", selection["scenario"])]
+            if not all(scenario_name in scenario_store.scenarios for scenario_name in scenario_names):
+                continue
+            prefetch_executor.submit(
+                layer_cache.prefetch,
+                (selection["scenario"], selection.get("base"), selection["layer"]),
+                functools.partial(
+                    layer_payload, scenario_store, selection["scenario"], selection["layer"], selection.get("base")
+                ),
+            )
+            # the live map requests its layers with the same parameters in the same order
+            url = "/live/layer?" + urlencode({**selection, "v": scenario_store.version})
+        else:
+            url = selected_map_url(*selection).split("#")[0]
+            # only maps that exist carry a version
+            if "?v=" not in url:
+                continue
+        if url != current_url and url not in urls:
+            urls.append(url)
+    return [html.Link(rel="prefetch", href=url) for url in urls]
+
+
 @app.callback(
     Output("map-frame", "src"),
     Output("legend-container", "children"),
+    Output("prefetch-links", "children"),
     Input("selected_s1_year", "value"),
     Input("selected_s1", "value"),
     Input("selected_s2_year", "value"),
@@ -224,13 +527,7 @@ app.layout = html.Div([
     Input("selected_tp", "value")
 )
 def display_selected_map(s1y, s1, s2y, s2, metric, tp):
-    # Cache-busting to force iframe to reload file
-    if (metric == "Volumes" or metric == "Capacity" or metric == "Lanes") and (s2 != "None"):
-        map_output = f"/assets/Y{s1y}_{scenario_options_to_scenario_name[s1]}_vs_Y{s2y}_{scenario_options_to_scenario_name[s2]}_{metric_options_to_metric_code[metric]}_{tp}_DIFF.html?t={int(time.time())}"
-    #elif metric == "V/C" or metric == "Congested Speed":
-    #    map_output = f"/assets/Y{s1y}_{scenario_options_to_scenario_name[s1]}_{tp}_{metric_options_to_metric_code[metric]}.html?t={int(time.time())}"
-    else:
-        map_output = f"/assets/Y{s1y}_{scenario_options_to_scenario_name[s1]}_{metric_options_to_metric_code[metric]}_{tp}.html?t={int(time.time())}"
+    map_output = selected_map_url(s1y, s1, s2y, s2, metric, tp)
     if metric == "Volumes" and s2 != "None":
         legend = html.Img(src=f"/assets/_LEGENDS/_LEGEND_VOL_COMP.png",
                           style={"height": "50px", "width": "440px", "position": "absolute", "top": "800px",
@@ -263,7 +560,8 @@ def display_selected_map(s1y, s1, s2y, s2, metric, tp):
         legend = html.Img(src=f"/assets/_LEGENDS/_LEGEND_LANE.png",
                           style={"height": "130px", "width": "200px", "position": "absolute", "top": "725px",
                                  "left": "35px", "zIndex": "10", "pointer-events": "none"})
-    return map_output, legend
+    prefetch = prefetch_links(s1y, s1, s2y, s2, metric, tp) if prefetch_adjacent_maps else []
+    return map_output, legend, prefetch
 
 
 # Restrict year options based on scenario selected
@@ -378,4 +676,6 @@ def update_scenario2(met, scen1, scen1_year, scen2, scen2_year):
         return no_update
 
 
-app.run_server(host="0.0.0.0", port="8002", debug=False, use_reloader=False)
+if __name__ == "__main__":
+    # development server; Serve_Dashboard.py serves the dashboard for several users at once
+    app.run(host="0.0.0.0", port=8002, debug=False, use_reloader=False)
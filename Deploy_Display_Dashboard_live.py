@@ -0,0 +1,319 @@
+import gzip
+import hashlib
+import json
+import threading
+from collections import OrderedDict, namedtuple
+
+import duckdb
+import numpy as np
+import pandas as pd
+import shapely
+
+from Generate_Network_HTML_functions import (
+    DIFF_DIVISORS, GEOMETRY_LEVEL_ZOOMS, LINK_CLASS_FILTER, SCENARIO_CACHE_VERSION, SCENARIO_COLUMNS,
+    geometry_level_column, geometry_levels, plan_pair_maps, plan_scenario_maps, scenario_table_name
+)
+from Generate_Network_HTML_bundles import BUNDLE_LAYER_STYLES, bundle_geometry_levels, bundle_layer, encode_array
+
+# Every scenario in the scenario cache is held as columnar arrays over one shared link set, so any
+# scenario or pair of scenarios can be shown without a pre-rendered map. The links (A, B and the coarsest
+# geometry level) are sent to the live viewer once; a selection then only fetches its attribute arrays.
+# links_payloads: the gzipped links, then each finer geometry level as the viewer fetches it
+ScenarioStore = namedtuple("ScenarioStore", ["version", "links", "scenarios", "links_payloads"])
+# values: column -> float64 array over the store's links, NaN where the scenario lacks the link;
+# linkc: the scenario's LINKC_AM; in_filter: the links it has that pass the class filter
+StoredScenario = namedtuple("StoredScenario", ["values", "linkc", "in_filter"])
+
+VALUE_COLUMNS = [col for col in SCENARIO_COLUMNS if col not in ("A", "B")]
+# the map types of a scenario and of a pair, by the layer key the viewers use (e.g. VEH_AM, VEH_AM_DIFF)
+SCENARIO_LAYER_JOBS = {
+    BUNDLE_LAYER_STYLES[job.plot_type]["key"].format(col=job.plot_column): job for job in plan_scenario_maps("", "")
+}
+PAIR_LAYER_JOBS = {
+    BUNDLE_LAYER_STYLES[job.plot_type]["key"].format(col=job.plot_column): job for job in plan_pair_maps("", "", "")
+}
+PAYLOAD_GZIP_LEVEL = 5
+
+LIVE_HTML = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>Live network map</title>
+    <script src="https://unpkg.com/deck.gl@^9.0.0/dist.min.js"></script>
+    <script src="https://unpkg.com/maplibre-gl@^4.0.0/dist/maplibre-gl.js"></script>
+    <link href="https://unpkg.com/maplibre-gl@^4.0.0/dist/maplibre-gl.css" rel="stylesheet"/>
+<style>
+    html, body, #map {{ height: 100%; width: 100%; margin: 0; padding: 0; }}
+    #message {{ position: absolute; top: 10px; left: 50px; font-family: sans-serif; background: white; padding: 4px; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<div id="message"></div>
+<script>
+{viewer_script}
+{live_script}
+</script>
+</body>
+</html>
+"""
+
+# The selection is the URL fragment, e.g. `#scenario=Y2036_RC25v1_02&base=Y2026_RC25v1_02&layer=VEH_AM_DIFF`.
+# The links are fetched once and drawn by the bundles' viewer, which fetches the finer geometry levels as the
+# zoom needs them; changing the fragment only fetches the selection's layer.
+LIVE_SCRIPT = """(function () {
+    var message = document.getElementById('message');
+    var version = null;
+    var viewer = null;
+    var latestRequest = 0;
+
+    function fetchJson(url) {
+        return fetch(url).then(function (response) {
+            if (!response.ok) {
+                return response.text().then(function (text) {
+                    throw new Error(text || response.statusText);
+                });
+            }
+            return response.json();
+        });
+    }
+
+    function loadSelection() {
+        var selection = new URLSearchParams(window.location.hash.slice(1));
+        selection.set('v', version);
+        var key = selection.toString();
+        var request = ++latestRequest;
+        message.textContent = 'Loading...';
+        fetchJson('layer?' + key).then(function (payload) {
+            // a later selection may have been made while this one loaded
+            if (request === latestRequest) {
+                message.textContent = '';
+                var columns = networkViewer.decodeColumns(payload.columns, {});
+                viewer.show(networkViewer.decodeLayer(payload.layer, columns), key);
+            }
+        }).catch(function (error) {
+            if (request === latestRequest) {
+                message.textContent = error.message;
+            }
+        });
+    }
+
+    fetchJson('links').then(function (payload) {
+        version = payload.version;
+        viewer = networkViewer.createViewer(payload, 'map', function (index) {
+            return fetchJson('links?level=' + index + '&v=' + version);
+        });
+        window.addEventListener('hashchange', loadSelection);
+        loadSelection();
+    }).catch(function (error) {
+        message.textContent = error.message;
+    });
+})();
+"""
+
+
+def store_version(con):
+    # Changes whenever a cached scenario is reloaded from a changed shapefile
+    digest = hashlib.sha256(str(SCENARIO_CACHE_VERSION).encode())
+    for row in con.execute(
+        "SELECT scenario, extension, sha256 FROM scenario_sources WHERE cache_version = ? ORDER BY scenario, extension",
+        [SCENARIO_CACHE_VERSION]
+    ).fetchall():
+        digest.update("|".join(row).encode())
+    return digest.hexdigest()[:16]
+
+
+def cached_scenario_names(con):
+    return [
+        scenario_name for (scenario_name,) in con.execute("""
+            SELECT DISTINCT s.scenario FROM scenario_sources AS s
+            JOIN duckdb_tables() AS t ON t.table_name = 'links_' || s.scenario
+            WHERE s.cache_version = ?
+            ORDER BY s.scenario
+        """, [SCENARIO_CACHE_VERSION]).fetchall()
+    ]
+
+
+def create_store_links(con, scenario_names):
+    # One link per (A, B) passing the class filter in any scenario, with the geometry of the last
+    # scenario that has it; `link` is its position in every array of the store
+    links = " UNION ALL BY NAME ".join(
+        f"SELECT A, B, geometry, {source} AS source, rowid AS link_row "
+        f"FROM {scenario_table_name(scenario_name)} WHERE {LINK_CLASS_FILTER}"
+        for source, scenario_name in enumerate(scenario_names)
+    )
+    con.sql(f"""
+        CREATE OR REPLACE TEMP TABLE store_links AS
+        SELECT row_number() OVER (ORDER BY A, B) - 1 AS link, A, B, geometry
+        FROM (
+            SELECT A, B, geometry FROM ({links})
+            QUALIFY row_number() OVER (PARTITION BY A, B ORDER BY source DESC, link_row DESC) = 1
+        )
+    """)
+
+
+def load_stored_scenario(con, scenario_name, link_count):
+    table = con.execute(f"""
+        SELECT l.link, {", ".join(f"CAST(s.{col} AS DOUBLE) AS {col}" for col in VALUE_COLUMNS)},
+            CAST(s.LINKC_AM AS DOUBLE) AS LINKC_AM, coalesce({LINK_CLASS_FILTER}, false) AS in_filter
+        FROM (
+            SELECT * FROM {scenario_table_name(scenario_name)}
+            QUALIFY row_number() OVER (PARTITION BY A, B ORDER BY rowid DESC) = 1
+        ) AS s
+        JOIN store_links AS l ON l.A = s.A AND l.B = s.B
+    """).fetch_arrow_table()
+    links = table.column("link").to_numpy()
+
+    def spread(values, fill):
+        spread_values = np.full(link_count, fill, dtype=np.asarray(values).dtype)
+        spread_values[links] = values
+        return spread_values
+
+    return StoredScenario(
+        values={col: spread(table.column(col).to_numpy(), np.nan) for col in VALUE_COLUMNS},
+        linkc=spread(table.column("LINKC_AM").to_numpy(), np.nan),
+        in_filter=spread(table.column("in_filter").to_numpy(zero_copy_only=False), False),
+    )
+
+
+def links_payloads(version, links):
+    levels = geometry_levels(shapely.from_wkb(links["geometry"]))
+    levels = bundle_geometry_levels([(zoom, levels[geometry_level_column(zoom)]) for zoom in GEOMETRY_LEVEL_ZOOMS])
+    payload = {
+        "version": version,
+        "A": encode_array(links["A"], np.int32),
+        "B": encode_array(links["B"], np.int32),
+        "geometry_levels": [levels[0]] + [{"min_zoom": level["min_zoom"]} for level in levels[1:]],
+        "view_state": {"longitude": 144.935032, "latitude": -37.839289, "zoom": 9},
+    }
+    return [
+        gzip.compress(json.dumps(payload).encode(), PAYLOAD_GZIP_LEVEL)
+    ] + [gzip.compress(json.dumps(level).encode(), PAYLOAD_GZIP_LEVEL) for level in levels[1:]]
+
+
+def load_scenario_store(scenario_cache_db):
+    # Read once at startup; the run script must not be writing to the cache at the same time
+    con = duckdb.connect(scenario_cache_db, read_only=True)
+    try:
+        version = store_version(con)
+        scenario_names = cached_scenario_names(con)
+        create_store_links(con, scenario_names)
+        links = con.sql("SELECT A, B, geometry FROM store_links ORDER BY link").fetch_arrow_table()
+        links = {
+            "A": links.column("A").to_numpy(),
+            "B": links.column("B").to_numpy(),
+            "geometry": links.column("geometry").to_numpy(zero_copy_only=False),
+        }
+        scenarios = {
+            scenario_name: load_stored_scenario(con, scenario_name, len(links["A"]))
+            for scenario_name in scenario_names
+        }
+    finally:
+        con.close()
+    payloads = links_payloads(version, links)
+    del links["geometry"]
+    return ScenarioStore(version, links, scenarios, payloads)
+
+
+def scenario_frame(scenario, columns):
+    # The columns of a scenario map, NaN outside the scenario's own filtered links
+    frame = {col: np.where(scenario.in_filter, scenario.values[col], np.nan) for col in columns}
+    frame["LINKC_AM"] = np.where(scenario.in_filter, scenario.linkc, np.nan)
+    return pd.DataFrame(frame)
+
+
+def pair_frame(base, compare, columns):
+    # compare - base over the links passing the filter in either scenario, as the run script's pair
+    # frames: NaN where either scenario lacks the link, and the link attributes are the compare
+    # scenario's where its link passes the filter, else the base's
+    in_frame = compare.in_filter | base.in_filter
+    frame = {}
+    for col in columns:
+        source_col = col[:-len("_DIFF")]
+        diff = (compare.values[source_col] - base.values[source_col]) / DIFF_DIVISORS.get(source_col, 1)
+        frame[col] = np.where(in_frame, diff, np.nan)
+    frame["LINKC_AM"] = np.where(in_frame, np.where(compare.in_filter, compare.linkc, base.linkc), np.nan)
+    return pd.DataFrame(frame)
+
+
+def live_layer(store, scenario_name, layer_key, base_name=None):
+    # The bundle layer spec and columns of one selection, styled as the pre-rendered maps;
+    # KeyError for a scenario or layer the store does not have
+    job = (SCENARIO_LAYER_JOBS if base_name is None else PAIR_LAYER_JOBS)[layer_key]
+    style = BUNDLE_LAYER_STYLES[job.plot_type]
+    names = {
+        style[field].format(col=job.plot_column) for field in ("value", "colour", "filter", "width")
+        if isinstance(style[field], str)
+    }
+    if base_name is None:
+        frame = scenario_frame(store.scenarios[scenario_name], names)
+    else:
+        frame = pair_frame(store.scenarios[base_name], store.scenarios[scenario_name], names)
+    columns = {}
+    _, spec = bundle_layer(frame, job, columns)
+    return spec, columns
+
+
+def layer_payload(store, scenario_name, layer_key, base_name=None):
+    spec, columns = live_layer(store, scenario_name, layer_key, base_name)
+    payload = {
+        "layer": spec,
+        "columns": {name: encode_array(values, np.float32) for name, values in columns.items()},
+    }
+    return gzip.compress(json.dumps(payload).encode(), PAYLOAD_GZIP_LEVEL)
+
+
+class LayerCache:
+    # Least recently used layer payloads, bounded by their total size in bytes. Payloads are computed
+    # outside the lock, so a slow layer does not hold up hits on other layers.
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self.prefetches = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+    def get_or_compute(self, key, compute):
+        with self.lock:
+            if key in self.entries:
+                self.entries.move_to_end(key)
+                self.hits += 1
+                return self.entries[key]
+            self.misses += 1
+        payload = compute()
+        self.store(key, payload)
+        return payload
+
+    def prefetch(self, key, compute):
+        # A layer the user may select next, counted apart from the requests' hits and misses; a cached
+        # layer is left as it is
+        with self.lock:
+            if key in self.entries:
+                return
+            self.prefetches += 1
+        self.store(key, compute())
+
+    def store(self, key, payload):
+        with self.lock:
+            if key not in self.entries and len(payload) <= self.max_bytes:
+                self.entries[key] = payload
+                self.size += len(payload)
+                while self.size > self.max_bytes:
+                    _, evicted = self.entries.popitem(last=False)
+                    self.size -= len(evicted)
+                    self.evictions += 1
+
+    def metrics(self):
+        with self.lock:
+            return {
+                "entries": len(self.entries),
+                "bytes": self.size,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "prefetches": self.prefetches,
+                "evictions": self.evictions,
+            }
@@ -0,0 +1,529 @@
+import os
+import base64
+import hashlib
+import json
+import numpy as np
+import shapely
+
+from Generate_Network_HTML_functions import (
+    COLOUR_CLASSES, GEOMETRY_LEVEL_ZOOMS, cap_capacity_values, classify_colour_index, geometry_level_column,
+    plot_width_scale, write_text_atomic
+)
+
+DARK_MATTER_STYLE = "https://basemaps.cartocdn.com/gl/dark-matter-gl-style/style.json"
+POSITRON_STYLE = "https://basemaps.cartocdn.com/gl/positron-gl-style/style.json"
+
+# Styling of each map type, mirroring the generate_*_plot functions.
+# `{col}` is the MapJob plot column (a time period for the "vc" and "cspd" maps).
+BUNDLE_LAYER_STYLES = {
+    "volume": {
+        "key": "{col}", "value": "{col}", "colour": "{col}", "colour_class": "vol_diff",
+        "width": "{col}", "filter": "{col}", "scale_numerator": 400,
+        "width_min_pixels": 0, "width_max_pixels": 10000, "width_units": "meters", "basemap": DARK_MATTER_STYLE,
+        "capped": False,
+    },
+    "network": {
+        "key": "{col}", "value": "{col}", "colour": "{col}", "colour_class": "cap_diff",
+        "width": "{col}", "filter": "{col}", "scale_numerator": 350,
+        "width_min_pixels": 0.001, "width_max_pixels": 10000, "width_units": "meters", "basemap": DARK_MATTER_STYLE,
+        "capped": True,
+    },
+    "vc": {
+        "key": "VC_{col}", "value": "VC_{col}", "colour": "VC_{col}", "colour_class": "vc",
+        "width": "VEH_{col}", "filter": "VEH_{col}", "scale_numerator": 400,
+        "width_min_pixels": 0, "width_max_pixels": 10000, "width_units": "meters", "basemap": POSITRON_STYLE,
+        "capped": False,
+    },
+    "cspd": {
+        "key": "CSPD_{col}", "value": "CSPD_{col}", "colour": "CSPD_{col}", "colour_class": "speed",
+        "width": 15, "filter": "VEH_{col}", "scale_numerator": None,
+        "width_min_pixels": 2, "width_max_pixels": 8, "width_units": "meters", "basemap": POSITRON_STYLE,
+        "capped": False,
+    },
+    "lanes": {
+        "key": "{col}", "value": "{col}", "colour": "{col}", "colour_class": "lanes",
+        "width": 15, "filter": "{col}", "scale_numerator": None,
+        "width_min_pixels": 2, "width_max_pixels": 8, "width_units": "meters", "basemap": POSITRON_STYLE,
+        "capped": False,
+    },
+}
+
+BUNDLE_HTML_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+    <script src="https://unpkg.com/deck.gl@^9.0.0/dist.min.js"></script>
+    <script src="https://unpkg.com/maplibre-gl@^4.0.0/dist/maplibre-gl.js"></script>
+    <link href="https://unpkg.com/maplibre-gl@^4.0.0/dist/maplibre-gl.css" rel="stylesheet"/>
+<style>
+    html, body, #map {{ height: 100%; width: 100%; margin: 0; padding: 0; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script type="application/json" id="bundle-data">{bundle_data}</script>
+<script>
+{viewer_script}
+{bundle_script}
+</script>
+</body>
+</html>
+"""
+
+# The viewer shared by the bundles and the dashboard's live map. `networkViewer.createViewer(links, container,
+# loadLevel)` takes the links as the bundles and the live links payload encode them (A, B, geometry_levels,
+# view_state): only the coarsest geometry level is inline, `loadLevel(index)` resolves to a finer one the first
+# time the zoom needs it, which is drawn from the coarser level until then. `show(layer, key)` draws a layer
+# from `networkViewer.decodeLayer(spec, columns)`; showing another layer only swaps the colour/width accessors
+# through deck.gl update triggers, and zooming only swaps the path data to the level simplified for that zoom.
+VIEWER_SCRIPT = """var networkViewer = (function () {
+    function decode(encoded, ArrayType) {
+        var binary = atob(encoded);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        return new ArrayType(bytes.buffer);
+    }
+
+    function decodeColumns(encodedColumns, columns) {
+        Object.keys(encodedColumns).forEach(function (name) {
+            columns[name] = decode(encodedColumns[name], Float32Array);
+        });
+        return columns;
+    }
+
+    // columns: name -> decoded values, holding at least the columns the spec names
+    function decodeLayer(spec, columns) {
+        return {
+            spec: spec,
+            columns: columns,
+            colourIndex: decode(spec.colour_index, Uint8Array),
+            drawOrders: {},
+            palette: spec.palette.map(function (colour) {
+                return colour.length === 4 ? colour : colour.concat([255]);
+            })
+        };
+    }
+
+    function decodeGeometry(encoded) {
+        return withPaths({
+            coordinates: decode(encoded.coordinates, Float32Array),
+            pathStarts: decode(encoded.path_starts, Uint32Array),
+            pathLinks: decode(encoded.path_links, Uint32Array)
+        });
+    }
+
+    function withPaths(geometry) {
+        geometry.paths = {length: geometry.pathLinks.length};
+        geometry.path = function (path) {
+            return geometry.coordinates.subarray(geometry.pathStarts[path] * 2, geometry.pathStarts[path + 1] * 2);
+        };
+        return geometry;
+    }
+
+    // A finer level only holds the paths of the links it changes; the coarser level's paths of the other
+    // links are kept, all in link order
+    function mergeLevel(coarser, changed, linkCount) {
+        var replaced = new Uint8Array(linkCount);
+        var pathCount = changed.pathLinks.length;
+        var coordinateCount = changed.coordinates.length / 2;
+        var i;
+        for (i = 0; i < changed.pathLinks.length; i++) {
+            replaced[changed.pathLinks[i]] = 1;
+        }
+        for (i = 0; i < coarser.pathLinks.length; i++) {
+            if (!replaced[coarser.pathLinks[i]]) {
+                pathCount++;
+                coordinateCount += coarser.pathStarts[i + 1] - coarser.pathStarts[i];
+            }
+        }
+        var merged = {
+            coordinates: new Float32Array(coordinateCount * 2),
+            pathStarts: new Uint32Array(pathCount + 1),
+            pathLinks: new Uint32Array(pathCount)
+        };
+        var path = 0;
+        function copyPath(source, index) {
+            var coordinates = source.coordinates.subarray(source.pathStarts[index] * 2, source.pathStarts[index + 1] * 2);
+            merged.coordinates.set(coordinates, merged.pathStarts[path] * 2);
+            merged.pathLinks[path] = source.pathLinks[index];
+            merged.pathStarts[path + 1] = merged.pathStarts[path] + coordinates.length / 2;
+            path++;
+        }
+        var next = 0;
+        for (i = 0; i < coarser.pathLinks.length; i++) {
+            for (; next < changed.pathLinks.length && changed.pathLinks[next] <= coarser.pathLinks[i]; next++) {
+                copyPath(changed, next);
+            }
+            if (!replaced[coarser.pathLinks[i]]) {
+                copyPath(coarser, i);
+            }
+        }
+        for (; next < changed.pathLinks.length; next++) {
+            copyPath(changed, next);
+        }
+        return withPaths(merged);
+    }
+
+    function createViewer(links, container, loadLevel) {
+        var linkA = decode(links.A, Int32Array);
+        var linkB = decode(links.B, Int32Array);
+        var levels = [decodeGeometry(links.geometry_levels[0])];
+        var loadingLevels = [Promise.resolve(levels[0])];
+        var layer = null;
+        var layerKey = null;
+        // the level for the zoom, and the level drawn while it loads
+        var level = levelIndex(links.view_state.zoom);
+        var shownLevel = 0;
+        var deckgl = null;
+
+        function levelIndex(zoom) {
+            var index = 0;
+            links.geometry_levels.forEach(function (encoded, i) {
+                if (zoom >= encoded.min_zoom) {
+                    index = i;
+                }
+            });
+            return index;
+        }
+
+        // Each level is merged onto the one before it, so those are loaded first. A loaded level is drawn
+        // right away when the zoom needs it or a finer one
+        function requestLevel(index) {
+            if (!loadingLevels[index]) {
+                loadingLevels[index] = requestLevel(index - 1).then(function (coarser) {
+                    return loadLevel(index).then(function (encoded) {
+                        levels[index] = mergeLevel(coarser, decodeGeometry(encoded), linkA.length);
+                        if (deckgl !== null && level >= index && shownLevel < index) {
+                            deckgl.setProps({layers: buildLayers()});
+                        }
+                        return levels[index];
+                    });
+                }).catch(function (error) {
+                    // a later zoom tries again
+                    loadingLevels[index] = null;
+                    throw error;
+                });
+            }
+            return loadingLevels[index];
+        }
+
+        function showLevel(index) {
+            level = index;
+            requestLevel(index).catch(function (error) {
+                console.error(error);
+            });
+        }
+
+        // The level's paths ordered by the absolute value of the layer's order column, smallest first and
+        // NaN last, so large values are drawn on top as in the single maps
+        function drawOrder(index) {
+            if (!layer.drawOrders[index]) {
+                var orderValues = layer.columns[layer.spec.order];
+                var pathLinks = levels[index].pathLinks;
+                var order = new Uint32Array(pathLinks.length);
+                var sortKeys = new Float64Array(pathLinks.length);
+                for (var i = 0; i < order.length; i++) {
+                    var value = Math.abs(orderValues[pathLinks[i]]);
+                    order[i] = i;
+                    sortKeys[i] = isNaN(value) ? Infinity : value;
+                }
+                order.sort(function (a, b) {
+                    return (sortKeys[a] - sortKeys[b]) || (a - b);
+                });
+                layer.drawOrders[index] = order;
+            }
+            return layer.drawOrders[index];
+        }
+
+        function buildLayers() {
+            shownLevel = level;
+            while (!levels[shownLevel]) {
+                shownLevel--;
+            }
+            var current = levels[shownLevel];
+            var spec = layer.spec;
+            var filterValues = layer.columns[spec.filter];
+            var widths = typeof spec.width === 'string' ? layer.columns[spec.width] : null;
+            var pathLinks = current.pathLinks;
+            var order = drawOrder(shownLevel);
+
+            function isVisible(link) {
+                return Math.abs(filterValues[link]) >= spec.min_abs;
+            }
+
+            var valueLayer = new deck.PathLayer({
+                id: 'values',
+                data: current.paths,
+                _pathType: 'open',
+                positionFormat: 'XY',
+                getPath: function (_, info) {
+                    return current.path(order[info.index]);
+                },
+                getColor: function (_, info) {
+                    var link = pathLinks[order[info.index]];
+                    return isVisible(link) ? layer.palette[layer.colourIndex[link]] : [0, 0, 0, 0];
+                },
+                getWidth: function (_, info) {
+                    var link = pathLinks[order[info.index]];
+                    if (!isVisible(link)) {
+                        return 0;
+                    }
+                    return widths ? Math.abs(widths[link]) : spec.width;
+                },
+                updateTriggers: {getPath: layerKey, getColor: layerKey, getWidth: layerKey},
+                widthScale: spec.width_scale,
+                widthMinPixels: spec.width_min_pixels,
+                widthMaxPixels: spec.width_max_pixels,
+                widthUnits: spec.width_units,
+                capRounded: true,
+                extensions: [new deck.PathStyleExtension({offset: true})],
+                getOffset: -0.7,
+                autoHighlight: true,
+                pickable: true,
+                opacity: 0.85
+            });
+            var roadLayer = new deck.PathLayer({
+                id: 'road',
+                data: current.paths,
+                _pathType: 'open',
+                positionFormat: 'XY',
+                getPath: function (_, info) {
+                    return current.path(info.index);
+                },
+                getColor: [168, 168, 168],
+                widthMinPixels: 0.5,
+                pickable: false
+            });
+            return [valueLayer, roadLayer];
+        }
+
+        function tooltip(info) {
+            if (info.index < 0 || info.layer === null || info.layer.id !== 'values') {
+                return null;
+            }
+            var link = levels[shownLevel].pathLinks[drawOrder(shownLevel)[info.index]];
+            var value = layer.columns[layer.spec.value][link];
+            return 'A: ' + linkA[link] + '\\nB: ' + linkB[link] + '\\n' + layer.spec.value + ': ' +
+                (isNaN(value) ? '' : Math.round(value * 100) / 100);
+        }
+
+        function show(nextLayer, nextKey) {
+            var previousBasemap = layer ? layer.spec.basemap : null;
+            layer = nextLayer;
+            layerKey = nextKey;
+            if (deckgl === null) {
+                deckgl = new deck.DeckGL({
+                    container: container,
+                    mapStyle: layer.spec.basemap,
+                    initialViewState: links.view_state,
+                    controller: true,
+                    getTooltip: tooltip,
+                    onViewStateChange: function (params) {
+                        var nextLevel = levelIndex(params.viewState.zoom);
+                        if (nextLevel !== level) {
+                            showLevel(nextLevel);
+                            deckgl.setProps({layers: buildLayers()});
+                        }
+                    },
+                    layers: buildLayers()
+                });
+                return;
+            }
+            var props = {layers: buildLayers()};
+            if (layer.spec.basemap !== previousBasemap) {
+                props.mapStyle = layer.spec.basemap;
+            }
+            deckgl.setProps(props);
+        }
+
+        showLevel(level);
+        return {show: show};
+    }
+
+    return {decode: decode, decodeColumns: decodeColumns, decodeLayer: decodeLayer, createViewer: createViewer};
+})();
+"""
+
+# Switching layer is the URL fragment, e.g. `#VEH_AM`; the bundle's columns are decoded once and
+# shared by its layers. The finer geometry levels are side scripts next to the bundle (BUNDLE_LEVEL_TEMPLATE),
+# so they load from the dashboard and from a bundle opened as a local file alike.
+BUNDLE_SCRIPT = """(function () {
+    var bundle = JSON.parse(document.getElementById('bundle-data').textContent);
+    var columns = networkViewer.decodeColumns(bundle.columns, {});
+    var layers = {};
+    var levelLoaded = {};
+
+    window.bundleGeometryLevel = function (index, encoded) {
+        levelLoaded[index](encoded);
+    };
+
+    function loadLevel(index) {
+        return new Promise(function (resolve, reject) {
+            var script = document.createElement('script');
+            levelLoaded[index] = resolve;
+            script.src = bundle.geometry_levels[index].src;
+            script.onerror = function () {
+                document.head.removeChild(script);
+                reject(new Error('Could not load ' + script.src));
+            };
+            document.head.appendChild(script);
+        });
+    }
+
+    var viewer = networkViewer.createViewer({
+        A: bundle.links.A,
+        B: bundle.links.B,
+        geometry_levels: bundle.geometry_levels,
+        view_state: bundle.view_state
+    }, 'map', loadLevel);
+
+    function showActiveLayer() {
+        var key = decodeURIComponent(window.location.hash.slice(1));
+        if (!bundle.layers[key]) {
+            key = bundle.default_layer;
+        }
+        if (!layers[key]) {
+            layers[key] = networkViewer.decodeLayer(bundle.layers[key], columns);
+        }
+        viewer.show(layers[key], key);
+    }
+
+    window.addEventListener('hashchange', showActiveLayer);
+    showActiveLayer();
+})();
+"""
+
+BUNDLE_LEVEL_TEMPLATE = """bundleGeometryLevel({index}, {level});
+"""
+# A geometry level with fewer than this share of coordinates less than the next finer level is not sent,
+# the finer level is used from its zoom instead
+GEOMETRY_LEVEL_MIN_SAVING = 0.2
+
+
+def encode_array(values, dtype):
+    return base64.b64encode(np.ascontiguousarray(values, dtype=dtype).tobytes()).decode("ascii")
+
+
+def bundle_geometry(geometry, links=None):
+    # links: the link of each geometry, when they are not all the links in order
+    parts, part_links = shapely.get_parts(np.asarray(geometry), return_index=True)
+    if links is not None:
+        part_links = links[part_links]
+    counts = shapely.get_num_coordinates(parts)
+    return {
+        "coordinates": encode_array(shapely.get_coordinates(parts), np.float32),
+        "path_starts": encode_array(np.concatenate([[0], np.cumsum(counts)]), np.uint32),
+        "path_links": encode_array(part_links, np.uint32),
+    }
+
+
+def bundle_geometry_levels(level_geometries):
+    # level_geometries: (min_zoom, geometry of every link), coarsest first. A level that saves little over the
+    # next finer one is dropped and every level after the first only holds the links it changes (e.g. none of
+    # the 2-vertex links), the viewer takes the others from the level before it
+    kept = []
+    for zoom, geometry in reversed(level_geometries):
+        geometry = np.asarray(geometry)
+        coordinates = int(shapely.get_num_coordinates(geometry).sum())
+        if kept and coordinates > (1 - GEOMETRY_LEVEL_MIN_SAVING) * kept[0][2]:
+            kept[0] = (zoom, kept[0][1], kept[0][2])
+        else:
+            kept.insert(0, (zoom, geometry, coordinates))
+    levels = [{"min_zoom": kept[0][0], **bundle_geometry(kept[0][1])}]
+    for (_, coarser, _), (zoom, geometry, _) in zip(kept, kept[1:]):
+        changed = np.flatnonzero(~shapely.equals_exact(coarser, geometry, tolerance=0))
+        levels.append({"min_zoom": zoom, **bundle_geometry(geometry[changed], changed)})
+    return levels
+
+
+def bundle_level_path(file_name, zoom):
+    return f"{os.path.splitext(file_name)[0]}_Z{zoom}.js"
+
+
+def bundle_layer(gdf_input, job, columns):
+    style = BUNDLE_LAYER_STYLES[job.plot_type]
+    names = {field: style[field].format(col=job.plot_column) for field in ("value", "colour", "filter")}
+    if isinstance(style["width"], str):
+        names["width"] = style["width"].format(col=job.plot_column)
+    for field, name in names.items():
+        if style["capped"]:
+            # capped values are shipped as their own column, the raw one is not needed
+            name = f"{name}_CAPPED"
+            names[field] = name
+            if name not in columns:
+                columns[name] = cap_capacity_values(gdf_input, job.plot_column)
+        elif name not in columns:
+            columns[name] = gdf_input[name].to_numpy(dtype=np.float64)
+
+    width_scale = 1
+    if "width" in names:
+        width_scale = plot_width_scale(style["scale_numerator"], columns[names["width"]])
+
+    return style["key"].format(col=job.plot_column), {
+        "value": names["value"],
+        "filter": names["filter"],
+        # paths are drawn by the absolute value of this column, smallest first, as plot_order does
+        "order": names.get("width", names["value"]),
+        "min_abs": job.min_abs_vol,
+        "colour": names["colour"],
+        "colour_class": style["colour_class"],
+        "colour_index": encode_array(classify_colour_index(columns[names["colour"]], style["colour_class"]), np.uint8),
+        "palette": COLOUR_CLASSES[style["colour_class"]]["palette"],
+        "width": names.get("width", style["width"]),
+        "width_scale": float(width_scale),
+        "width_min_pixels": style["width_min_pixels"],
+        "width_max_pixels": style["width_max_pixels"],
+        "width_units": style["width_units"],
+        "basemap": style["basemap"],
+    }
+
+
+def generate_map_bundle(gdf_input, maps, file_name):
+    # One HTML holding the geometry once and every map of `maps` as a switchable layer. The finer geometry
+    # levels are written next to it first, so the bundle never refers to a missing one; returns their paths
+    columns = {}
+    layers = {}
+    for job in maps:
+        key, layer = bundle_layer(gdf_input, job, columns)
+        layers[key] = layer
+    geometry_levels = bundle_geometry_levels(
+        [(zoom, gdf_input[geometry_level_column(zoom)].values) for zoom in GEOMETRY_LEVEL_ZOOMS]
+    )
+    level_paths = []
+    for index, level in enumerate(geometry_levels[1:], 1):
+        level_path = bundle_level_path(file_name, level["min_zoom"])
+        level_script = BUNDLE_LEVEL_TEMPLATE.format(index=index, level=json.dumps(level))
+        write_text_atomic(level_path, level_script)
+        level_paths.append(level_path)
+        # versioned by content, as the dashboard versions its assets, so a rebuilt level is not taken from a cache
+        version = hashlib.sha256(level_script.encode()).hexdigest()[:16]
+        geometry_levels[index] = {"min_zoom": level["min_zoom"], "src": f"{os.path.basename(level_path)}?v={version}"}
+    bundle = {
+        "geometry_levels": geometry_levels,
+        "links": {
+            "A": encode_array(gdf_input["A"], np.int32),
+            "B": encode_array(gdf_input["B"], np.int32),
+        },
+        "columns": {name: encode_array(values, np.float32) for name, values in columns.items()},
+        "layers": layers,
+        "default_layer": next(iter(layers)),
+        "view_state": {"longitude": 144.935032, "latitude": -37.839289, "zoom": 9},
+    }
+    write_text_atomic(file_name, BUNDLE_HTML_TEMPLATE.format(
+        title=file_name,
+        bundle_data=json.dumps(bundle).replace("</", "<\\/"),
+        viewer_script=VIEWER_SCRIPT,
+        bundle_script=BUNDLE_SCRIPT,
+    ))
+    return level_paths
+
+
+def scenario_bundle_path(scenario_name, output_dir):
+    return os.path.join(output_dir, f"{scenario_name}_BUNDLE.html")
+
+
+def pair_bundle_path(scenario_base_name, scenario_compare_name, output_dir):
+    return os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_BUNDLE.html")
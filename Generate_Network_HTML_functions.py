@@ -1,130 +1,766 @@
 import os
-import duckdb
-import geopandas as gpd
+import functools
+import gzip
+import hashlib
+import multiprocessing
+import tempfile
+import json
 import numpy as np
 import pandas as pd
-import codecs
-from shapely import from_wkb
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
+# geopandas, shapely, pyarrow, lonboard and ipywidgets are imported where the links are decoded and the
+# maps are built: the dashboard's live maps use this module for the scenario cache and layer plans only,
+# and should start without the generation stack
 
-import lonboard as lb
-from lonboard import Map, PathLayer, basemap
-from lonboard.colormap import apply_categorical_cmap
-from lonboard.layer_extension import PathStyleExtension
+from Generate_Network_HTML_profiling import STAGE_RECORDS, stage_labels, take_stage_records, timed_stage
 
-import warnings
+try:
+    import brotli
+except ImportError:
+    # .br variants are only written when the brotli package is installed
+    brotli = None
 
-warnings.simplefilter(action='ignore', category=FutureWarning)
-warnings.filterwarnings("ignore", category=DeprecationWarning)
-warnings.filterwarnings("ignore", category=UserWarning)
-warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+SCENARIO_COLUMNS = [
+    "A", "B",
+    "VEH_AM", "VEH_IP", "VEH_PM", "VEH_OP", "VEH_WD",
+    "VC_AM", "VC_IP", "VC_PM", "VC_OP",
+    "HYCAP_AM", "HYCAP_IP", "HYCAP_PM", "HYCAP_OP",
+    "CSPD_AM", "CSPD_IP", "CSPD_PM", "CSPD_OP",
+    "LANES_AM", "LANES_IP", "LANES_PM", "LANES_OP",
+]
+SCENARIO_SOURCE_EXTENSIONS = [".shp", ".dbf"]
+# Bump when the scenario table layout changes so cached tables are rebuilt
+SCENARIO_CACHE_VERSION = 1
+LINK_CLASS_FILTER = "LINKC_AM NOT IN (1,-1,0) AND LINKC_AM < 39 AND LINKC_AM < 50"
+TIME_PERIODS = ["AM", "IP", "PM", "OP"]
+VOL_COLS = ["VEH_AM", "VEH_IP", "VEH_PM", "VEH_OP", "VEH_WD"]
+CAP_COLS = ["HYCAP_AM", "HYCAP_IP", "HYCAP_PM", "HYCAP_OP"]
+LANE_COLS = ["LANES_AM", "LANES_IP", "LANES_PM", "LANES_OP"]
+DIFF_SOURCE_COLS = VOL_COLS + CAP_COLS + LANE_COLS
+# capacity differences are reported per hour of each period
+DIFF_DIVISORS = {"HYCAP_AM": 2, "HYCAP_IP": 6, "HYCAP_PM": 3, "HYCAP_OP": 6}
 
+# Min zoom of each geometry level. A level is simplified to half a screen pixel at the next
+# level's min zoom, so it is drawn without visible loss; the last level is the full geometry.
+GEOMETRY_LEVEL_ZOOMS = [0, 10, 12, 14]
+# the grey road layer of the single maps is drawn from this level
+ROAD_LAYER_GEOMETRY_ZOOM = 12
+# Resident bytes of a decoded link with its geometry levels per byte of its WKB, roughly, as measured
+# on a 100k-link network; sizes the record batches of a streamed load
+LINK_BYTES_PER_WKB_BYTE = 12
+# smaller batches cost more in per-batch overhead than they save
+MIN_LINK_BATCH_ROWS = 1024
 
-def decode_escaped_wkb(s):
-    s_fixed = s.replace('\\X', '\\x')  # fix uppercase \X to \x
-    # Decode escape sequences to bytes
-    wkb_bytes = codecs.decode(s_fixed, 'unicode_escape').encode('latin1')
-    return from_wkb(wkb_bytes)
+# Outputs also written as .gz/.br for the dashboard; MBTiles files hold gzipped tiles already
+PRECOMPRESSED_EXTENSIONS = [".html", ".js"]
+# quality 11 saves another ~10% on the maps but is ~25x slower than 9
+BROTLI_QUALITY = 9
+# sha256 of the file the variants were compressed from, written next to them
+PRECOMPRESSED_DIGEST_SUFFIX = ".sha256"
 
+MapJob = namedtuple("MapJob", ["plot_type", "plot_column", "min_abs_vol", "file_name"])
 
-def create_gdf_using_decoded_geoms(input_df):
-    input_df['geometry'] = input_df['geometry'].apply(decode_escaped_wkb)
-    gdf_output = gpd.GeoDataFrame(input_df, geometry='geometry')
-    return gdf_output
 
+def scenario_shapefile_path(raw_file_dir, scenario_name):
+    return os.path.join(raw_file_dir, f"SUMMARY_LOADED_NETWORK_LINKS_{scenario_name}.shp")
 
-def categorise_vol_diff(diff):
-    if diff < 0:
-        return [255, 128, 0]
-    else:
-        return [0, 204, 204]
 
+def scenario_table_name(scenario_name):
+    return f'"links_{scenario_name}"'
 
-def categorise_cap_diff(diff):
-    if diff < 0:
-        return [255, 56, 76]
-    else:
-        return [64, 132, 234]
-
-
-def categorise_vc(vc):
-    if vc < 0.6:
-        return [26, 150, 65]
-    elif vc < 0.7:
-        return [138, 204, 98]
-    elif vc < 0.8:
-        return [219, 240, 158]
-    elif vc < 0.9:
-        return [254, 223, 154]
-    elif vc < 1.0:
-        return [245, 144, 83]
-    elif vc < 1.2:
-        return [215, 25, 28]
-    else:
-        return [138, 0, 5]
-
-
-def categorise_speed(cspd):
-    if cspd < 10:
-        return [0, 0, 0]
-    elif cspd < 20:
-        return [133, 11, 3]
-    elif cspd < 30:
-        return [245, 19, 2]
-    elif cspd < 40:
-        return [245, 107, 2]
-    elif cspd < 60:
-        return [245, 200, 2]
-    elif cspd < 80:
-        return [140, 245, 2]
-    else:
-        return [0, 194, 45]
-
-
-def categorise_lanes(lanes):
-    if abs(lanes) < 1:
-        return [0, 0, 0, 0]
-    elif abs(lanes) < 2:
-        return [255, 56, 76, 255]
-    elif abs(lanes) < 3:
-        return [255, 145, 0, 255]
-    elif abs(lanes) < 4:
-        return [255, 210, 0, 255]
-    elif abs(lanes) < 5:
-        return [120, 163, 0, 255]
-    elif abs(lanes) < 6:
-        return [174, 105, 255, 255]
+
+def load_scenario_links(con, scenario_name, shp_path):
+    # Read and reproject the shapefile once; every pair involving this
+    # scenario then queries the cached table instead of the shapefile.
+    table_name = scenario_table_name(scenario_name)
+    con.sql(f"""
+            CREATE OR REPLACE TABLE {table_name} AS
+            SELECT
+                    {", ".join(SCENARIO_COLUMNS)}, COLUMNS('LINKC_'), COLUMNS('SL'),
+                    ST_AsWKB(ST_FlipCoordinates(ST_Transform(geom, 'EPSG:20255', 'EPSG:4326'))) AS geometry
+            FROM '{shp_path}'
+            """)
+    return table_name
+
+
+def file_sha256(file_name):
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def scenario_source_files(shp_path):
+    base_name = os.path.splitext(shp_path)[0]
+    return {extension: base_name + extension for extension in SCENARIO_SOURCE_EXTENSIONS}
+
+
+def create_scenario_cache_tables(con):
+    con.sql("""
+            CREATE TABLE IF NOT EXISTS scenario_sources (
+                scenario VARCHAR,
+                extension VARCHAR,
+                mtime_ns BIGINT,
+                size BIGINT,
+                sha256 VARCHAR,
+                cache_version INTEGER,
+                PRIMARY KEY (scenario, extension)
+            )
+            """)
+
+
+def is_scenario_cached(con, scenario_name, shp_path):
+    # A cached table is reused while its .shp/.dbf are unchanged: same mtime and size,
+    # or, when only the mtime moved (e.g. a re-copy), the same content hash.
+    table_exists = con.execute(
+        "SELECT count(*) FROM duckdb_tables() WHERE table_name = ?", [f"links_{scenario_name}"]
+    ).fetchone()[0]
+    recorded = {
+        extension: (mtime_ns, size, sha256)
+        for extension, mtime_ns, size, sha256 in con.execute(
+            "SELECT extension, mtime_ns, size, sha256 FROM scenario_sources WHERE scenario = ? AND cache_version = ?",
+            [scenario_name, SCENARIO_CACHE_VERSION]
+        ).fetchall()
+    }
+    if not table_exists or set(recorded) != set(SCENARIO_SOURCE_EXTENSIONS):
+        return False
+    for extension, file_name in scenario_source_files(shp_path).items():
+        mtime_ns, size, sha256 = recorded[extension]
+        stat = os.stat(file_name)
+        if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+            continue
+        if stat.st_size != size or file_sha256(file_name) != sha256:
+            return False
+        con.execute(
+            "UPDATE scenario_sources SET mtime_ns = ? WHERE scenario = ? AND extension = ?",
+            [stat.st_mtime_ns, scenario_name, extension]
+        )
+    return True
+
+
+def recorded_scenario_sources(con):
+    # scenario -> extension -> (mtime_ns, size, sha256) of every source file the cache has loaded
+    recorded = {}
+    if not con.execute("SELECT count(*) FROM duckdb_tables() WHERE table_name = 'scenario_sources'").fetchone()[0]:
+        return recorded
+    for scenario_name, extension, mtime_ns, size, sha256 in con.execute(
+        "SELECT scenario, extension, mtime_ns, size, sha256 FROM scenario_sources"
+    ).fetchall():
+        recorded.setdefault(scenario_name, {})[extension] = (mtime_ns, size, sha256)
+    return recorded
+
+
+def record_scenario_sources(con, scenario_name, shp_path):
+    con.execute("DELETE FROM scenario_sources WHERE scenario = ?", [scenario_name])
+    for extension, file_name in scenario_source_files(shp_path).items():
+        stat = os.stat(file_name)
+        con.execute(
+            "INSERT INTO scenario_sources VALUES (?, ?, ?, ?, ?, ?)",
+            [scenario_name, extension, stat.st_mtime_ns, stat.st_size, file_sha256(file_name), SCENARIO_CACHE_VERSION]
+        )
+
+
+def load_scenario_registry(con, scenario_names, raw_file_dir):
+    # Scenario tables persist in the connection's database file between runs
+    create_scenario_cache_tables(con)
+    registry = {}
+    for scenario_name in scenario_names:
+        if scenario_name in registry:
+            continue
+        shp_path = scenario_shapefile_path(raw_file_dir, scenario_name)
+        if is_scenario_cached(con, scenario_name, shp_path):
+            print(f"Using cached {scenario_name}.")
+            registry[scenario_name] = scenario_table_name(scenario_name)
+            continue
+        print(f"Loading {scenario_name} into the database...")
+        # the shapefile scan and ST_Transform run as one DuckDB query
+        with timed_stage("scan_and_transform", scenario=scenario_name):
+            registry[scenario_name] = load_scenario_links(con, scenario_name, shp_path)
+        record_scenario_sources(con, scenario_name, shp_path)
+    return registry
+
+
+def build_scenario_values(con, scenario_registry):
+    # One long table (scenario, A, B, metric, period, value) stacking the diffable columns of every scenario
+    stacked = " UNION ALL ".join(
+        f"SELECT '{scenario_name}' AS scenario, A, B, "
+        + ", ".join(f"CAST({col} AS DOUBLE) AS {col}" for col in DIFF_SOURCE_COLS)
+        + f" FROM {scenario_table}"
+        for scenario_name, scenario_table in scenario_registry.items()
+    )
+    con.sql(f"""
+        CREATE OR REPLACE TEMP TABLE scenario_values AS
+        SELECT
+            scenario, A, B,
+            split_part(name, '_', 1) AS metric,
+            split_part(name, '_', 2) AS period,
+            value
+        FROM (UNPIVOT ({stacked}) ON {", ".join(DIFF_SOURCE_COLS)} INTO NAME name VALUE value)
+    """)
+
+
+def compute_pair_diffs(con, pairs):
+    # Every requested pair is diffed in one pass over scenario_values. A pair and its reverse
+    # share one unordered (scenario_lo, scenario_hi) row; query_pair_diff negates for the reverse.
+    unordered_pairs = sorted({tuple(sorted(pair)) for pair in pairs})
+    con.sql("CREATE OR REPLACE TEMP TABLE diff_pairs (scenario_lo VARCHAR, scenario_hi VARCHAR)")
+    if unordered_pairs:
+        con.executemany("INSERT INTO diff_pairs VALUES (?, ?)", unordered_pairs)
+    divisor = "CASE hi.metric || '_' || hi.period " + " ".join(
+        f"WHEN '{col}' THEN {value}" for col, value in DIFF_DIVISORS.items()
+    ) + " ELSE 1 END"
+    diff_names = ", ".join(f"'{col}_DIFF'" for col in DIFF_SOURCE_COLS)
+    con.sql(f"""
+        CREATE OR REPLACE TEMP TABLE pair_diffs AS
+        PIVOT (
+            SELECT
+                p.scenario_lo, p.scenario_hi, hi.A, hi.B,
+                hi.metric || '_' || hi.period || '_DIFF' AS name,
+                (hi.value - lo.value) / {divisor} AS value
+            FROM diff_pairs AS p
+            JOIN scenario_values AS hi ON hi.scenario = p.scenario_hi
+            JOIN scenario_values AS lo
+                ON lo.scenario = p.scenario_lo
+                AND lo.A = hi.A AND lo.B = hi.B
+                AND lo.metric = hi.metric AND lo.period = hi.period
+        )
+        ON name IN ({diff_names})
+        USING first(value)
+        GROUP BY scenario_lo, scenario_hi, A, B
+    """)
+
+
+def master_links_query(scenario_tables):
+    # Every link passing the class filter in any of the scenarios, once per (A, B). A later scenario's
+    # link wins over an earlier one's, the compare scenario's over the base's; link_source is the
+    # position of the scenario the link is taken from and link_row its row in that scenario's table.
+    links = " UNION ALL BY NAME ".join(
+        f"SELECT A, B, COLUMNS('LINKC_'), COLUMNS('SL'), {link_source} AS link_source, rowid AS link_row "
+        f"FROM {scenario_table} WHERE {LINK_CLASS_FILTER}"
+        for link_source, scenario_table in enumerate(scenario_tables)
+    )
+    return f"""
+        SELECT * FROM ({links})
+        QUALIFY row_number() OVER (PARTITION BY A, B ORDER BY link_source DESC, link_row DESC) = 1
+    """
+
+
+def query_scenario_values(con, scenario_table):
+    return con.sql(f"""
+        SELECT {", ".join(f"v.{col}" for col in SCENARIO_COLUMNS)}, m.* EXCLUDE (A, B)
+        FROM {scenario_table} AS v
+        JOIN ({master_links_query([scenario_table])}) AS m ON m.A = v.A AND m.B = v.B
+        ORDER BY v.rowid
+    """)
+
+
+def query_pair_diff(con, scenario_registry, scenario_base_name, scenario_compare_name):
+    # Every master link of the pair, as the full outer join of base and compare did, with compare - base
+    # differences, NULL where either scenario lacks the link. Compare's links come first in its table
+    # order, then the links only the base has in the base's order.
+    scenario_lo, scenario_hi = sorted((scenario_base_name, scenario_compare_name))
+    if scenario_compare_name == scenario_hi:
+        diff_columns = ", ".join(f"d.{col}_DIFF" for col in DIFF_SOURCE_COLS)
     else:
-        return [64, 132, 234, 255]
+        diff_columns = ", ".join(f"0.0 - d.{col}_DIFF AS {col}_DIFF" for col in DIFF_SOURCE_COLS)
+    scenario_tables = [scenario_registry[scenario_base_name], scenario_registry[scenario_compare_name]]
+    return con.execute(f"""
+        SELECT m.A, m.B, {diff_columns}, m.* EXCLUDE (A, B)
+        FROM ({master_links_query(scenario_tables)}) AS m
+        LEFT JOIN pair_diffs AS d
+            ON d.scenario_lo = ? AND d.scenario_hi = ?
+            AND d.A = m.A AND d.B = m.B
+        ORDER BY m.link_source DESC, m.link_row
+    """, [scenario_lo, scenario_hi])
 
 
-def generate_volume_diff_plot(gdf_input, plot_column, min_abs_vol, file_name):
-    scale = 400 / gdf_input[plot_column].abs().max()
-    gdf_input["color"] = gdf_input[plot_column].apply(categorise_vol_diff)
+def link_batch_rows(link_count, wkb_bytes, memory_budget_mb):
+    # Links per record batch so that one batch, decoded and simplified, stays within the budget
+    if not link_count:
+        return MIN_LINK_BATCH_ROWS
+    link_bytes = wkb_bytes / link_count * LINK_BYTES_PER_WKB_BYTE
+    return max(MIN_LINK_BATCH_ROWS, int(memory_budget_mb * 1024 ** 2 / link_bytes))
 
-    # sort data so that small abs values get plotted first
-    gdf = gdf_input
-    gdf[plot_column + "_abs"] = gdf[plot_column].abs()
-    gdf[plot_column] = gdf[plot_column].round()
-    gdf = gdf.query(f"{plot_column}_abs >= {min_abs_vol}")
-    gdf = gdf.sort_values(plot_column + "_abs")
-    # define lonboard extensions
-    path_style_ext = PathStyleExtension(offset=True)
-    # define styles
-    line_widths = gdf[plot_column].abs().to_numpy()
-    line_colors = np.vstack(gdf["color"].values).astype(np.uint8)
-    road_layer = PathLayer.from_geopandas(
-        gdf_input[['A', 'B', 'geometry']],
+
+def link_geometry_columns():
+    return ["geometry"] + [geometry_level_column(zoom) for zoom in GEOMETRY_LEVEL_ZOOMS[:-1]]
+
+
+def query_link_geometries(con, scenario_table, memory_budget_mb=None):
+    import pyarrow as pa
+
+    # The scenario's link set: link_row and every geometry level as arrays over its filtered links. Without a
+    # budget the links arrive as one Arrow table. With one they are streamed as record batches, each decoded
+    # and simplified into the preallocated arrays before the next is fetched, so only one batch of WKB is
+    # held at a time.
+    query = f"SELECT rowid AS link_row, geometry FROM {scenario_table} WHERE {LINK_CLASS_FILTER};"
+    if memory_budget_mb is None:
+        with timed_stage("fetch_arrow"):
+            links = con.sql(query).fetch_arrow_table()
+        with timed_stage("wkb_decode"):
+            geometry = decode_link_geometry(links)
+        return {"link_row": links.column("link_row").to_numpy(), **geometry_levels(geometry)}
+
+    link_count, wkb_bytes = con.sql(
+        f"SELECT count(*), coalesce(sum(octet_length(geometry)), 0) FROM {scenario_table} WHERE {LINK_CLASS_FILTER}"
+    ).fetchone()
+    link_set = {"link_row": np.empty(link_count, dtype=np.int64)}
+    link_set.update({col: np.empty(link_count, dtype=object) for col in link_geometry_columns()})
+    # the connection runs no other query until the reader is exhausted
+    reader = con.execute(query).fetch_record_batch(link_batch_rows(link_count, wkb_bytes, memory_budget_mb))
+    batch_index = 0
+    filled = 0
+    while True:
+        with timed_stage("fetch_arrow", batch=batch_index):
+            try:
+                batch = reader.read_next_batch()
+            except StopIteration:
+                break
+        with timed_stage("wkb_decode", batch=batch_index):
+            geometry = decode_link_geometry(pa.Table.from_batches([batch]))
+        with stage_labels(batch=batch_index):
+            levels = geometry_levels(geometry)
+        rows = slice(filled, filled + len(geometry))
+        link_set["link_row"][rows] = batch.column("link_row").to_numpy()
+        for col, values in levels.items():
+            link_set[col][rows] = values
+        filled += len(geometry)
+        batch_index += 1
+    return link_set
+
+
+def geometry_level_column(zoom):
+    return "geometry" if zoom == GEOMETRY_LEVEL_ZOOMS[-1] else f"geometry_z{zoom}"
+
+
+def geometry_level_tolerance(zoom):
+    # half of a 256px tile pixel at `zoom`, in degrees
+    return 0.5 * 360 / (256 * 2 ** zoom)
+
+
+def geometry_levels(geometry):
+    import shapely
+
+    # Each link is simplified on its own and keeps its topology. A link a level leaves as it is (every link
+    # of 2 vertices) shares the full geometry's object instead of holding a copy.
+    levels = {"geometry": geometry}
+    coordinate_counts = shapely.get_num_coordinates(geometry)
+    with timed_stage("simplify"):
+        for zoom, next_zoom in zip(GEOMETRY_LEVEL_ZOOMS, GEOMETRY_LEVEL_ZOOMS[1:]):
+            simplified = shapely.simplify(geometry, geometry_level_tolerance(next_zoom), preserve_topology=True)
+            unchanged = shapely.get_num_coordinates(simplified) == coordinate_counts
+            simplified[unchanged] = geometry[unchanged]
+            levels[geometry_level_column(zoom)] = simplified
+    return levels
+
+
+def load_link_geometries(con, scenario_name, scenario_table, memory_budget_mb=None):
+    with timed_stage("link_geometries", scenario=scenario_name):
+        return query_link_geometries(con, scenario_table, memory_budget_mb)
+
+
+def load_scenario_link_geometries(con, scenario_registry, memory_budget_mb=None):
+    # Link geometries are decoded and simplified once per scenario and shared by
+    # the scenario's own maps and by every pair it takes part in.
+    return {
+        scenario_name: load_link_geometries(con, scenario_name, scenario_table, memory_budget_mb)
+        for scenario_name, scenario_table in scenario_registry.items()
+    }
+
+
+def gather_link_geometries(frame_values, link_sets):
+    import geopandas as gpd
+
+    # Geometry levels of each frame row, taken by position from the link set of the
+    # scenario its master link comes from; the shapely objects are shared, not copied
+    link_sources = frame_values.pop("link_source").to_numpy()
+    link_rows = frame_values.pop("link_row").to_numpy()
+    columns = link_geometry_columns()
+    geometries = {col: np.empty(len(frame_values), dtype=object) for col in columns}
+    for link_source, links in enumerate(link_sets):
+        rows = link_sources == link_source
+        positions = pd.Index(links["link_row"]).get_indexer(link_rows[rows])
+        for col in columns:
+            geometries[col][rows] = links[col][positions]
+    for col in columns:
+        frame_values[col] = gpd.GeoSeries(geometries[col], index=frame_values.index, crs="EPSG:4326")
+    return gpd.GeoDataFrame(frame_values, geometry="geometry", crs="EPSG:4326")
+
+
+def build_scenario_gdf(con, scenario_table, scenario_links):
+    with timed_stage("to_df"):
+        scenario_values = query_scenario_values(con, scenario_table).df()
+    with timed_stage("join"):
+        return gather_link_geometries(scenario_values, [scenario_links])
+
+
+def build_pair_gdf(con, scenario_registry, scenario_base_name, scenario_compare_name, scenario_links):
+    # The master link set and the joins run in DuckDB, only the frame's rows come back
+    with timed_stage("to_df"):
+        pair_diff = query_pair_diff(con, scenario_registry, scenario_base_name, scenario_compare_name).df()
+    with timed_stage("join"):
+        return gather_link_geometries(
+            pair_diff, [scenario_links[scenario_base_name], scenario_links[scenario_compare_name]]
+        )
+
+
+def plan_build(scenarios1, scenarios2):
+    # Stage 1 renders every scenario taking part in a pair once,
+    # stage 2 renders only the `_vs_` diff maps for each ordered pair.
+    pairs = [(scenario1, scenario2) for scenario1 in scenarios1 for scenario2 in scenarios2 if scenario1 != scenario2]
+    scenario_names = list(dict.fromkeys(scenario_name for pair in pairs for scenario_name in pair))
+    return scenario_names, pairs
+
+
+def plan_scenario_maps(scenario_name, output_dir):
+    maps = []
+    for col in VOL_COLS:
+        maps.append(MapJob("volume", col, 100, os.path.join(output_dir, f"{scenario_name}_{col}.html")))
+    for col in CAP_COLS:
+        maps.append(MapJob("network", col, 1, os.path.join(output_dir, f"{scenario_name}_{col}.html")))
+    for col in LANE_COLS:
+        maps.append(MapJob("lanes", col, 1, os.path.join(output_dir, f"{scenario_name}_{col}.html")))
+    for tp in TIME_PERIODS:
+        maps.append(MapJob("vc", tp, 100, os.path.join(output_dir, f"{scenario_name}_VC_{tp}.html")))
+        maps.append(MapJob("cspd", tp, 1, os.path.join(output_dir, f"{scenario_name}_CSPD_{tp}.html")))
+    return maps
+
+
+def plan_pair_maps(scenario_base_name, scenario_compare_name, output_dir):
+    prefix = os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}")
+    maps = []
+    for col in VOL_COLS:
+        maps.append(MapJob("volume", f"{col}_DIFF", 100, f"{prefix}_{col}_DIFF.html"))
+    for col in CAP_COLS:
+        maps.append(MapJob("network", f"{col}_DIFF", 1, f"{prefix}_{col}_DIFF.html"))
+    for col in LANE_COLS:
+        maps.append(MapJob("lanes", f"{col}_DIFF", 1, f"{prefix}_{col}_DIFF.html"))
+    return maps
+
+
+def decode_link_geometry(input_table):
+    from shapely import from_wkb
+
+    # WKB arrives as a binary Arrow column and is decoded in a single vectorized call
+    return from_wkb(input_table.column('geometry').to_numpy())
+
+
+# Colour classes: a link takes palette[i] where i is the number of breaks <= its value,
+# i.e. the same `value < break` ladder the maps have always used.
+COLOUR_CLASSES = {
+    "vol_diff": {
+        "breaks": [0],
+        "palette": [[255, 128, 0], [0, 204, 204]],
+        "absolute": False,
+    },
+    "cap_diff": {
+        "breaks": [0],
+        "palette": [[255, 56, 76], [64, 132, 234]],
+        "absolute": False,
+    },
+    "vc": {
+        "breaks": [0.6, 0.7, 0.8, 0.9, 1.0, 1.2],
+        "palette": [[26, 150, 65], [138, 204, 98], [219, 240, 158], [254, 223, 154], [245, 144, 83], [215, 25, 28],
+                    [138, 0, 5]],
+        "absolute": False,
+    },
+    "speed": {
+        "breaks": [10, 20, 30, 40, 60, 80],
+        "palette": [[0, 0, 0], [133, 11, 3], [245, 19, 2], [245, 107, 2], [245, 200, 2], [140, 245, 2],
+                    [0, 194, 45]],
+        "absolute": False,
+    },
+    "lanes": {
+        "breaks": [1, 2, 3, 4, 5, 6],
+        "palette": [[0, 0, 0, 0], [255, 56, 76, 255], [255, 145, 0, 255], [255, 210, 0, 255], [120, 163, 0, 255],
+                    [174, 105, 255, 255], [64, 132, 234, 255]],
+        "absolute": True,
+    },
+}
+
+
+def classify_colour_index(values, colour_class):
+    # NaN sorts past every break, so missing values take the last colour as before
+    table = COLOUR_CLASSES[colour_class]
+    values = np.asarray(values, dtype=np.float64)
+    if table["absolute"]:
+        values = np.abs(values)
+    return np.searchsorted(np.asarray(table["breaks"], dtype=np.float64), values, side="right").astype(np.uint8)
+
+
+def classify_colours(values, colour_class):
+    with timed_stage("colour_classification"):
+        palette = np.asarray(COLOUR_CLASSES[colour_class]["palette"], dtype=np.uint8)
+        return palette[classify_colour_index(values, colour_class)]
+
+
+def cap_capacity_values(gdf_input, plot_column):
+    # very large capacities on LINKC_AM 25/5/16 links are shown as +/-1000
+    values = gdf_input[plot_column].to_numpy(dtype=np.float64, copy=True)
+    special_links = gdf_input["LINKC_AM"].isin([25, 5, 16]).to_numpy()
+    values[special_links & (values > 9999)] = 1000
+    values[special_links & (values < -9999)] = -1000
+    return values
+
+
+def plot_width_scale(scale_numerator, widths):
+    # The largest absolute width is drawn scale_numerator wide; a column of only zeros or NaN
+    # (a self-diff, a metric with no change) keeps a scale of 1 rather than inf or NaN
+    abs_widths = np.abs(np.asarray(widths, dtype=np.float64))
+    max_width = np.max(abs_widths, where=np.isfinite(abs_widths), initial=0.0)
+    return scale_numerator / max_width if max_width > 0 else 1
+
+
+def plot_order(sort_values, keep):
+    # Positions of the rows to draw, smallest first so large values are drawn on top;
+    # NaN sorts last and ties keep the frame order
+    positions = np.flatnonzero(keep)
+    return positions[np.argsort(sort_values[positions], kind="stable")]
+
+
+def plot_layer_table(gdf_input, order, columns):
+    import geopandas as gpd
+
+    # The rows and columns a layer shows, gathered from the frame's arrays; the frame itself is never modified
+    return gpd.GeoDataFrame(
+        {
+            "A": gdf_input["A"].to_numpy()[order],
+            "B": gdf_input["B"].to_numpy()[order],
+            **columns,
+        },
+        geometry=gdf_input.geometry.values[order],
+        crs=gdf_input.crs,
+    )
+
+
+# Maps are written as head + widget snippet + tail, the VIC font style is part of the head
+MAP_HTML_HEAD = """<!DOCTYPE html>
+<html lang="en">
+<head>
+<style>
+  :root {{
+    --jp-ui-font-family: "VIC", monospace;
+  }}
+</style>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+<style>
+    html {{ height: 100%; }}
+    body {{ height: 100%; }}
+    .widget-subarea {{ height: 100%; }}
+    .jupyter-widgets-disconnected {{ height: 100%; }}
+</style>
+</head>
+<body>
+"""
+MAP_HTML_TAIL = """
+{base_network}
+</body>
+</html>
+"""
+
+# Shared base network asset: restores the grey road layer's table buffers into the
+# widget state before the widget manager renders (it waits for the page to load).
+BASE_NETWORK_ASSET_TEMPLATE = """(function () {{
+    var buffers = {buffers};
+    var script = document.currentScript;
+    var stateElement = document.querySelector('script[type="application/vnd.jupyter.widget-state+json"]');
+    var widgetState = JSON.parse(stateElement.textContent);
+    widgetState.state[script.dataset.modelId].buffers = buffers;
+    stateElement.textContent = JSON.stringify(widgetState);
+}})();
+"""
+
+
+def write_text_atomic(file_name, *parts):
+    # Parts are streamed to a temporary file that is then renamed over the output, so the
+    # dashboard and parallel workers only ever see a complete file.
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8') as f:
+            for part in parts:
+                f.write(part)
+        # mkstemp creates the file owner-only, outputs are served to others
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def write_bytes_atomic(file_name, data):
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or ".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def precompressed_variants():
+    # file suffix and compressor of each precompressed copy the dashboard can serve
+    variants = {".gz": lambda data: gzip.compress(data, compresslevel=9, mtime=0)}
+    if brotli is not None:
+        variants[".br"] = lambda data: brotli.compress(data, quality=BROTLI_QUALITY)
+    return variants
+
+
+def precompressed_digest_path(file_name):
+    return file_name + PRECOMPRESSED_DIGEST_SUFFIX
+
+
+def is_precompressed(file_name, variant_name):
+    # A variant carries the mtime of the file it was compressed from. When only the mtimes moved (e.g. a plain
+    # cp into the dashboard's assets), it is still current while the file has the digest recorded next to it.
+    digest_path = precompressed_digest_path(file_name)
+    if not (os.path.exists(variant_name) and os.path.exists(digest_path)):
+        return False
+    source_stat = os.stat(file_name)
+    if os.stat(variant_name).st_mtime_ns == source_stat.st_mtime_ns:
+        return True
+    with open(digest_path, 'r', encoding='utf-8') as f:
+        if f.read().strip() != file_sha256(file_name):
+            return False
+    os.utime(variant_name, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    return True
+
+
+def precompress_file(file_name):
+    source_stat = os.stat(file_name)
+    with open(file_name, 'rb') as f:
+        data = f.read()
+    for suffix, compress in precompressed_variants().items():
+        variant_name = file_name + suffix
+        if not is_precompressed(file_name, variant_name):
+            write_bytes_atomic(variant_name, compress(data))
+            os.utime(variant_name, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+    # the dashboard checks variants against this digest when their mtimes no longer match
+    write_text_atomic(precompressed_digest_path(file_name), hashlib.sha256(data).hexdigest())
+    return file_name
+
+
+def precompress_outputs(output_dir, workers):
+    # Subfolders are included, e.g. the vendored deck.gl of the tile viewers. zlib and brotli release the GIL,
+    # so threads compress the files in parallel
+    file_names = [
+        os.path.join(dir_path, file_name)
+        for dir_path, _, dir_file_names in sorted(os.walk(output_dir)) for file_name in sorted(dir_file_names)
+        if os.path.splitext(file_name)[1] in PRECOMPRESSED_EXTENSIONS
+        and not all(
+            is_precompressed(os.path.join(dir_path, file_name), os.path.join(dir_path, file_name) + suffix)
+            for suffix in precompressed_variants()
+        )
+    ]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(precompress_file, file_names))
+
+
+def base_network_key(road_links):
+    from shapely import to_wkb
+
+    digest = hashlib.sha1()
+    digest.update(road_links["A"].to_numpy().tobytes())
+    digest.update(road_links["B"].to_numpy().tobytes())
+    digest.update(b"".join(to_wkb(road_links.geometry.values)))
+    return digest.hexdigest()[:16]
+
+
+def path_layer_from_geopandas(gdf, **kwargs):
+    # None for a layer with no rows to draw (e.g. a metric that does not change), lonboard cannot build one
+    from lonboard import PathLayer
+
+    if len(gdf) == 0:
+        return None
+    with timed_stage("from_geopandas"):
+        return PathLayer.from_geopandas(gdf, **kwargs)
+
+
+def build_road_layer(gdf_input, file_name, shared_base_network=False):
+    import geopandas as gpd
+
+    road_geometry = geometry_level_column(ROAD_LAYER_GEOMETRY_ZOOM)
+    if road_geometry not in gdf_input:
+        road_geometry = 'geometry'
+    # in (A, B) order, so every frame over the same network (e.g. a pair and its reverse) writes the same asset
+    order = np.lexsort((gdf_input["B"].to_numpy(), gdf_input["A"].to_numpy()))
+    road_links = gpd.GeoDataFrame(
+        {"A": gdf_input["A"].to_numpy()[order], "B": gdf_input["B"].to_numpy()[order]},
+        geometry=gdf_input[road_geometry].values[order], crs=gdf_input.crs
+    )
+    base_network_asset = None
+    if shared_base_network:
+        base_network_asset = f"_BASE_NETWORK_{base_network_key(road_links)}.js"
+        if os.path.exists(os.path.join(os.path.dirname(file_name), base_network_asset)):
+            # the asset already holds this network, only serialise a placeholder row
+            road_links = road_links.iloc[:1]
+    road_layer = path_layer_from_geopandas(
+        road_links,
         width_min_pixels=0.5,
         get_color=[168, 168, 168],
         auto_highlight=False,
         pickable=False,
     )
-    diff_layer = PathLayer.from_geopandas(
-        gdf[['A', 'B', 'geometry', plot_column]],
+    return road_layer, base_network_asset
+
+
+def save_map_html(m, file_name, road_layer=None, base_network_asset=None):
+    with timed_stage("to_html") as record:
+        base_network_asset = write_map_html(m, file_name, road_layer, base_network_asset)
+        record["output_bytes"] = os.path.getsize(file_name)
+    return base_network_asset
+
+
+def write_map_html(m, file_name, road_layer=None, base_network_asset=None):
+    # Only the state of this map is embedded, see lonboard's Map.to_html. Returns the base network asset the
+    # map loads, if any
+    from ipywidgets.embed import dependency_state, embed_snippet
+
+    state = dependency_state([m], drop_defaults=False)
+    base_network = ""
+    # no road layer is drawn for a frame without links, so there is no base network to share
+    if road_layer is None:
+        base_network_asset = None
+    if base_network_asset is not None:
+        buffers = state[road_layer.model_id].pop("buffers")
+        asset_path = os.path.join(os.path.dirname(file_name), base_network_asset)
+        if not os.path.exists(asset_path):
+            write_text_atomic(asset_path, BASE_NETWORK_ASSET_TEMPLATE.format(buffers=json.dumps(buffers)))
+        base_network = f'<script src="{base_network_asset}" data-model-id="{road_layer.model_id}"></script>'
+    write_text_atomic(
+        file_name,
+        MAP_HTML_HEAD.format(title=file_name),
+        embed_snippet(views=[m], drop_defaults=False, state=state),
+        MAP_HTML_TAIL.format(base_network=base_network),
+    )
+    return base_network_asset
+
+
+def generate_volume_diff_plot(gdf_input, plot_column, min_abs_vol, file_name, shared_base_network=False):
+    from lonboard import Map, basemap
+    from lonboard.layer_extension import PathStyleExtension
+
+    values = gdf_input[plot_column].to_numpy(dtype=np.float64)
+    abs_values = np.abs(values)
+    scale = plot_width_scale(400, abs_values)
+    colours = classify_colours(values, "vol_diff")
+
+    # plot small abs values first
+    order = plot_order(abs_values, abs_values >= min_abs_vol)
+    rounded = np.round(values[order])
+    # define lonboard extensions
+    path_style_ext = PathStyleExtension(offset=True)
+    road_layer, base_network_asset = build_road_layer(gdf_input, file_name, shared_base_network)
+    diff_layer = path_layer_from_geopandas(
+        plot_layer_table(gdf_input, order, {plot_column: rounded}),
         width_min_pixels=0,
         width_max_pixels=10000,
-        get_color=line_colors,
-        get_width=line_widths,
+        get_color=colours[order],
+        get_width=np.abs(rounded),
         width_scale=scale,
         cap_rounded=True,
         extensions=[path_style_ext],
@@ -138,60 +774,38 @@ def generate_volume_diff_plot(gdf_input, plot_column, min_abs_vol, file_name):
         "latitude": -37.839289,
         "zoom": 9,
     }
-    m = Map(layers=[diff_layer, road_layer], basemap_style=basemap.CartoBasemap.DarkMatter, view_state=view_state,
+    layers = [layer for layer in (diff_layer, road_layer) if layer is not None]
+    m = Map(layers=layers, basemap_style=basemap.CartoBasemap.DarkMatter, view_state=view_state,
             show_tooltip=True, _height=900)
-    m.to_html(file_name, title=file_name)
+    base_network_asset = save_map_html(m, file_name, road_layer, base_network_asset)
     # close_all is required so that when we iteratively save the map
     # the state of `Map` doesn't get carried over to the next one
     # which would cause the saved HTML to become larger and larger.
     Map.close_all()
+    return base_network_asset
+
+
+def generate_network_diff_plot(gdf_input, plot_column, min_abs_vol, file_name, shared_base_network=False):
+    from lonboard import Map, basemap
+    from lonboard.layer_extension import PathStyleExtension
 
+    values = cap_capacity_values(gdf_input, plot_column)
+    abs_values = np.abs(values)
+    scale = plot_width_scale(350, abs_values)
+    colours = classify_colours(values, "cap_diff")
 
-def generate_network_diff_plot(gdf_input, plot_column, min_abs_vol, file_name):
-    gdf_input.loc[
-        (
-                ((gdf_input[plot_column] > 9999) & (gdf_input["LINKC_AM"] == 25)) |
-                ((gdf_input[plot_column] > 9999) & (gdf_input["LINKC_AM"] == 5)) |
-                ((gdf_input[plot_column] > 9999) & (gdf_input["LINKC_AM"] == 16))
-        ),
-        plot_column
-    ] = 1000
-    gdf_input.loc[
-        (
-                ((gdf_input[plot_column] < -9999) & (gdf_input["LINKC_AM"] == 25)) |
-                ((gdf_input[plot_column] < -9999) & (gdf_input["LINKC_AM"] == 5)) |
-                ((gdf_input[plot_column] < -9999) & (gdf_input["LINKC_AM"] == 16))
-        ),
-        plot_column
-    ] = -1000
-    scale = 350 / gdf_input[plot_column].abs().max()
-    gdf_input["color"] = gdf_input[plot_column].apply(categorise_cap_diff)
-
-    # sort data so that small abs values get plotted first
-    gdf = gdf_input
-    gdf[plot_column + "_abs"] = gdf[plot_column].abs()
-    gdf[plot_column] = gdf[plot_column].round()
-    gdf = gdf.query(f"{plot_column}_abs >= {min_abs_vol}")
-    gdf = gdf.sort_values(plot_column + "_abs")
+    # plot small abs values first
+    order = plot_order(abs_values, abs_values >= min_abs_vol)
+    rounded = np.round(values[order])
     # define lonboard extensions
     path_style_ext = PathStyleExtension(offset=True)
-    # define styles
-    line_widths = gdf[plot_column].abs().to_numpy()
-    line_widths = line_widths.astype(np.float64)
-    line_colors = np.vstack(gdf["color"].values).astype(np.uint8)
-    road_layer = PathLayer.from_geopandas(
-        gdf_input[['A', 'B', 'geometry']],
-        width_min_pixels=0.5,
-        get_color=[168, 168, 168],
-        auto_highlight=False,
-        pickable=False,
-    )
-    diff_layer = PathLayer.from_geopandas(
-        gdf[['A', 'B', 'geometry', plot_column]],
+    road_layer, base_network_asset = build_road_layer(gdf_input, file_name, shared_base_network)
+    diff_layer = path_layer_from_geopandas(
+        plot_layer_table(gdf_input, order, {plot_column: rounded}),
         width_min_pixels=0.001,
         width_max_pixels=10000,
-        get_color=line_colors,
-        get_width=line_widths,
+        get_color=colours[order],
+        get_width=np.abs(rounded),
         width_scale=scale,
         cap_rounded=True,
         extensions=[path_style_ext],
@@ -206,43 +820,41 @@ def generate_network_diff_plot(gdf_input, plot_column, min_abs_vol, file_name):
         "latitude": -37.839289,
         "zoom": 9,
     }
-    m = Map(layers=[diff_layer, road_layer], basemap_style=basemap.CartoBasemap.DarkMatter, view_state=view_state,
+    layers = [layer for layer in (diff_layer, road_layer) if layer is not None]
+    m = Map(layers=layers, basemap_style=basemap.CartoBasemap.DarkMatter, view_state=view_state,
             show_tooltip=True, _height=900)
-    m.to_html(file_name, title=file_name)
+    base_network_asset = save_map_html(m, file_name, road_layer, base_network_asset)
     # close_all is required so that when we iteratively save the map
     # the state of `Map` doesn't get carried over to the next one
     # which would cause the saved HTML to become larger and larger.
     Map.close_all()
+    return base_network_asset
 
 
-def generate_vc_plot(gdf_input, time_period, min_abs_vol, file_name):
-    scale = 400 / gdf_input[f"VEH_{time_period}"].abs().max()
-    gdf_input["color"] = gdf_input[f"VC_{time_period}"].apply(categorise_vc)
+def generate_vc_plot(gdf_input, time_period, min_abs_vol, file_name, shared_base_network=False):
+    from lonboard import Map, basemap
+    from lonboard.layer_extension import PathStyleExtension
 
-    # sort data so that small abs values get plotted first
-    gdf = gdf_input
-    gdf[f"VEH_{time_period}" + "_abs"] = gdf[f"VEH_{time_period}"].abs()
-    gdf[f"VEH_{time_period}"] = gdf[f"VEH_{time_period}"].round()
-    gdf = gdf.query(f"VEH_{time_period}_abs >= {min_abs_vol}")
-    gdf = gdf.sort_values(f"VEH_{time_period}" + "_abs")
+    volumes = gdf_input[f"VEH_{time_period}"].to_numpy(dtype=np.float64)
+    abs_volumes = np.abs(volumes)
+    scale = plot_width_scale(400, abs_volumes)
+    colours = classify_colours(gdf_input[f"VC_{time_period}"], "vc")
+
+    # plot small abs values first
+    order = plot_order(abs_volumes, abs_volumes >= min_abs_vol)
+    rounded_volumes = np.round(volumes[order])
     # define lonboard extensions
     path_style_ext = PathStyleExtension(offset=True)
-    # define styles
-    line_widths = gdf[f"VEH_{time_period}"].abs().to_numpy()
-    line_colors = np.vstack(gdf["color"].values).astype(np.uint8)
-    road_layer = PathLayer.from_geopandas(
-        gdf_input[['A', 'B', 'geometry']],
-        width_min_pixels=0.5,
-        get_color=[168, 168, 168],
-        auto_highlight=False,
-        pickable=False,
-    )
-    vc_layer = PathLayer.from_geopandas(
-        gdf[['A', 'B', 'geometry', f"VC_{time_period}", f"VEH_{time_period}"]],
+    road_layer, base_network_asset = build_road_layer(gdf_input, file_name, shared_base_network)
+    vc_layer = path_layer_from_geopandas(
+        plot_layer_table(gdf_input, order, {
+            f"VC_{time_period}": gdf_input[f"VC_{time_period}"].to_numpy()[order],
+            f"VEH_{time_period}": rounded_volumes,
+        }),
         width_min_pixels=0,
         width_max_pixels=10000,
-        get_color=line_colors,
-        get_width=line_widths,
+        get_color=colours[order],
+        get_width=np.abs(rounded_volumes),
         width_scale=scale,
         cap_rounded=True,
         extensions=[path_style_ext],
@@ -256,42 +868,35 @@ def generate_vc_plot(gdf_input, time_period, min_abs_vol, file_name):
         "latitude": -37.839289,
         "zoom": 9,
     }
-    m = Map(layers=[vc_layer, road_layer], basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
+    layers = [layer for layer in (vc_layer, road_layer) if layer is not None]
+    m = Map(layers=layers, basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
             show_tooltip=True, _height=900)
-    m.to_html(file_name, title=file_name)
+    base_network_asset = save_map_html(m, file_name, road_layer, base_network_asset)
     # close_all is required so that when we iteratively save the map
     # the state of `Map` doesn't get carried over to the next one
     # which would cause the saved HTML to become larger and larger.
     Map.close_all()
+    return base_network_asset
+
+
+def generate_cspd_plot(gdf_input, time_period, min_abs_vol, file_name, shared_base_network=False):
+    from lonboard import Map, basemap
+    from lonboard.layer_extension import PathStyleExtension
 
+    speeds = gdf_input[f"CSPD_{time_period}"].to_numpy(dtype=np.float64)
+    colours = classify_colours(speeds, "speed")
 
-def generate_cspd_plot(gdf_input, time_period, min_abs_vol, file_name):
-    gdf_input["color"] = gdf_input[f"CSPD_{time_period}"].apply(categorise_speed)
-    gdf_input["width"] = 15
-    # sort data so that small abs values get plotted first
-    gdf = gdf_input
-    gdf[f"CSPD_{time_period}" + "_abs"] = gdf[f"CSPD_{time_period}"].abs()
-    gdf[f"CSPD_{time_period}"] = gdf[f"CSPD_{time_period}"].round()
-    gdf = gdf.sort_values(f"CSPD_{time_period}" + "_abs")
-    gdf = gdf.query(f"VEH_{time_period}_abs >= {min_abs_vol}")
+    # plot small abs values first
+    order = plot_order(np.abs(speeds), np.abs(gdf_input[f"VEH_{time_period}"].to_numpy()) >= min_abs_vol)
     # define lonboard extensions
     path_style_ext = PathStyleExtension(offset=True)
-    # define styles
-    line_widths = gdf["width"].abs().to_numpy()
-    line_colors = np.vstack(gdf["color"].values).astype(np.uint8)
-    road_layer = PathLayer.from_geopandas(
-        gdf_input[['A', 'B', 'geometry']],
-        width_min_pixels=0.5,
-        get_color=[168, 168, 168],
-        auto_highlight=False,
-        pickable=False,
-    )
-    cspd_layer = PathLayer.from_geopandas(
-        gdf[['A', 'B', 'geometry', f"CSPD_{time_period}"]],
+    road_layer, base_network_asset = build_road_layer(gdf_input, file_name, shared_base_network)
+    cspd_layer = path_layer_from_geopandas(
+        plot_layer_table(gdf_input, order, {f"CSPD_{time_period}": np.round(speeds[order])}),
         width_min_pixels=2,
         width_max_pixels=8,
-        get_color=line_colors,
-        get_width=line_widths,
+        get_color=colours[order],
+        get_width=15,
         # width_scale=line_widths,
         cap_rounded=True,
         extensions=[path_style_ext],
@@ -305,42 +910,36 @@ def generate_cspd_plot(gdf_input, time_period, min_abs_vol, file_name):
         "latitude": -37.839289,
         "zoom": 9,
     }
-    m = Map(layers=[cspd_layer, road_layer], basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
+    layers = [layer for layer in (cspd_layer, road_layer) if layer is not None]
+    m = Map(layers=layers, basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
             show_tooltip=True, _height=900)
-    m.to_html(file_name, title=file_name)
+    base_network_asset = save_map_html(m, file_name, road_layer, base_network_asset)
     # close_all is required so that when we iteratively save the map
     # the state of `Map` doesn't get carried over to the next one
     # which would cause the saved HTML to become larger and larger.
     Map.close_all()
+    return base_network_asset
+
 
+def generate_nlanes_plot(gdf_input, plot_col, min_abs_vol, file_name, shared_base_network=False):
+    from lonboard import Map, basemap
+    from lonboard.layer_extension import PathStyleExtension
 
-def generate_nlanes_plot(gdf_input, plot_col, min_abs_vol, file_name):
-    gdf_input[plot_col + "_abs"] = gdf_input[plot_col].abs()
-    gdf_input["color"] = gdf_input[plot_col + "_abs"].apply(categorise_lanes)
-    gdf_input["width"] = 15
-    # sort data so that small abs values get plotted first
-    gdf = gdf_input
-    gdf[plot_col] = gdf[plot_col].round()
-    gdf = gdf.sort_values(plot_col + "_abs")
-    gdf = gdf.query(f"{plot_col}_abs >= {min_abs_vol}")
+    lanes = gdf_input[plot_col].to_numpy(dtype=np.float64)
+    abs_lanes = np.abs(lanes)
+    colours = classify_colours(abs_lanes, "lanes")
+
+    # plot small abs values first
+    order = plot_order(abs_lanes, abs_lanes >= min_abs_vol)
     # define lonboard extensions
     path_style_ext = PathStyleExtension(offset=True)
-    # define styles
-    line_widths = gdf["width"].abs().to_numpy()
-    line_colors = np.vstack(gdf["color"].values).astype(np.uint8)
-    road_layer = PathLayer.from_geopandas(
-        gdf_input[['A', 'B', 'geometry']],
-        width_min_pixels=0.5,
-        get_color=[168, 168, 168],
-        auto_highlight=False,
-        pickable=False,
-    )
-    lanes_layer = PathLayer.from_geopandas(
-        gdf[['A', 'B', 'geometry', plot_col]],
+    road_layer, base_network_asset = build_road_layer(gdf_input, file_name, shared_base_network)
+    lanes_layer = path_layer_from_geopandas(
+        plot_layer_table(gdf_input, order, {plot_col: np.round(lanes[order])}),
         width_min_pixels=2,
         width_max_pixels=8,
-        get_color=line_colors,
-        get_width=line_widths,
+        get_color=colours[order],
+        get_width=15,
         # width_scale=line_widths,
         cap_rounded=True,
         extensions=[path_style_ext],
@@ -354,32 +953,94 @@ def generate_nlanes_plot(gdf_input, plot_col, min_abs_vol, file_name):
         "latitude": -37.839289,
         "zoom": 9,
     }
-    m = Map(layers=[lanes_layer, road_layer], basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
+    layers = [layer for layer in (lanes_layer, road_layer) if layer is not None]
+    m = Map(layers=layers, basemap_style=basemap.CartoBasemap.Positron, view_state=view_state,
             show_tooltip=True, _height=900)
-    m.to_html(file_name, title=file_name)
+    base_network_asset = save_map_html(m, file_name, road_layer, base_network_asset)
     # close_all is required so that when we iteratively save the map
     # the state of `Map` doesn't get carried over to the next one
     # which would cause the saved HTML to become larger and larger.
     Map.close_all()
+    return base_network_asset
 
 
-def insert_jp_ui_font_family(html_file_path):
-    style_block = """
-<style>
-  :root {
-    --jp-ui-font-family: "VIC", monospace;
-  }
-</style>
-"""
-    with open(html_file_path, 'r', encoding='utf-8') as f:
-        html = f.read()
+PLOT_FUNCTIONS = {
+    "volume": generate_volume_diff_plot,
+    "network": generate_network_diff_plot,
+    "vc": generate_vc_plot,
+    "cspd": generate_cspd_plot,
+    "lanes": generate_nlanes_plot,
+}
+
+
+def render_map(gdf_input, job, shared_base_network=False):
+    # plot functions only read the frame, so every map of a frame is rendered from the same one;
+    # returns the base network asset the map loads, if any
+    with timed_stage("map", map=os.path.basename(job.file_name)) as record:
+        base_network_asset = PLOT_FUNCTIONS[job.plot_type](
+            gdf_input, job.plot_column, job.min_abs_vol, job.file_name, shared_base_network
+        )
+        record["output_bytes"] = os.path.getsize(job.file_name)
+    return base_network_asset
+
+
+def render_maps(gdf_input, maps, shared_base_network=False):
+    # yields the file name and base network asset of each map once it is written
+    for job in maps:
+        yield job.file_name, render_map(gdf_input, job, shared_base_network)
+
+
+def prepare_frame(gdf_input, prepared_path):
+    # prepared frames are handed to render workers as Arrow files rather than pickles
+    gdf_input.to_feather(prepared_path)
+    return prepared_path
+
+
+@functools.lru_cache(maxsize=2)
+def load_prepared_frame(prepared_path):
+    import geopandas as gpd
+
+    return gpd.read_feather(prepared_path)
+
+
+def render_prepared_maps(prepared_path, maps, shared_base_network=False):
+    # the worker's stage records travel back with the file names and base network assets
+    first_record = len(STAGE_RECORDS)
+    frame_name = os.path.splitext(os.path.basename(prepared_path))[0]
+    with stage_labels(frame=frame_name):
+        rendered = list(render_maps(load_prepared_frame(prepared_path), maps, shared_base_network))
+    return rendered, take_stage_records(first_record)
+
+
+def render_pool(workers, initializer=None):
+    # spawned workers each hold their own lonboard state; initializer runs once in each of them
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn"), initializer=initializer
+    )
+
+
+def submit_prepared_maps(executor, render_futures, prepared_path, maps, shared_base_network=False, chunksize=4):
+    # Consecutive maps share a prepared frame, so each chunk of them is rendered by the one worker that
+    # loads the frame. render_futures maps every pending chunk to its prepared frame.
+    for start in range(0, len(maps), chunksize):
+        future = executor.submit(render_prepared_maps, prepared_path, maps[start:start + chunksize], shared_base_network)
+        render_futures[future] = prepared_path
 
-    if '<head>' in html:
-        # Insert style block right after <head>
-        new_html = html.replace('<head>', f'<head>{style_block}')
-    else:
-        # If no <head>, add style block at start
-        new_html = style_block + html
 
-    with open(html_file_path, 'w', encoding='utf-8') as f:
-        f.write(new_html)
+def collect_rendered_maps(render_futures, max_pending_frames=None):
+    # Yields the file name and base network asset of each rendered map and deletes each prepared frame once
+    # all of its maps are rendered. Waits until at most max_pending_frames frames have maps left to render;
+    # None only collects the chunks that have finished already.
+    while True:
+        finished = [future for future in render_futures if future.done()]
+        if not finished:
+            if max_pending_frames is None or len(set(render_futures.values())) <= max_pending_frames:
+                return
+            finished = [next(as_completed(render_futures))]
+        for future in finished:
+            prepared_path = render_futures.pop(future)
+            rendered, records = future.result()
+            STAGE_RECORDS.extend(records)
+            yield from rendered
+            if prepared_path not in render_futures.values():
+                os.remove(prepared_path)
@@ -0,0 +1,152 @@
+import os
+import functools
+import hashlib
+import json
+
+import Generate_Network_HTML_functions
+import Generate_Network_HTML_bundles
+import Generate_Network_HTML_tiles
+from Generate_Network_HTML_functions import COLOUR_CLASSES, file_sha256, scenario_source_files, write_text_atomic
+from Generate_Network_HTML_bundles import BUNDLE_LAYER_STYLES
+from Generate_Network_HTML_tiles import TILE_MIN_ZOOM, TILE_MAX_ZOOM
+
+MANIFEST_NAME = "_BUILD_MANIFEST.json"
+
+
+def scenario_source_hashes(shp_path, recorded=None):
+    # A source with the mtime and size recorded for it in the scenario cache (recorded_scenario_sources) is
+    # not hashed again; recorded maps an extension to its (mtime_ns, size, sha256)
+    recorded = recorded or {}
+    hashes = {}
+    for extension, file_name in scenario_source_files(shp_path).items():
+        stat = os.stat(file_name)
+        mtime_ns, size, sha256 = recorded.get(extension, (None, None, None))
+        if (stat.st_mtime_ns, stat.st_size) == (mtime_ns, size):
+            hashes[extension] = sha256
+        else:
+            hashes[extension] = file_sha256(file_name)
+    return hashes
+
+
+@functools.lru_cache(maxsize=None)
+def code_version():
+    # any change to the generating code invalidates every output
+    digest = hashlib.sha256()
+    for module in (Generate_Network_HTML_functions, Generate_Network_HTML_bundles, Generate_Network_HTML_tiles):
+        with open(module.__file__, 'rb') as f:
+            digest.update(f.read())
+    return digest.hexdigest()
+
+
+def map_style(job, shared_base_network):
+    style = BUNDLE_LAYER_STYLES[job.plot_type]
+    return {
+        "plot_type": job.plot_type,
+        "plot_column": job.plot_column,
+        "min_abs_vol": job.min_abs_vol,
+        "scale": style["scale_numerator"],
+        "palette": COLOUR_CLASSES[style["colour_class"]],
+        "shared_base_network": shared_base_network,
+    }
+
+
+def map_inputs(job, sources, shared_base_network=False):
+    return {
+        "sources": sources,
+        "style": map_style(job, shared_base_network),
+        "code_version": code_version(),
+    }
+
+
+def bundle_inputs(maps, sources):
+    return {
+        "sources": sources,
+        "style": [map_style(job, False) for job in maps],
+        "code_version": code_version(),
+    }
+
+
+def tiles_inputs(maps, sources):
+    return {
+        "sources": sources,
+        "style": [map_style(job, False) for job in maps],
+        "zooms": [TILE_MIN_ZOOM, TILE_MAX_ZOOM],
+        "code_version": code_version(),
+    }
+
+
+def load_build_manifest(output_dir):
+    manifest_path = os.path.join(output_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_build_manifest(output_dir, manifest):
+    write_text_atomic(os.path.join(output_dir, MANIFEST_NAME), json.dumps(manifest, indent=1, sort_keys=True))
+
+
+def output_assets(entry):
+    # the assets an output loads: a map's base network asset, a bundle's geometry levels
+    assets = list(entry.get("assets", []))
+    if entry.get("base_network_asset") is not None:
+        assets.append(entry["base_network_asset"])
+    return assets
+
+
+def is_up_to_date(manifest, file_name, inputs, damaged_assets=()):
+    # round-trip through JSON so tuples and lists compare the way they are stored; an output is also stale
+    # while an asset it loads is damaged
+    entry = dict(manifest.get(os.path.basename(file_name)) or {})
+    assets = output_assets(entry)
+    entry.pop("base_network_asset", None)
+    entry.pop("assets", None)
+    return (
+        os.path.exists(file_name) and entry == json.loads(json.dumps(inputs))
+        and not any(asset_name in damaged_assets for asset_name in assets)
+    )
+
+
+def record_output(manifest, file_name, inputs, base_network_asset=None, assets=()):
+    # assets: paths of the files the output loads besides the base network asset
+    entry = json.loads(json.dumps(inputs))
+    if base_network_asset is not None:
+        entry["base_network_asset"] = base_network_asset
+        record_asset(manifest, os.path.join(os.path.dirname(file_name), base_network_asset))
+    if assets:
+        entry["assets"] = [os.path.basename(asset_path) for asset_path in assets]
+        for asset_path in assets:
+            record_asset(manifest, asset_path)
+    manifest[os.path.basename(file_name)] = entry
+
+
+def record_asset(manifest, asset_path):
+    # Shared assets are recorded with their content hash, hashed again only when their mtime or size moved
+    stat = os.stat(asset_path)
+    entry = manifest.get(os.path.basename(asset_path))
+    if entry is not None and (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+        return
+    manifest[os.path.basename(asset_path)] = {
+        "mtime_ns": stat.st_mtime_ns, "size": stat.st_size, "sha256": file_sha256(asset_path)
+    }
+
+
+def damaged_assets(manifest, output_dir):
+    # The assets the recorded outputs load that are missing or no longer hold the recorded content
+    damaged = set()
+    assets = {asset_name for entry in manifest.values() for asset_name in output_assets(entry)}
+    for asset_name in assets:
+        asset_path = os.path.join(output_dir, asset_name)
+        entry = manifest.get(asset_name)
+        if entry is None or not os.path.exists(asset_path):
+            damaged.add(asset_name)
+            continue
+        stat = os.stat(asset_path)
+        if (entry["mtime_ns"], entry["size"]) == (stat.st_mtime_ns, stat.st_size):
+            continue
+        if stat.st_size != entry["size"] or file_sha256(asset_path) != entry["sha256"]:
+            damaged.add(asset_name)
+            continue
+        entry["mtime_ns"] = stat.st_mtime_ns
+    return damaged
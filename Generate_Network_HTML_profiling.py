@@ -0,0 +1,156 @@
+import os
+import sys
+import csv
+import json
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    # not available on Windows, where psutil is used if installed
+    resource = None
+
+# Every timed stage of this process, in the order the stages finished
+STAGE_RECORDS = []
+# Labels (scenario, pair, map, ...) of the stages currently running, inherited by nested stages
+_ACTIVE_LABELS = [{}]
+# Linux keeps the peak RSS since it was last reset through clear_refs (VmHWM in /proc/self/status),
+# which gives each stage its own peak. Resetting it also resets ru_maxrss, so the process peak is kept here.
+PROC_STATUS = "/proc/self/status"
+PROC_CLEAR_REFS = "/proc/self/clear_refs"
+# running peak RSS in MB of each stage being measured, innermost last
+_STAGE_PEAKS = []
+_PROCESS_PEAK_MB = [0.0]
+
+
+def proc_status_mb(*fields):
+    # the given kB fields of /proc/self/status in MB, None where it cannot be read
+    try:
+        with open(PROC_STATUS, 'r', encoding='ascii') as f:
+            values = {line.split(":")[0]: line.split()[1] for line in f if line.startswith(fields)}
+        return [int(values[field]) / 1024 for field in fields]
+    except (OSError, KeyError, IndexError, ValueError):
+        return None
+
+
+def reset_peak_rss():
+    # False where the peak cannot be reset (not Linux, or /proc not writable)
+    try:
+        with open(PROC_CLEAR_REFS, 'w', encoding='ascii') as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def current_rss_mb():
+    status = proc_status_mb("VmRSS")
+    if status is not None:
+        return status[0]
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss / 1024 ** 2
+    except ImportError:
+        return None
+
+
+def fold_peak_rss():
+    # Adds the peak since the last reset to the measured stages and the process peak, then resets it;
+    # False where per-stage peaks cannot be measured
+    status = proc_status_mb("VmHWM")
+    if status is None or not reset_peak_rss():
+        return False
+    _PROCESS_PEAK_MB[0] = max(_PROCESS_PEAK_MB[0], status[0])
+    for i, peak in enumerate(_STAGE_PEAKS):
+        _STAGE_PEAKS[i] = max(peak, status[0])
+    return True
+
+
+def peak_rss_mb():
+    # High-water mark of this process' resident memory so far, None where it cannot be read
+    status = proc_status_mb("VmHWM")
+    if status is not None:
+        return max(_PROCESS_PEAK_MB[0], status[0])
+    if resource is not None:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        # ru_maxrss is in bytes on macOS and in KiB elsewhere
+        return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+    try:
+        import psutil
+        return psutil.Process().memory_info().peak_wset / 1024 ** 2
+    except (ImportError, AttributeError):
+        return None
+
+
+@contextmanager
+def timed_stage(stage, **labels):
+    # Records wall time and memory of the block; the block may set record["output_bytes"].
+    # peak_rss_mb is the highest RSS during the block itself (None where it cannot be measured),
+    # rss_delta_mb the RSS it left behind and process_peak_rss_mb the process' high-water mark so far.
+    record = {"stage": stage, **_ACTIVE_LABELS[-1], **labels}
+    _ACTIVE_LABELS.append({key: value for key, value in record.items() if key != "stage"})
+    measure_peak = fold_peak_rss()
+    start_rss = current_rss_mb()
+    if measure_peak:
+        _STAGE_PEAKS.append(start_rss)
+    start = time.perf_counter()
+    try:
+        yield record
+    finally:
+        record["seconds"] = time.perf_counter() - start
+        if measure_peak:
+            fold_peak_rss()
+            record["peak_rss_mb"] = _STAGE_PEAKS.pop()
+        else:
+            record["peak_rss_mb"] = None
+        end_rss = current_rss_mb()
+        record["rss_delta_mb"] = end_rss - start_rss if None not in (start_rss, end_rss) else None
+        record["process_peak_rss_mb"] = peak_rss_mb()
+        _ACTIVE_LABELS.pop()
+        STAGE_RECORDS.append(record)
+
+
+@contextmanager
+def stage_labels(**labels):
+    # labels for the stages inside the block, without timing the block itself
+    _ACTIVE_LABELS.append({**_ACTIVE_LABELS[-1], **labels})
+    try:
+        yield
+    finally:
+        _ACTIVE_LABELS.pop()
+
+
+def take_stage_records(start=0):
+    # removes and returns the records since `start`, used to send a worker's records back
+    records = STAGE_RECORDS[start:]
+    del STAGE_RECORDS[start:]
+    return records
+
+
+def summarise_stages(records):
+    summary = {}
+    for record in records:
+        stage = summary.setdefault(record["stage"], {"count": 0, "seconds": 0.0, "output_bytes": 0})
+        stage["count"] += 1
+        stage["seconds"] += record["seconds"]
+        stage["output_bytes"] += record.get("output_bytes", 0)
+        if record["peak_rss_mb"] is not None:
+            stage["peak_rss_mb"] = max(stage.get("peak_rss_mb", 0), record["peak_rss_mb"])
+        if record.get("rss_delta_mb") is not None:
+            stage["rss_delta_mb"] = stage.get("rss_delta_mb", 0) + record["rss_delta_mb"]
+    return summary
+
+
+def write_run_report(report_dir, records):
+    # One JSON (per-stage summary and every record) and one CSV (every record) per run
+    os.makedirs(report_dir, exist_ok=True)
+    report_name = os.path.join(report_dir, f"_RUN_REPORT_{time.strftime('%Y%m%d_%H%M%S')}")
+    with open(report_name + ".json", 'w', encoding='utf-8') as f:
+        json.dump({"summary": summarise_stages(records), "stages": records}, f, indent=1)
+    fields = list(dict.fromkeys(field for record in records for field in record))
+    with open(report_name + ".csv", 'w', encoding='utf-8', newline='') as f:
+        writer = csv.DictWriter(f, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(records)
+    return report_name + ".json"
@@ -0,0 +1,337 @@
+import os
+import gzip
+import json
+import sqlite3
+import tempfile
+from urllib.error import URLError
+from urllib.request import urlopen
+import numpy as np
+import pandas as pd
+from shapely import to_wkb
+
+from Generate_Network_HTML_functions import (
+    COLOUR_CLASSES, GEOMETRY_LEVEL_ZOOMS, geometry_level_column, write_bytes_atomic, write_text_atomic
+)
+from Generate_Network_HTML_bundles import DARK_MATTER_STYLE, POSITRON_STYLE, bundle_layer
+
+TILE_MIN_ZOOM = 8
+TILE_MAX_ZOOM = 14
+TILE_EXTENT = 4096
+TILE_BUFFER = 64
+TILE_LAYER_NAME = "links"
+# half the width of the web mercator world in metres
+MERCATOR_HALF_WIDTH = 20037508.342789244
+# Tiles are viewed without a basemap, which would need an external tile server;
+# the background takes the colour of the basemap the other maps use.
+TILE_BACKGROUNDS = {DARK_MATTER_STYLE: "#0e0e0e", POSITRON_STYLE: "#fafaf8"}
+# The viewers load deck.gl from a copy next to them (write_vendor_deck_gl), so they need no CDN.
+# The same release line as the bundles' deck.gl.
+DECK_GL_URL = "https://unpkg.com/deck.gl@9.0/dist.min.js"
+DECK_GL_VENDOR_PATH = "_VENDOR/deck.gl.min.js"
+
+TILE_VIEWER_TEMPLATE = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <title>{title}</title>
+    <script src="{deck_gl_path}"></script>
+<style>
+    html, body, #map {{ height: 100%; width: 100%; margin: 0; padding: 0; }}
+</style>
+</head>
+<body>
+<div id="map"></div>
+<script type="application/json" id="viewer-data">{viewer_data}</script>
+<script>
+{viewer_script}
+</script>
+</body>
+</html>
+"""
+
+# Same layer switching as the bundles (the URL fragment, e.g. `#VEH_AM`), but links come from
+# the dashboard's tile route and are classified into colours as their tiles arrive.
+TILE_VIEWER_SCRIPT = """(function () {
+    var viewer = JSON.parse(document.getElementById('viewer-data').textContent);
+    if (!window.deck) {
+        document.getElementById('map').textContent =
+            viewer.deck_gl_path + ' is missing: copy the _VENDOR folder of the map outputs next to this viewer.';
+        return;
+    }
+
+    function activeKey() {
+        var key = decodeURIComponent(window.location.hash.slice(1));
+        return viewer.layers[key] ? key : viewer.default_layer;
+    }
+
+    function colourIndex(value, colourClass) {
+        // missing values take the last colour, as in classify_colour_index
+        if (value === undefined || value === null || isNaN(value)) {
+            return colourClass.breaks.length;
+        }
+        if (colourClass.absolute) {
+            value = Math.abs(value);
+        }
+        var index = 0;
+        while (index < colourClass.breaks.length && value >= colourClass.breaks[index]) {
+            index++;
+        }
+        return index;
+    }
+
+    function buildLayers(key) {
+        var spec = viewer.layers[key];
+        var colourClass = viewer.colour_classes[spec.colour_class];
+        var palette = colourClass.palette.map(function (colour) {
+            return colour.length === 4 ? colour : colour.concat([255]);
+        });
+
+        function isVisible(properties) {
+            return Math.abs(properties[spec.filter]) >= spec.min_abs;
+        }
+
+        var valueLayer = new deck.MVTLayer({
+            id: 'values',
+            data: viewer.tiles_url,
+            minZoom: viewer.min_zoom,
+            maxZoom: viewer.max_zoom,
+            getLineColor: function (feature) {
+                var properties = feature.properties;
+                return isVisible(properties) ? palette[colourIndex(properties[spec.colour], colourClass)] : [0, 0, 0, 0];
+            },
+            getLineWidth: function (feature) {
+                var properties = feature.properties;
+                if (!isVisible(properties)) {
+                    return 0;
+                }
+                return typeof spec.width === 'string' ? Math.abs(properties[spec.width]) : spec.width;
+            },
+            updateTriggers: {getLineColor: key, getLineWidth: key},
+            lineWidthScale: spec.width_scale,
+            lineWidthMinPixels: spec.width_min_pixels,
+            lineWidthMaxPixels: spec.width_max_pixels,
+            lineWidthUnits: spec.width_units,
+            lineCapRounded: true,
+            autoHighlight: true,
+            pickable: true,
+            opacity: 0.85
+        });
+        var roadLayer = new deck.MVTLayer({
+            id: 'road',
+            data: viewer.tiles_url,
+            minZoom: viewer.min_zoom,
+            maxZoom: viewer.max_zoom,
+            getLineColor: [168, 168, 168],
+            lineWidthMinPixels: 0.5,
+            pickable: false
+        });
+        return [valueLayer, roadLayer];
+    }
+
+    function tooltip(info) {
+        if (!info.object || info.layer === null || info.layer.id.indexOf('values') !== 0) {
+            return null;
+        }
+        var spec = viewer.layers[activeKey()];
+        var properties = info.object.properties;
+        var value = properties[spec.value];
+        return 'A: ' + properties.A + '\\nB: ' + properties.B + '\\n' + spec.value + ': ' +
+            (value === undefined || isNaN(value) ? '' : Math.round(value * 100) / 100);
+    }
+
+    var container = document.getElementById('map');
+    var key = activeKey();
+    container.style.background = viewer.layers[key].background;
+    var deckgl = new deck.DeckGL({
+        container: container,
+        initialViewState: viewer.view_state,
+        controller: true,
+        getTooltip: tooltip,
+        layers: buildLayers(key)
+    });
+
+    window.addEventListener('hashchange', function () {
+        key = activeKey();
+        container.style.background = viewer.layers[key].background;
+        deckgl.setProps({layers: buildLayers(key)});
+    });
+})();
+"""
+
+
+def tile_zoom_geometry_column(zoom):
+    # the geometry level simplified for this zoom
+    return geometry_level_column(max(level_zoom for level_zoom in GEOMETRY_LEVEL_ZOOMS if level_zoom <= zoom))
+
+
+def register_tile_links(con, gdf_input, columns):
+    # Tile properties are the map columns as FLOAT, geometry levels are reprojected to web mercator
+    tile_frame = pd.DataFrame({
+        "A": gdf_input["A"].to_numpy(dtype=np.int64),
+        "B": gdf_input["B"].to_numpy(dtype=np.int64),
+        **columns,
+    })
+    geometry_columns = sorted({tile_zoom_geometry_column(zoom) for zoom in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1)})
+    for geometry_column in geometry_columns:
+        if geometry_column not in gdf_input:
+            geometry_column_values = gdf_input.geometry.values
+        else:
+            geometry_column_values = gdf_input[geometry_column].values
+        tile_frame[geometry_column] = to_wkb(geometry_column_values)
+    con.register("tile_frame", tile_frame)
+    con.sql(f"""
+        CREATE OR REPLACE TEMP TABLE tile_links AS
+        SELECT
+            A, B,
+            {", ".join(f'CAST("{name}" AS FLOAT) AS "{name}"' for name in columns)},
+            {", ".join(
+                f"ST_Transform(ST_GeomFromWKB({col}), 'EPSG:4326', 'EPSG:3857', always_xy := true) AS {col}"
+                for col in geometry_columns
+            )}
+        FROM tile_frame
+    """)
+    con.unregister("tile_frame")
+
+
+def query_zoom_tiles(con, zoom, property_names):
+    # Each link is assigned to every tile its bounding box overlaps, the tiles of a zoom
+    # are then encoded together, one MVT blob per tile.
+    tile_size = 2 * MERCATOR_HALF_WIDTH / 2 ** zoom
+    properties = ", ".join(f"'{name}': \"{name}\"" for name in ["A", "B"] + property_names)
+    return con.sql(f"""
+        WITH link_columns AS (
+            SELECT *, CAST(unnest(range(
+                CAST(floor((ST_XMin(geom) + {MERCATOR_HALF_WIDTH}) / {tile_size}) AS INTEGER),
+                CAST(floor((ST_XMax(geom) + {MERCATOR_HALF_WIDTH}) / {tile_size}) AS INTEGER) + 1
+            )) AS INTEGER) AS tile_x
+            FROM (SELECT *, {tile_zoom_geometry_column(zoom)} AS geom FROM tile_links)
+        ), link_tiles AS (
+            SELECT *, CAST(unnest(range(
+                CAST(floor(({MERCATOR_HALF_WIDTH} - ST_YMax(geom)) / {tile_size}) AS INTEGER),
+                CAST(floor(({MERCATOR_HALF_WIDTH} - ST_YMin(geom)) / {tile_size}) AS INTEGER) + 1
+            )) AS INTEGER) AS tile_y
+            FROM link_columns
+        )
+        SELECT
+            tile_x, tile_y,
+            ST_AsMVT({{
+                'geometry': ST_AsMVTGeom(
+                    geom, ST_Extent(ST_TileEnvelope({zoom}, tile_x, tile_y)), {TILE_EXTENT}, {TILE_BUFFER}, true
+                ),
+                {properties}
+            }}, '{TILE_LAYER_NAME}', {TILE_EXTENT}, 'geometry') AS tile_data
+        FROM link_tiles
+        WHERE ST_Intersects(geom, ST_TileEnvelope({zoom}, tile_x, tile_y))
+        GROUP BY tile_x, tile_y
+    """).fetchall()
+
+
+def write_mbtiles(file_name, metadata, tiles):
+    # Written to a temporary database that is renamed over the output, like write_text_atomic
+    fd, temp_name = tempfile.mkstemp(dir=os.path.dirname(file_name) or ".", suffix=".tmp")
+    os.close(fd)
+    try:
+        db = sqlite3.connect(temp_name)
+        db.executescript("""
+            CREATE TABLE metadata (name TEXT, value TEXT);
+            CREATE TABLE tiles (zoom_level INTEGER, tile_column INTEGER, tile_row INTEGER, tile_data BLOB);
+            CREATE UNIQUE INDEX tile_index ON tiles (zoom_level, tile_column, tile_row);
+        """)
+        db.executemany("INSERT INTO metadata VALUES (?, ?)", metadata.items())
+        db.executemany("INSERT INTO tiles VALUES (?, ?, ?, ?)", tiles)
+        db.commit()
+        db.close()
+        os.chmod(temp_name, 0o644)
+        os.replace(temp_name, file_name)
+    except BaseException:
+        os.remove(temp_name)
+        raise
+
+
+def generate_map_tiles(con, gdf_input, maps, tiles_path, viewer_path):
+    # An MBTiles file of gzipped MVT tiles with the columns of every map in `maps`,
+    # and a viewer HTML loading them from the dashboard's /tiles route
+    columns = {}
+    layers = {}
+    for job in maps:
+        key, layer = bundle_layer(gdf_input, job, columns)
+        del layer["colour_index"]
+        layer["background"] = TILE_BACKGROUNDS[layer["basemap"]]
+        layers[key] = layer
+
+    register_tile_links(con, gdf_input, columns)
+    tiles = []
+    for zoom in range(TILE_MIN_ZOOM, TILE_MAX_ZOOM + 1):
+        for tile_x, tile_y, tile_data in query_zoom_tiles(con, zoom, list(columns)):
+            # MBTiles rows count from the bottom of the world (TMS)
+            tiles.append((zoom, tile_x, 2 ** zoom - 1 - tile_y, gzip.compress(tile_data)))
+    con.sql("DROP TABLE tile_links")
+
+    min_x, min_y, max_x, max_y = gdf_input.total_bounds
+    tile_name = os.path.splitext(os.path.basename(tiles_path))[0]
+    write_mbtiles(tiles_path, {
+        "name": tile_name,
+        "format": "pbf",
+        "minzoom": str(TILE_MIN_ZOOM),
+        "maxzoom": str(TILE_MAX_ZOOM),
+        "bounds": f"{min_x},{min_y},{max_x},{max_y}",
+        "center": f"144.935032,-37.839289,{TILE_MIN_ZOOM}",
+        "json": json.dumps({"vector_layers": [{
+            "id": TILE_LAYER_NAME,
+            "fields": {name: "Number" for name in ["A", "B"] + list(columns)},
+        }]}),
+    }, tiles)
+
+    viewer = {
+        "tiles_url": f"/tiles/{tile_name}/{{z}}/{{x}}/{{y}}.pbf",
+        "min_zoom": TILE_MIN_ZOOM,
+        "max_zoom": TILE_MAX_ZOOM,
+        "colour_classes": COLOUR_CLASSES,
+        "layers": layers,
+        "default_layer": next(iter(layers)),
+        "view_state": {"longitude": 144.935032, "latitude": -37.839289, "zoom": 9},
+        "deck_gl_path": DECK_GL_VENDOR_PATH,
+    }
+    write_text_atomic(viewer_path, TILE_VIEWER_TEMPLATE.format(
+        title=viewer_path,
+        deck_gl_path=DECK_GL_VENDOR_PATH,
+        viewer_data=json.dumps(viewer).replace("</", "<\\/"),
+        viewer_script=TILE_VIEWER_SCRIPT,
+    ))
+
+
+def write_vendor_deck_gl(output_dir, source=None):
+    # deck.gl for the tile viewers in output_dir, copied from `source` (a local dist.min.js) or downloaded
+    # from DECK_GL_URL; an existing copy is kept, delete it to update deck.gl
+    vendor_path = os.path.join(output_dir, *DECK_GL_VENDOR_PATH.split("/"))
+    if os.path.exists(vendor_path):
+        return vendor_path
+    if source is not None:
+        with open(source, 'rb') as f:
+            data = f.read()
+    else:
+        try:
+            with urlopen(DECK_GL_URL, timeout=60) as response:
+                data = response.read()
+        except URLError as error:
+            raise RuntimeError(
+                f"Could not download deck.gl for the tile viewers from {DECK_GL_URL} ({error.reason}). "
+                "Set deck_gl_source in the run script to a local copy of deck.gl's dist.min.js."
+            ) from error
+    os.makedirs(os.path.dirname(vendor_path), exist_ok=True)
+    write_bytes_atomic(vendor_path, data)
+    return vendor_path
+
+
+def scenario_tiles_paths(scenario_name, output_dir):
+    return (
+        os.path.join(output_dir, f"{scenario_name}_TILES.mbtiles"),
+        os.path.join(output_dir, f"{scenario_name}_TILES.html"),
+    )
+
+
+def pair_tiles_paths(scenario_base_name, scenario_compare_name, output_dir):
+    return (
+        os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_TILES.mbtiles"),
+        os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_TILES.html"),
+    )
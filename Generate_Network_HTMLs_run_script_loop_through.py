@@ -1,20 +1,22 @@
 import os
+import argparse
+import shutil
 import duckdb
-import geopandas as gpd
-import numpy as np
 import pandas as pd
-import lonboard as lb
-from lonboard import Map, PathLayer, basemap
-from lonboard.colormap import apply_categorical_cmap
-from lonboard.layer_extension import PathStyleExtension
-from Generate_Network_HTML_functions import *
+from Generate_Network_HTML_functions import (
+    build_pair_gdf, build_scenario_gdf, build_scenario_values, collect_rendered_maps, compute_pair_diffs,
+    load_link_geometries, load_scenario_registry, plan_build, plan_pair_maps, plan_scenario_maps, precompress_outputs,
+    prepare_frame, recorded_scenario_sources, render_maps, render_pool, scenario_shapefile_path, submit_prepared_maps
+)
+from Generate_Network_HTML_bundles import generate_map_bundle, scenario_bundle_path, pair_bundle_path
+from Generate_Network_HTML_tiles import generate_map_tiles, scenario_tiles_paths, pair_tiles_paths, write_vendor_deck_gl
+from Generate_Network_HTML_manifest import (
+    scenario_source_hashes, map_inputs, bundle_inputs, tiles_inputs, load_build_manifest, save_build_manifest, is_up_to_date,
+    record_output, damaged_assets
+)
+from Generate_Network_HTML_profiling import STAGE_RECORDS, timed_stage, write_run_report
 import warnings
 
-warnings.simplefilter(action='ignore', category=FutureWarning)
-warnings.filterwarnings("ignore", category=DeprecationWarning)
-warnings.filterwarnings("ignore", category=RuntimeWarning)
-warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
-
 working_dir = "c:/Data/Network_HTMLs/"
 raw_file_dir = os.path.join(working_dir, "1_Raw_Summary_Loaded_Network_Links")
 output_dir = os.path.join(working_dir, "4_HTML_outputs")
@@ -29,207 +31,293 @@ pipeline_scenarios = ["Y2031_RC25v1_02_PLv1", "Y2031_RC25v1_02_PLv2", "Y2031_RC2
 scenarios1 = pipeline_scenarios
 scenarios2 = pipeline_scenarios
 
-for scenario1 in scenarios1:
-    for scenario2 in scenarios2:
-        if scenario1 == scenario2:
-            continue
-        scenario_base_name = scenario1
-        scenario_compare_name = scenario2
-
-        # Create temporary storage for duckdb, remove if already exists
-        store_db = "store.db"
-        if os.path.exists(store_db):
-            os.remove(store_db)
-            print(f"File '{store_db}' deleted successfully.")
-        else:
-            print(f"File '{store_db}' does not exist.")
-
-        if 'con' in globals():
-            con.close()
-        con = duckdb.connect()
-        con.load_extension("spatial")
-
-        columns = "A, B, VEH_AM, VEH_IP, VEH_PM, VEH_OP, VEH_WD, VC_AM, VC_IP, VC_PM, VC_OP, HYCAP_AM, HYCAP_IP, HYCAP_PM, HYCAP_OP, CSPD_AM, CSPD_IP, CSPD_PM, CSPD_OP, LANES_AM, LANES_IP, LANES_PM, LANES_OP"
-        scenario_base_dir = os.path.join(working_dir, raw_file_dir, f"SUMMARY_LOADED_NETWORK_LINKS_{scenario_base_name}.shp")
-        scenario_compare_dir = os.path.join(working_dir, raw_file_dir,
-                                            f"SUMMARY_LOADED_NETWORK_LINKS_{scenario_compare_name}.shp")
-
-        print("Loading layers into the database...")
-        # Create a 'links' temp table
-        con.sql(f"""
-                CREATE TABLE IF NOT EXISTS base_links AS 
-                SELECT 
-                        A, B, COLUMNS('LINKC_'), COLUMNS('SL'),
-                        CAST(ST_AsWKB(ST_FlipCoordinates(ST_Transform(geom, 'EPSG:20255', 'EPSG:4326'))) AS VARCHAR) AS geometry
-                FROM '{scenario_base_dir}' 
-                """)
-        con.sql(f"""
-                CREATE TABLE IF NOT EXISTS compare_links AS 
-                SELECT 
-                        A, B, COLUMNS('LINKC_'), COLUMNS('SL'),
-                        CAST(ST_AsWKB(ST_FlipCoordinates(ST_Transform(geom, 'EPSG:20255', 'EPSG:4326'))) AS VARCHAR) AS geometry
-                FROM '{scenario_compare_dir}' 
-                """)
-        # Create a 'after' temp table
-        con.sql(f"""
-                CREATE TABLE IF NOT EXISTS after AS 
-                SELECT {columns}, geom
-                FROM '{scenario_compare_dir}' 
-                --WHERE LINKC_AM != 25
-                """)
-        # Create a 'before' temp table
-        con.sql(f"""
-                CREATE TABLE IF NOT EXISTS before AS 
-                SELECT {columns} 
-                FROM '{scenario_base_dir}' 
-                --WHERE LINKC_AM != 25
-                """)
-
-        diff = con.sql("""
-            WITH 
-                merged AS 
-                (
-                    SELECT 
-                        a.A, a.B,
-                        a.VEH_AM AS VEH_AM_after,
-                        a.VEH_IP AS VEH_IP_after,
-                        a.VEH_PM AS VEH_PM_after,
-                        a.VEH_OP AS VEH_OP_after,
-                        a.VEH_WD AS VEH_WD_after,
-                        b.VEH_AM AS VEH_AM_before,
-                        b.VEH_IP AS VEH_IP_before,
-                        b.VEH_PM AS VEH_PM_before,
-                        b.VEH_OP AS VEH_OP_before,
-                        b.VEH_WD AS VEH_WD_before,
-                        a.HYCAP_AM AS HYCAP_AM_after,
-                        a.HYCAP_IP AS HYCAP_IP_after,
-                        a.HYCAP_PM AS HYCAP_PM_after,
-                        a.HYCAP_OP AS HYCAP_OP_after,
-                        b.HYCAP_AM AS HYCAP_AM_before,
-                        b.HYCAP_IP AS HYCAP_IP_before,
-                        b.HYCAP_PM AS HYCAP_PM_before,
-                        b.HYCAP_OP AS HYCAP_OP_before,
-                        a.LANES_AM AS LANES_AM_after,
-                        a.LANES_IP AS LANES_IP_after,
-                        a.LANES_PM AS LANES_PM_after,
-                        a.LANES_OP AS LANES_OP_after,
-                        b.LANES_AM AS LANES_AM_before,
-                        b.LANES_IP AS LANES_IP_before,
-                        b.LANES_PM AS LANES_PM_before,
-                        b.LANES_OP AS LANES_OP_before,
-                    FROM after AS a
-                    FULL OUTER JOIN before AS b
-                    USING (A, B)
-                ),
-                diff AS 
-                (
-                    SELECT 
-                        A, B,
-                        VEH_AM_after - VEH_AM_before AS VEH_AM_DIFF,
-                        VEH_IP_after - VEH_IP_before AS VEH_IP_DIFF,
-                        VEH_PM_after - VEH_PM_before AS VEH_PM_DIFF,
-                        VEH_OP_after - VEH_OP_before AS VEH_OP_DIFF,
-                        VEH_WD_after - VEH_WD_before AS VEH_WD_DIFF,
-                        (HYCAP_AM_after - HYCAP_AM_before) / 2 AS HYCAP_AM_DIFF,
-                        (HYCAP_IP_after - HYCAP_IP_before) / 6 AS HYCAP_IP_DIFF,
-                        (HYCAP_PM_after - HYCAP_PM_before) / 3 AS HYCAP_PM_DIFF,
-                        (HYCAP_OP_after - HYCAP_OP_before) / 6 AS HYCAP_OP_DIFF,
-                        LANES_AM_after - LANES_AM_before AS LANES_AM_DIFF,
-                        LANES_IP_after - LANES_IP_before AS LANES_IP_DIFF,
-                        LANES_PM_after - LANES_PM_before AS LANES_PM_DIFF,
-                        LANES_OP_after - LANES_OP_before AS LANES_OP_DIFF,
-                    FROM merged
+# Write the grey base network once as a shared asset next to the maps instead of inlining it in every HTML
+shared_base_network = True
+# Also write one bundle HTML per scenario and per pair holding every metric and time period as switchable layers
+write_map_bundles = True
+# Also export each scenario and pair as MVT tiles in an MBTiles file with a viewer HTML, served by the
+# dashboard's /tiles route; for networks too large to ship whole in one HTML
+write_map_tiles = False
+# The tile viewers load deck.gl from _VENDOR/deck.gl.min.js in output_dir. It is downloaded on the first run
+# with tiles; on a machine without internet access, point this at a local copy of deck.gl's dist.min.js
+deck_gl_source = None
+# Also write .gz (and .br, with the brotli package) copies of every HTML and shared asset for the dashboard
+write_precompressed = True
+
+# Number of worker processes rendering maps, 1 renders everything in this process
+render_workers = max(1, (os.cpu_count() or 2) - 1)
+prepared_dir = os.path.join(working_dir, "_PREPARED")
+# Memory for link geometries in flight while loading a scenario, in MB. Links are streamed from DuckDB in
+# batches of about this size into the scenario's arrays; None loads each scenario in one go. A scenario's
+# geometries are loaded for its first frame and released after its last
+ingest_memory_budget_mb = 512
+# DuckDB database holding each scenario's reprojected links, validated against the source shapefiles
+scenario_cache_db = os.path.join(working_dir, "_SCENARIO_CACHE.duckdb")
+# Wall time, peak and change of RSS and output bytes of every stage, per scenario, pair and map, as JSON and CSV
+run_report_dir = os.path.join(working_dir, "_RUN_REPORTS")
+
+
+def ignore_library_warnings():
+    # Set for the run and its render workers only, the modules it imports leave the filters of their importers
+    # (e.g. the dashboard) as they are
+    warnings.simplefilter(action='ignore', category=FutureWarning)
+    warnings.filterwarnings("ignore", category=DeprecationWarning)
+    warnings.filterwarnings("ignore", category=RuntimeWarning)
+    warnings.filterwarnings("ignore", category=UserWarning)
+    warnings.simplefilter(action='ignore', category=pd.errors.PerformanceWarning)
+
+
+def plan_scenario_frame(scenario_name):
+    return (
+        scenario_name, (scenario_name,),
+        plan_scenario_maps(scenario_name, output_dir), scenario_bundle_path(scenario_name, output_dir),
+        scenario_tiles_paths(scenario_name, output_dir)
+    )
+
+
+def plan_pair_frame(scenario_base_name, scenario_compare_name):
+    return (
+        f"{scenario_compare_name}_vs_{scenario_base_name}", (scenario_base_name, scenario_compare_name),
+        plan_pair_maps(scenario_base_name, scenario_compare_name, output_dir),
+        pair_bundle_path(scenario_base_name, scenario_compare_name, output_dir),
+        pair_tiles_paths(scenario_base_name, scenario_compare_name, output_dir)
+    )
+
+
+def plan_frames(scenario_names, pairs):
+    # (frame name, scenarios the frame is built from, maps rendered from it, bundle path, tiles paths).
+    # A scenario's own frame comes just before the first pair it takes part in, so its link geometries
+    # are only held from then until its last pair.
+    frames = []
+    planned_scenarios = set()
+    for pair in pairs:
+        for scenario_name in pair:
+            if scenario_name not in planned_scenarios:
+                planned_scenarios.add(scenario_name)
+                frames.append(plan_scenario_frame(scenario_name))
+        frames.append(plan_pair_frame(*pair))
+    for scenario_name in scenario_names:
+        if scenario_name not in planned_scenarios:
+            frames.append(plan_scenario_frame(scenario_name))
+    return frames
+
+
+def read_recorded_sources():
+    # The sources the scenario cache has loaded, so that planning only hashes the ones that changed since
+    if not os.path.exists(scenario_cache_db):
+        return {}
+    con = duckdb.connect(scenario_cache_db, read_only=True)
+    try:
+        return recorded_scenario_sources(con)
+    finally:
+        con.close()
+
+
+def plan_stale_frames(frames, manifest, force=False, recorded_sources=None, damaged=()):
+    # Only outputs whose sources, styling or code version changed since they were built, or that load a
+    # damaged asset (a shared base network asset, a bundle's geometry level), are rebuilt
+    recorded_sources = recorded_sources or {}
+    source_hashes = {}
+    stale_frames = []
+    for frame_name, frame_scenarios, maps, bundle_path, tiles_paths in frames:
+        for scenario_name in frame_scenarios:
+            if scenario_name not in source_hashes:
+                source_hashes[scenario_name] = scenario_source_hashes(
+                    scenario_shapefile_path(raw_file_dir, scenario_name), recorded_sources.get(scenario_name)
                 )
-            SELECT * from diff
-        """)
-        print("Finished loading layers into the database.")
-
-        base_links = con.sql("from base_links WHERE LINKC_AM NOT IN (1,-1,0) AND LINKC_AM < 39 AND LINKC_AM < 50;").to_df()
-        compare_links = con.sql(
-            "from compare_links WHERE LINKC_AM NOT IN (1,-1,0) AND LINKC_AM < 39 AND LINKC_AM < 50;").to_df()
-        master_links = pd.concat([base_links, compare_links])
-        master_links = master_links.drop_duplicates(subset=['A', 'B'], keep='last')
-
-        diff_with_geo = diff.to_df().merge(
-            master_links,
-            on=['A', 'B'],
-            how="inner"
-        )
-
-        base_vc = con.sql("select * from before").to_df().merge(
-            master_links,
-            on=['A', 'B'],
-            how="inner"
-        )
-
-        compare_vc = con.sql("select * from after").to_df().merge(
-            master_links,
-            on=['A', 'B'],
-            how="inner"
-        )
-
-        gdf_input = create_gdf_using_decoded_geoms(diff_with_geo).reset_index()
-        base_vc_gdf = create_gdf_using_decoded_geoms(base_vc).reset_index()
-        compare_vc_gdf = create_gdf_using_decoded_geoms(compare_vc).reset_index()
-
-        print("Preparing maps...")
-        vol_cols = ["VEH_AM_DIFF", "VEH_IP_DIFF", "VEH_PM_DIFF", "VEH_OP_DIFF", "VEH_WD_DIFF"]
-        for col in vol_cols:
-            generate_volume_diff_plot(gdf_input, col, 100,
-                                      os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-
-        cap_cols = ["HYCAP_AM_DIFF", "HYCAP_IP_DIFF", "HYCAP_PM_DIFF", "HYCAP_OP_DIFF"]
-        for col in cap_cols:
-            generate_network_diff_plot(gdf_input, col, 1,
-                                       os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-
-        lane_cols = ["LANES_AM_DIFF", "LANES_IP_DIFF", "LANES_PM_DIFF", "LANES_OP_DIFF"]
-        for col in lane_cols:
-            generate_nlanes_plot(gdf_input, col, 1,
-                                       os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_vs_{scenario_base_name}_{col}.html"))
-
-        # Raw volumes and capacity
-        vol_raw_cols = ["VEH_AM", "VEH_IP", "VEH_PM", "VEH_OP", "VEH_WD"]
-        for col in vol_raw_cols:
-            generate_volume_diff_plot(base_vc_gdf, col, 100,
-                                      os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            generate_volume_diff_plot(compare_vc_gdf, col, 100,
-                                      os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-
-        cap_raw_cols = ["HYCAP_AM", "HYCAP_IP", "HYCAP_PM", "HYCAP_OP"]
-        for col in cap_raw_cols:
-            generate_network_diff_plot(base_vc_gdf, col, 1,
-                                       os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            generate_network_diff_plot(compare_vc_gdf, col, 1,
-                                       os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-
-        lane_raw_cols = ["LANES_AM", "LANES_IP", "LANES_PM", "LANES_OP"]
-        for col in lane_raw_cols:
-            generate_nlanes_plot(base_vc_gdf, col, 1,
-                                       os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_base_name}_{col}.html"))
-            generate_nlanes_plot(compare_vc_gdf, col, 1,
-                                       os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_{col}.html"))
-
-        time_periods = ["AM", "IP", "PM", "OP"]
-        for tp in time_periods:
-            generate_vc_plot(base_vc_gdf, tp, 100, os.path.join(output_dir, f"{scenario_base_name}_VC_{tp}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_base_name}_VC_{tp}.html"))
-            generate_vc_plot(compare_vc_gdf, tp, 100, os.path.join(output_dir, f"{scenario_compare_name}_VC_{tp}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_VC_{tp}.html"))
-
-            generate_cspd_plot(base_vc_gdf, tp, 1, os.path.join(output_dir, f"{scenario_base_name}_CSPD_{tp}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_base_name}_CSPD_{tp}.html"))
-            generate_cspd_plot(compare_vc_gdf, tp, 1, os.path.join(output_dir, f"{scenario_compare_name}_CSPD_{tp}.html"))
-            insert_jp_ui_font_family(os.path.join(output_dir, f"{scenario_compare_name}_CSPD_{tp}.html"))
+        sources = {scenario_name: source_hashes[scenario_name] for scenario_name in frame_scenarios}
+        outputs = {job.file_name: map_inputs(job, sources, shared_base_network) for job in maps}
+        if write_map_bundles:
+            outputs[bundle_path] = bundle_inputs(maps, sources)
+        if write_map_tiles:
+            # the viewer HTML is written with its tiles and tracked through them
+            outputs[tiles_paths[0]] = tiles_inputs(maps, sources)
+        stale_outputs = {
+            file_name: inputs for file_name, inputs in outputs.items()
+            if force or not is_up_to_date(manifest, file_name, inputs, damaged)
+        }
+        if stale_outputs:
+            stale_frames.append((frame_name, frame_scenarios, maps, bundle_path, tiles_paths, stale_outputs))
+    return stale_frames
+
+
+def record_rendered_maps(rendered, manifest, pending_outputs):
+    for file_name, base_network_asset in rendered:
+        record_output(manifest, file_name, pending_outputs.pop(file_name), base_network_asset)
+        print(f"Saved {file_name}")
+    save_build_manifest(output_dir, manifest)
+
+
+def update_scenario_cache():
+    # Only load every scenario of scenarios1 and scenarios2 into the scenario cache, e.g. for the
+    # dashboard's live maps, which are computed from the cache without any HTML being built
+    con = duckdb.connect(scenario_cache_db)
+    con.load_extension("spatial")
+    try:
+        load_scenario_registry(con, list(dict.fromkeys(scenarios1 + scenarios2)), raw_file_dir)
+    finally:
+        con.close()
+    print(f"Scenario cache {scenario_cache_db} is up to date.")
+
+
+def main(dry_run=False, force=False):
+    scenario_names, pairs = plan_build(scenarios1, scenarios2)
+    manifest = load_build_manifest(output_dir)
+    damaged = damaged_assets(manifest, output_dir)
+    stale_frames = plan_stale_frames(
+        plan_frames(scenario_names, pairs), manifest, force, read_recorded_sources(), damaged
+    )
+    stale_count = sum(len(stale_outputs) for *_, stale_outputs in stale_frames)
+
+    if dry_run:
+        for *_, stale_outputs in stale_frames:
+            for file_name in stale_outputs:
+                print(f"Would rebuild {file_name}")
+        print(f"{stale_count} outputs would be rebuilt.")
+        return
+    if write_map_tiles:
+        write_vendor_deck_gl(output_dir, deck_gl_source)
+    if not stale_frames:
+        print("All maps are up to date.")
+        if write_precompressed:
+            precompress_outputs(output_dir, render_workers)
+        return
+    print(f"Rebuilding {stale_count} outputs...")
+    # a damaged asset would be reused as it is, the outputs loading it write it again
+    for asset_name in damaged:
+        if os.path.exists(os.path.join(output_dir, asset_name)):
+            os.remove(os.path.join(output_dir, asset_name))
+        manifest.pop(asset_name, None)
+
+    # Persistent scenario cache: reprojected link tables survive between runs
+    con = duckdb.connect(scenario_cache_db)
+    con.load_extension("spatial")
+
+    # Each scenario shapefile is read and reprojected at most once per run: only if one of its outputs
+    # is stale and its cached table no longer matches the shapefile
+    print("Loading layers into the database...")
+    needed_scenarios = list(dict.fromkeys(
+        scenario_name for _, frame_scenarios, *_ in stale_frames for scenario_name in frame_scenarios
+    ))
+    scenario_registry = load_scenario_registry(con, needed_scenarios, raw_file_dir)
+    print("Finished loading layers into the database.")
+    # A scenario's link geometries are decoded for the first frame that needs them and released after the
+    # last one, so only the scenarios of frames in progress are held
+    scenario_links = {}
+    last_frames = {
+        scenario_name: frame_index
+        for frame_index, (_, frame_scenarios, *_) in enumerate(stale_frames) for scenario_name in frame_scenarios
+    }
+
+    # Differences of every stale pair are computed together, a pair and its reverse only once
+    stale_pairs = [frame_scenarios for _, frame_scenarios, *_ in stale_frames if len(frame_scenarios) == 2]
+    if stale_pairs:
+        with timed_stage("diff"):
+            build_scenario_values(con, {
+                scenario_name: scenario_registry[scenario_name]
+                for scenario_name in dict.fromkeys(name for pair in stale_pairs for name in pair)
+            })
+            compute_pair_diffs(con, stale_pairs)
+
+    # With several workers, each frame is prepared here and its maps are rendered by the pool while the next
+    # frame is prepared; a prepared frame is deleted once its maps are rendered
+    render_executor = None
+    render_futures = {}
+    pending_outputs = {}
+    if render_workers > 1:
+        os.makedirs(prepared_dir, exist_ok=True)
+        render_executor = render_pool(render_workers, initializer=ignore_library_warnings)
+
+    try:
+        # Single-scenario frames (VEH, HYCAP, LANES, VC, CSPD rendered once per scenario) and the `_vs_`
+        # diff frames of each ordered pair
+        for frame_index, (frame_name, frame_scenarios, maps, bundle_path, tiles_paths, stale_outputs) in enumerate(
+            stale_frames
+        ):
+            with timed_stage("frame", frame=frame_name):
+                for scenario_name in frame_scenarios:
+                    if scenario_name not in scenario_links:
+                        scenario_links[scenario_name] = load_link_geometries(
+                            con, scenario_name, scenario_registry[scenario_name], ingest_memory_budget_mb
+                        )
+                if len(frame_scenarios) == 1:
+                    gdf_input = build_scenario_gdf(
+                        con, scenario_registry[frame_scenarios[0]], scenario_links[frame_scenarios[0]]
+                    )
+                else:
+                    scenario_base_name, scenario_compare_name = frame_scenarios
+                    gdf_input = build_pair_gdf(
+                        con, scenario_registry, scenario_base_name, scenario_compare_name, scenario_links
+                    )
+                print(f"Preparing maps for {frame_name}...")
+                if bundle_path in stale_outputs:
+                    with timed_stage("bundle") as record:
+                        level_paths = generate_map_bundle(gdf_input, maps, bundle_path)
+                        record["output_bytes"] = sum(
+                            os.path.getsize(file_name) for file_name in [bundle_path] + level_paths
+                        )
+                    record_output(manifest, bundle_path, stale_outputs[bundle_path], assets=level_paths)
+                if tiles_paths[0] in stale_outputs:
+                    with timed_stage("tiles") as record:
+                        generate_map_tiles(con, gdf_input, maps, *tiles_paths)
+                        record["output_bytes"] = sum(os.path.getsize(file_name) for file_name in tiles_paths)
+                    record_output(manifest, tiles_paths[0], stale_outputs[tiles_paths[0]])
+                stale_maps = [job for job in maps if job.file_name in stale_outputs]
+                if render_executor is not None:
+                    if stale_maps:
+                        with timed_stage("prepare_frame"):
+                            prepared_path = prepare_frame(
+                                gdf_input, os.path.join(prepared_dir, f"{frame_name}.feather")
+                            )
+                        submit_prepared_maps(
+                            render_executor, render_futures, prepared_path, stale_maps, shared_base_network
+                        )
+                        pending_outputs.update({job.file_name: stale_outputs[job.file_name] for job in stale_maps})
+                    # at most one prepared frame per worker waits on disk, enough to keep every worker busy
+                    record_rendered_maps(
+                        collect_rendered_maps(render_futures, max_pending_frames=render_workers),
+                        manifest, pending_outputs
+                    )
+                else:
+                    for file_name, base_network_asset in render_maps(gdf_input, stale_maps, shared_base_network):
+                        record_output(manifest, file_name, stale_outputs[file_name], base_network_asset)
+                    save_build_manifest(output_dir, manifest)
+                    print(f"Finished generating maps for {frame_name}!")
+                del gdf_input
+                for scenario_name in frame_scenarios:
+                    if last_frames[scenario_name] == frame_index:
+                        del scenario_links[scenario_name]
 
         con.close()
-        print(f"Finished generating maps for {scenario_base_name} vs {scenario_compare_name}!")
+
+        if render_executor is not None:
+            print(f"Rendering the last {len(pending_outputs)} maps with {render_workers} workers...")
+            record_rendered_maps(collect_rendered_maps(render_futures, max_pending_frames=0), manifest, pending_outputs)
+            render_executor.shutdown()
+            render_executor = None
+            shutil.rmtree(prepared_dir)
+            print("Finished generating maps!")
+
+        if write_precompressed:
+            print("Compressing outputs...")
+            with timed_stage("precompress"):
+                compressed = precompress_outputs(output_dir, render_workers)
+            print(f"Compressed {len(compressed)} outputs.")
+    finally:
+        if render_executor is not None:
+            render_executor.shutdown(cancel_futures=True)
+        save_build_manifest(output_dir, manifest)
+        print(f"Run report written to {write_run_report(run_report_dir, STAGE_RECORDS)}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate the summary loaded network HTML maps.")
+    parser.add_argument("--dry-run", action="store_true", help="list the outputs that would be rebuilt and exit")
+    parser.add_argument("--force", action="store_true", help="rebuild every output regardless of the build manifest")
+    parser.add_argument("--cache-only", action="store_true", help="only update the scenario cache, build no outputs")
+    args = parser.parse_args()
+    ignore_library_warnings()
+    if args.cache_only:
+        update_scenario_cache()
+    else:
+        main(dry_run=args.dry_run, force=args.force)
@@ -0,0 +1,34 @@
+import argparse
+import os
+
+# Serves the dashboard with waitress, a production WSGI server that also runs on Windows: requests are
+# handled by a pool of threads, so one user's multi-MB map download does not queue everyone else's.
+# Static files go out through the server's file wrapper instead of being read into memory.
+# On Linux, several worker processes can be run with gunicorn instead: gunicorn -c gunicorn.conf.py
+host = "0.0.0.0"
+port = 8002
+threads = max(8, 4 * (os.cpu_count() or 1))
+# connections accepted at once; further ones wait in the listen backlog
+connection_limit = 200
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the road network dashboard.")
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--threads", type=int, default=threads, help="requests served at once")
+    args = parser.parse_args()
+
+    try:
+        from waitress import serve
+    except ImportError:
+        raise SystemExit("waitress is not installed: pip install waitress, or run python Deploy_Display_Dashboard.py "
+                         "for the development server")
+    from Deploy_Display_Dashboard import server
+
+    print(f"Serving the dashboard on http://{args.host}:{args.port} with {args.threads} threads")
+    serve(server, host=args.host, port=args.port, threads=args.threads, connection_limit=connection_limit)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,64 @@
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Cold import time of the entry points, each in a fresh interpreter as a worker restart or a cold start
+# would pay it, and the modules they must not load. The budgets are about 1.5x the best times measured on a
+# development machine (0.50s, 0.32s and 0.28s), so an import that gets noticeably slower fails; the module
+# checks catch the generation stack creeping back into the serving path.
+IMPORT_TARGETS = {
+    # module: (budget in seconds, modules it must not import)
+    "Deploy_Display_Dashboard": (0.75, ["jupyter_dash", "Generate_Network_HTML_functions", "geopandas", "lonboard"]),
+    "Deploy_Display_Dashboard_live": (0.5, ["jupyter_dash", "geopandas", "lonboard", "ipywidgets"]),
+    "Generate_Network_HTML_functions": (0.4, ["duckdb", "geopandas", "shapely", "lonboard", "ipywidgets"]),
+}
+IMPORT_PROBE = """
+import sys, json, time
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "loaded": [name for name in {forbidden!r} if name in sys.modules]}}))
+"""
+
+
+def time_import(module, forbidden):
+    probe = IMPORT_PROBE.format(module=module, forbidden=forbidden)
+    completed = subprocess.run(
+        [sys.executable, "-c", probe], cwd=REPO_DIR, capture_output=True, text=True, check=True
+    )
+    return json.loads(completed.stdout.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Time cold imports of the dashboard and generator entry points.")
+    parser.add_argument("--repeat", type=int, default=5, help="fresh interpreters per module, the best is kept")
+    parser.add_argument("--module", action="append", choices=list(IMPORT_TARGETS), help="module to time, repeatable")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 when a budget or module check fails")
+    args = parser.parse_args()
+
+    failures = []
+    print(f"{'module':40s} {'best s':>8} {'budget s':>9}  loaded")
+    for module in args.module or IMPORT_TARGETS:
+        budget, forbidden = IMPORT_TARGETS[module]
+        runs = [time_import(module, forbidden) for _ in range(args.repeat)]
+        best = min(run["seconds"] for run in runs)
+        loaded = sorted({name for run in runs for name in run["loaded"]})
+        print(f"{module:40s} {best:8.3f} {budget:9.2f}  {', '.join(loaded) or '-'}")
+        if best > budget:
+            failures.append(f"{module} imports in {best:.3f}s, over its {budget:.2f}s budget")
+        if loaded:
+            failures.append(f"{module} loads {', '.join(loaded)}")
+
+    for failure in failures:
+        print(failure)
+    if failures and args.check:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
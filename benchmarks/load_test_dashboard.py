@@ -0,0 +1,89 @@
+import os
+import time
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+from urllib.error import HTTPError, URLError
+from urllib.parse import quote
+from urllib.request import Request, urlopen
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+
+# Requests maps from a running dashboard with several concurrent clients and reports throughput and
+# latency per concurrency level, e.g. against Serve_Dashboard.py and against the development server.
+
+
+def map_paths(assets_dir, limit):
+    # the map HTMLs in the dashboard's assets folder, as the iframe requests them
+    names = sorted(name for name in os.listdir(assets_dir) if name.endswith(".html"))
+    return [f"/assets/{quote(name)}" for name in names[:limit]]
+
+
+def fetch(url, accept_encoding):
+    start = time.perf_counter()
+    try:
+        with urlopen(Request(url, headers={"Accept-Encoding": accept_encoding}), timeout=300) as response:
+            size = len(response.read())
+            status = response.status
+    except HTTPError as error:
+        size, status = 0, error.code
+    except URLError:
+        size, status = 0, None
+    return status, size, time.perf_counter() - start
+
+
+def percentile(sorted_values, share):
+    return sorted_values[min(len(sorted_values) - 1, int(share * len(sorted_values)))]
+
+
+def run_level(base_url, paths, concurrency, request_count, accept_encoding):
+    urls = [base_url + paths[i % len(paths)] for i in range(request_count)]
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(fetch, urls, [accept_encoding] * len(urls)))
+    seconds = time.perf_counter() - start
+    latencies = sorted(latency for status, _, latency in results if status == 200)
+    errors = sum(status != 200 for status, _, _ in results)
+    received = sum(size for _, size, _ in results)
+    return {
+        "concurrency": concurrency,
+        "requests": request_count,
+        "errors": errors,
+        "seconds": seconds,
+        "requests_per_second": request_count / seconds,
+        "mb_per_second": received / 1024 ** 2 / seconds,
+        "p50": percentile(latencies, 0.5) if latencies else None,
+        "p90": percentile(latencies, 0.9) if latencies else None,
+        "p99": percentile(latencies, 0.99) if latencies else None,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test a running dashboard with concurrent map requests.")
+    parser.add_argument("--url", default="http://127.0.0.1:8002", help="dashboard base URL")
+    parser.add_argument("--path", action="append", help="path to request, repeatable; default: the maps in --assets")
+    parser.add_argument("--assets", default=os.path.join(REPO_DIR, "assets"), help="assets folder listing the maps")
+    parser.add_argument("--maps", type=int, default=20, help="number of maps from --assets to request")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16], help="concurrent clients")
+    parser.add_argument("--requests", type=int, default=100, help="requests per concurrency level")
+    parser.add_argument("--accept-encoding", default="gzip, br", help="Accept-Encoding header of the requests")
+    args = parser.parse_args()
+
+    paths = args.path or map_paths(args.assets, args.maps)
+    if not paths:
+        parser.error("no maps to request: pass --path or an --assets folder with map HTMLs")
+    print(f"{len(paths)} paths on {args.url}, {args.requests} requests per level")
+    print(f"{'clients':>8} {'req/s':>8} {'MB/s':>8} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} {'errors':>7}")
+    for concurrency in args.concurrency:
+        level = run_level(args.url.rstrip("/"), paths, concurrency, args.requests, args.accept_encoding)
+        latencies = [
+            f"{level[name] * 1000:8.1f}" if level[name] is not None else f"{'-':>8}" for name in ("p50", "p90", "p99")
+        ]
+        print(
+            f"{concurrency:8d} {level['requests_per_second']:8.1f} {level['mb_per_second']:8.1f} "
+            f"{' '.join(latencies)} {level['errors']:7d}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,183 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import subprocess
+
+import duckdb
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARK_DIR)
+sys.path.insert(0, REPO_DIR)
+
+import Generate_Network_HTMLs_run_script_loop_through as run_script
+from Generate_Network_HTML_functions import (
+    PLOT_FUNCTIONS, load_scenario_registry, load_scenario_link_geometries, build_scenario_values, compute_pair_diffs,
+    build_scenario_gdf, build_pair_gdf, plan_scenario_maps, plan_pair_maps
+)
+from Generate_Network_HTML_profiling import STAGE_RECORDS, peak_rss_mb, summarise_stages
+from synthetic_network import write_synthetic_scenarios
+
+# Synthetic shapefiles and outputs are kept per link count under _data, results are appended to
+# results.jsonl (one line per size and run) and compared with the last run of another commit.
+BENCHMARK_SCENARIOS = ["BENCH_A", "BENCH_B"]
+DATA_DIR = os.path.join(BENCHMARK_DIR, "_data")
+RESULTS_PATH = os.path.join(BENCHMARK_DIR, "results.jsonl")
+
+
+def git_revision():
+    def git(*args):
+        return subprocess.run(["git", *args], cwd=REPO_DIR, capture_output=True, text=True).stdout.strip()
+    return git("rev-parse", "--short", "HEAD") or "unknown", bool(git("status", "--porcelain", "--untracked-files=no"))
+
+
+def benchmark_dirs(n_links):
+    size_dir = os.path.join(DATA_DIR, str(n_links))
+    return os.path.join(size_dir, "raw"), os.path.join(size_dir, "work")
+
+
+def time_pipeline(n_links, workers):
+    # The run script end to end from a cold scenario cache, every output rebuilt
+    raw_file_dir, working_dir = benchmark_dirs(n_links)
+    shutil.rmtree(working_dir, ignore_errors=True)
+    run_script.working_dir = working_dir
+    run_script.raw_file_dir = raw_file_dir
+    run_script.output_dir = os.path.join(working_dir, "out")
+    run_script.prepared_dir = os.path.join(working_dir, "_PREPARED")
+    run_script.scenario_cache_db = os.path.join(working_dir, "_SCENARIO_CACHE.duckdb")
+    run_script.run_report_dir = os.path.join(working_dir, "_RUN_REPORTS")
+    run_script.scenarios1 = BENCHMARK_SCENARIOS
+    run_script.scenarios2 = BENCHMARK_SCENARIOS
+    run_script.render_workers = workers
+    os.makedirs(run_script.output_dir)
+
+    del STAGE_RECORDS[:]
+    start = time.perf_counter()
+    run_script.main(force=True)
+    seconds = time.perf_counter() - start
+    stages = {stage: round(summary["seconds"], 4) for stage, summary in summarise_stages(STAGE_RECORDS).items()}
+    del STAGE_RECORDS[:]
+    return seconds, stages
+
+
+def time_plot_functions(n_links, repeat):
+    # Each generate_*_plot on a scenario and a pair frame, best of `repeat`
+    raw_file_dir, working_dir = benchmark_dirs(n_links)
+    output_dir = os.path.join(working_dir, "plots")
+    os.makedirs(output_dir, exist_ok=True)
+    con = duckdb.connect()
+    con.load_extension("spatial")
+    registry = load_scenario_registry(con, BENCHMARK_SCENARIOS, raw_file_dir)
+    scenario_links = load_scenario_link_geometries(con, registry)
+    scenario_base_name, scenario_compare_name = BENCHMARK_SCENARIOS
+    build_scenario_values(con, registry)
+    compute_pair_diffs(con, [(scenario_base_name, scenario_compare_name)])
+    frames = {
+        "scenario": (
+            build_scenario_gdf(con, registry[scenario_base_name], scenario_links[scenario_base_name]),
+            plan_scenario_maps(scenario_base_name, output_dir),
+        ),
+        "pair": (
+            build_pair_gdf(con, registry, scenario_base_name, scenario_compare_name, scenario_links),
+            plan_pair_maps(scenario_base_name, scenario_compare_name, output_dir),
+        ),
+    }
+    con.close()
+
+    timings = {}
+    for frame_kind, (gdf_input, maps) in frames.items():
+        # the first map of each type stands for the type
+        for job in {job.plot_type: job for job in reversed(maps)}.values():
+            plot_function = PLOT_FUNCTIONS[job.plot_type]
+            best = None
+            for _ in range(repeat):
+                start = time.perf_counter()
+                plot_function(gdf_input, job.plot_column, job.min_abs_vol, job.file_name)
+                seconds = time.perf_counter() - start
+                best = seconds if best is None else min(best, seconds)
+            timings[f"{plot_function.__name__}[{frame_kind}]"] = round(best, 4)
+    shutil.rmtree(output_dir)
+    return timings
+
+
+def load_results():
+    if not os.path.exists(RESULTS_PATH):
+        return []
+    with open(RESULTS_PATH, 'r', encoding='utf-8') as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def compare_with_previous(result, previous_results, threshold):
+    # Regressions against the last result of another commit with the same link count and workers
+    previous = [
+        r for r in previous_results
+        if r["n_links"] == result["n_links"] and r["workers"] == result["workers"] and r["commit"] != result["commit"]
+    ]
+    if not previous:
+        print(f"{result['n_links']} links: no earlier commit to compare with.")
+        return []
+    baseline = previous[-1]
+    current_timings = {"pipeline": result.get("pipeline_seconds"), **result.get("plots", {})}
+    baseline_timings = {"pipeline": baseline.get("pipeline_seconds"), **baseline.get("plots", {})}
+    regressions = []
+    print(f"{result['n_links']} links, compared with {baseline['commit']}:")
+    for name, seconds in current_timings.items():
+        if seconds is None or not baseline_timings.get(name):
+            continue
+        ratio = seconds / baseline_timings[name]
+        flag = "REGRESSION" if ratio > 1 + threshold else ""
+        print(f"  {name:50s} {baseline_timings[name]:10.3f}s -> {seconds:10.3f}s  x{ratio:5.2f} {flag}")
+        if flag:
+            regressions.append(name)
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the network HTML generator on synthetic networks.")
+    parser.add_argument("--links", type=int, nargs="+", default=[10000, 100000], help="link counts to benchmark")
+    parser.add_argument("--repeat", type=int, default=3, help="runs of each plot function, the best is kept")
+    parser.add_argument("--workers", type=int, default=1, help="render workers of the pipeline run")
+    parser.add_argument("--skip-pipeline", action="store_true", help="only time the generate_*_plot functions")
+    parser.add_argument("--threshold", type=float, default=0.2, help="slowdown counted as a regression")
+    parser.add_argument("--check", action="store_true", help="exit with status 1 when a regression is found")
+    parser.add_argument("--no-save", action="store_true", help="do not append the results to results.jsonl")
+    args = parser.parse_args()
+
+    commit, dirty = git_revision()
+    previous_results = load_results()
+    regressions = []
+    for n_links in args.links:
+        raw_file_dir, _ = benchmark_dirs(n_links)
+        print(f"Writing synthetic networks of {n_links} links...")
+        write_synthetic_scenarios(raw_file_dir, n_links, BENCHMARK_SCENARIOS)
+
+        result = {
+            "commit": commit,
+            "dirty": dirty,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "n_links": n_links,
+            "workers": args.workers,
+        }
+        if not args.skip_pipeline:
+            result["pipeline_seconds"], result["pipeline_stages"] = time_pipeline(n_links, args.workers)
+        result["plots"] = time_plot_functions(n_links, args.repeat)
+        result["peak_rss_mb"] = peak_rss_mb()
+
+        regressions += compare_with_previous(result, previous_results, args.threshold)
+        if not args.no_save:
+            with open(RESULTS_PATH, 'a', encoding='utf-8') as f:
+                f.write(json.dumps(result) + "\n")
+
+    if regressions:
+        print(f"{len(regressions)} regressions over {args.threshold:.0%}.")
+        if args.check:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
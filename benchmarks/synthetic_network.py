@@ -0,0 +1,115 @@
+import os
+import numpy as np
+import pandas as pd
+import geopandas as gpd
+import shapely
+
+# Synthetic VITM-like summary loaded networks: links around Melbourne in EPSG:20255 (AGD66 / AMG zone 55)
+# with the columns of SUMMARY_LOADED_NETWORK_LINKS_*.shp the generator reads.
+TIME_PERIODS = ["AM", "IP", "PM", "OP"]
+PERIOD_HOURS = {"AM": 2, "IP": 6, "PM": 3, "OP": 6}
+MELBOURNE_CENTRE = (320500.0, 5813500.0)
+# link class: (share of links, speed limit km/h, capacity per lane per hour)
+LINK_CLASSES = {
+    2: (0.05, 100, 2000),
+    5: (0.01, 80, 9999),
+    16: (0.01, 60, 9999),
+    25: (0.01, 40, 9999),
+    30: (0.40, 60, 900),
+    34: (0.35, 50, 700),
+    38: (0.12, 80, 1200),
+    # centroid connectors and classes the generator filters out
+    1: (0.03, 40, 9999),
+    45: (0.02, 40, 600),
+}
+
+
+def synthetic_link_geometry(rng, n_links):
+    # Links start around the centre, run in a random direction and bend slightly at every vertex
+    starts = rng.normal(MELBOURNE_CENTRE, 15000.0, size=(n_links, 2))
+    headings = rng.uniform(0, 2 * np.pi, n_links)
+    lengths = np.clip(rng.lognormal(np.log(300.0), 0.8, n_links), 20.0, 5000.0)
+    vertex_counts = rng.integers(2, 13, n_links)
+    link_index = np.repeat(np.arange(n_links), vertex_counts)
+    first_vertex = np.concatenate([[0], np.cumsum(vertex_counts)[:-1]])
+    vertex_number = np.arange(len(link_index)) - first_vertex[link_index]
+
+    angles = headings[link_index] + rng.normal(0, 0.15, len(link_index))
+    steps = (lengths / (vertex_counts - 1))[link_index]
+    dx = np.where(vertex_number == 0, 0.0, np.cos(angles) * steps)
+    dy = np.where(vertex_number == 0, 0.0, np.sin(angles) * steps)
+    # cumulative offsets within each link
+    x = np.cumsum(dx)
+    y = np.cumsum(dy)
+    x -= np.repeat(x[first_vertex], vertex_counts)
+    y -= np.repeat(y[first_vertex], vertex_counts)
+    coords = np.column_stack([x + starts[link_index, 0], y + starts[link_index, 1]])
+    return shapely.linestrings(coords, indices=link_index)
+
+
+def synthetic_link_attributes(rng, link_classes):
+    n_links = len(link_classes)
+    speed_limits = np.array([LINK_CLASSES[c][1] for c in link_classes], dtype=float)
+    lane_capacity = np.array([LINK_CLASSES[c][2] for c in link_classes], dtype=float)
+    lanes = rng.choice([1, 2, 3, 4], n_links, p=[0.35, 0.4, 0.2, 0.05]).astype(float)
+    attributes = {}
+    for tp in TIME_PERIODS:
+        attributes[f"LINKC_{tp}"] = link_classes
+        attributes[f"SL_{tp}"] = speed_limits
+        attributes[f"LANES_{tp}"] = lanes
+        hycap = lanes * lane_capacity * PERIOD_HOURS[tp]
+        veh = hycap * np.clip(rng.gamma(2.0, 0.25, n_links), 0, 1.6)
+        vc = veh / hycap
+        attributes[f"HYCAP_{tp}"] = hycap
+        attributes[f"VEH_{tp}"] = veh
+        attributes[f"VC_{tp}"] = vc
+        attributes[f"CSPD_{tp}"] = np.clip(speed_limits * (1 - 0.45 * vc ** 2), 5, None)
+    attributes["VEH_WD"] = sum(attributes[f"VEH_{tp}"] for tp in TIME_PERIODS)
+    return attributes
+
+
+def make_synthetic_network(n_links, seed=0):
+    rng = np.random.default_rng(seed)
+    classes = np.array(list(LINK_CLASSES))
+    shares = np.array([LINK_CLASSES[c][0] for c in classes])
+    link_classes = rng.choice(classes, n_links, p=shares / shares.sum())
+    columns = {
+        "A": 10000 + np.arange(n_links),
+        "B": 10000 + rng.permutation(n_links),
+        **synthetic_link_attributes(rng, link_classes),
+    }
+    return gpd.GeoDataFrame(columns, geometry=synthetic_link_geometry(rng, n_links), crs="EPSG:20255")
+
+
+def make_scenario_variant(network, seed, change_share=0.02):
+    # A later scenario of the same network: some links removed, some added and
+    # changed volumes and lanes/capacity, so the pair diffs have every kind of row
+    rng = np.random.default_rng(seed)
+    n_links = len(network)
+    variant = network.iloc[np.sort(rng.permutation(n_links)[int(n_links * change_share):])].copy()
+    added = make_synthetic_network(int(n_links * change_share), seed=seed + 1000)
+    added["A"] += n_links
+    variant = pd.concat([variant, added[variant.columns]], ignore_index=True)
+    widened = rng.random(len(variant)) < change_share
+    for tp in TIME_PERIODS:
+        variant[f"VEH_{tp}"] *= rng.normal(1.0, 0.1, len(variant)).clip(0)
+        variant.loc[widened, f"LANES_{tp}"] += 1
+        lanes = variant.loc[widened, f"LANES_{tp}"]
+        variant.loc[widened, f"HYCAP_{tp}"] *= lanes / (lanes - 1)
+        variant[f"VC_{tp}"] = variant[f"VEH_{tp}"] / variant[f"HYCAP_{tp}"]
+    variant["VEH_WD"] = sum(variant[f"VEH_{tp}"] for tp in TIME_PERIODS)
+    return variant
+
+
+def write_synthetic_scenarios(raw_file_dir, n_links, scenario_names, seed=0):
+    # Writes SUMMARY_LOADED_NETWORK_LINKS_<scenario>.shp for each scenario, skipping existing ones
+    os.makedirs(raw_file_dir, exist_ok=True)
+    network = None
+    for number, scenario_name in enumerate(scenario_names):
+        shp_path = os.path.join(raw_file_dir, f"SUMMARY_LOADED_NETWORK_LINKS_{scenario_name}.shp")
+        if os.path.exists(shp_path):
+            continue
+        if network is None:
+            network = make_synthetic_network(n_links, seed)
+        scenario = network if number == 0 else make_scenario_variant(network, seed + number)
+        scenario.to_file(shp_path)
@@ -0,0 +1,15 @@
+import os
+
+# gunicorn -c gunicorn.conf.py (Linux and macOS; Serve_Dashboard.py serves with waitress elsewhere)
+wsgi_app = "Deploy_Display_Dashboard:server"
+bind = "0.0.0.0:8002"
+workers = max(2, os.cpu_count() or 1)
+# each worker serves several requests at once, so long map downloads do not hold up the others
+worker_class = "gthread"
+threads = 8
+# the app, and the live map store when use_live_maps is on, are loaded once before the workers fork; the live layer
+# cache is filled after the fork, so each worker caches on its own and /metrics reports the worker that answers
+preload_app = True
+# files sent with send_file go out with sendfile(2)
+sendfile = True
+timeout = 120
@@ -0,0 +1,38 @@
+import os
+import sys
+
+import geopandas as gpd
+import numpy as np
+from shapely import LineString
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Generate_Network_HTML_functions import build_road_layer, generate_volume_diff_plot
+
+
+def network_frame(links):
+    # links: (A, B, VEH_AM_DIFF), each drawn as a short line from (A, B)
+    return gpd.GeoDataFrame(
+        {
+            "A": np.array([a for a, _, _ in links], dtype=np.int64),
+            "B": np.array([b for _, b, _ in links], dtype=np.int64),
+            "VEH_AM_DIFF": np.array([value for _, _, value in links], dtype=np.float64),
+        },
+        geometry=[LineString([(144.9 + a / 100, -37.8), (144.9 + b / 100, -37.7)]) for a, b, _ in links],
+        crs="EPSG:4326",
+    )
+
+
+def test_frames_over_the_same_network_share_the_asset(tmp_path):
+    links = [(1, 2, 100.0), (2, 3, -50.0), (3, 4, 200.0)]
+    file_name = str(tmp_path / "map.html")
+    _, forward_asset = build_road_layer(network_frame(links), file_name, shared_base_network=True)
+    _, reverse_asset = build_road_layer(network_frame(links[::-1]), file_name, shared_base_network=True)
+    assert forward_asset == reverse_asset
+
+
+def test_frame_without_links_renders_with_a_shared_base_network(tmp_path):
+    file_name = str(tmp_path / "empty.html")
+    generate_volume_diff_plot(network_frame([]), "VEH_AM_DIFF", 100, file_name, shared_base_network=True)
+    assert os.path.exists(file_name)
+    assert not [name for name in os.listdir(tmp_path) if name.startswith("_BASE_NETWORK_")]
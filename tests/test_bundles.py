@@ -0,0 +1,58 @@
+import os
+import sys
+import json
+import base64
+
+import numpy as np
+import pandas as pd
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Generate_Network_HTML_functions import MapJob
+from Generate_Network_HTML_bundles import bundle_geometry_levels, bundle_layer
+
+
+def layer_spec(plot_type, plot_column, values):
+    frame = pd.DataFrame({plot_column: values, "LINKC_AM": np.full(len(values), 30.0)})
+    _, spec = bundle_layer(frame, MapJob(plot_type, plot_column, 1, ""), {})
+    return spec
+
+
+def test_width_scale_of_unchanged_metric_is_valid_json():
+    for values in ([0.0, 0.0, -0.0], [np.nan, np.nan, np.nan], [0.0, np.nan, 0.0]):
+        for plot_type, plot_column in (("volume", "VEH_AM_DIFF"), ("network", "HYCAP_AM_DIFF")):
+            spec = layer_spec(plot_type, plot_column, values)
+            assert spec["width_scale"] == 1
+            json.dumps(spec, allow_nan=False)
+
+
+def test_width_scale_of_largest_absolute_width():
+    assert layer_spec("volume", "VEH_AM_DIFF", [-200.0, np.nan, 100.0])["width_scale"] == 2.0
+
+
+def path_links(level):
+    return np.frombuffer(base64.b64decode(level["path_links"]), dtype=np.uint32).tolist()
+
+
+def test_finer_geometry_levels_only_hold_the_links_they_change():
+    straight = shapely.LineString([(0, 0), (1, 1)])
+    winding = shapely.LineString([(i, i % 2) for i in range(20)])
+    simplified = shapely.LineString([(0, 0), (19, 1)])
+    levels = bundle_geometry_levels([
+        (0, np.array([straight, simplified, simplified])),
+        (10, np.array([straight, winding, simplified])),
+    ])
+    assert [level["min_zoom"] for level in levels] == [0, 10]
+    assert path_links(levels[0]) == [0, 1, 2]
+    assert path_links(levels[1]) == [1]
+
+
+def test_geometry_level_saving_little_is_dropped():
+    winding = shapely.LineString([(i, i % 2) for i in range(20)])
+    nearly_winding = shapely.LineString([(i, i % 2) for i in range(18)] + [(19, 1)])
+    levels = bundle_geometry_levels([(0, np.array([nearly_winding])), (10, np.array([winding]))])
+    # the finer level is drawn from the dropped level's zoom
+    assert [level["min_zoom"] for level in levels] == [0]
+    assert path_links(levels[0]) == [0]
+    assert len(base64.b64decode(levels[0]["coordinates"])) == 20 * 2 * 4
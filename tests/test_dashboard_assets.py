@@ -0,0 +1,104 @@
+import os
+import sys
+import gzip
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Deploy_Display_Dashboard as dashboard
+
+MAP_HTML = b"<html><body>" + b"map " * 1000 + b"</body></html>"
+
+
+@pytest.fixture
+def assets(tmp_path, monkeypatch):
+    # serve_asset reads the dashboard's assets folder, which dash keeps read-only once the app is built
+    dashboard.app.config.unset_read_only(["assets_folder"])
+    monkeypatch.setitem(dashboard.app.config, "assets_folder", str(tmp_path))
+    yield tmp_path
+    monkeypatch.undo()
+    dashboard.app.config.set_read_only(["assets_folder"], "Read-only: can only be set in the Dash constructor")
+
+
+@pytest.fixture
+def client(assets):
+    return dashboard.server.test_client()
+
+
+def write_map(assets, variants=()):
+    # the map and precompressed copies of it carrying its mtime, as the run script writes them
+    file_path = assets / "S1_VEH_AM.html"
+    file_path.write_bytes(MAP_HTML)
+    stat = os.stat(file_path)
+    for suffix in variants:
+        variant_path = assets / f"S1_VEH_AM.html{suffix}"
+        variant_path.write_bytes(gzip.compress(MAP_HTML) if suffix == ".gz" else b"brotli " + MAP_HTML)
+        os.utime(variant_path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+    return dashboard.asset_version(str(file_path))
+
+
+def test_etag_revalidates_with_304(client, assets):
+    version = write_map(assets)
+    response = client.get("/assets/S1_VEH_AM.html")
+    assert response.status_code == 200
+    assert response.data == MAP_HTML
+    assert response.headers["ETag"] == f'"{version}"'
+    assert response.headers["Cache-Control"] == "no-cache"
+    assert client.get("/assets/S1_VEH_AM.html", headers={"If-None-Match": f'"{version}"'}).status_code == 304
+
+
+def test_rebuilt_map_gets_a_new_etag(client, assets):
+    version = write_map(assets)
+    (assets / "S1_VEH_AM.html").write_bytes(MAP_HTML + b"<!-- rebuilt -->")
+    response = client.get("/assets/S1_VEH_AM.html", headers={"If-None-Match": f'"{version}"'})
+    assert response.status_code == 200
+    assert response.headers["ETag"] != f'"{version}"'
+
+
+def test_versioned_url_is_cached_as_immutable(client, assets):
+    version = write_map(assets)
+    assert dashboard.versioned_asset_url("S1_VEH_AM.html", "VEH_AM") == f"/assets/S1_VEH_AM.html?v={version}#VEH_AM"
+    response = client.get(f"/assets/S1_VEH_AM.html?v={version}")
+    assert response.headers["Cache-Control"] == f"public, max-age={dashboard.versioned_asset_max_age}, immutable"
+    # a URL of an older version revalidates instead
+    response = client.get("/assets/S1_VEH_AM.html?v=0123456789abcdef")
+    assert response.headers["Cache-Control"] == "no-cache"
+
+
+def test_accept_encoding_selects_the_precompressed_copy(client, assets):
+    version = write_map(assets, variants=(".gz", ".br"))
+
+    response = client.get("/assets/S1_VEH_AM.html", headers={"Accept-Encoding": "gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+    assert response.headers["ETag"] == f'"{version}-gzip"'
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.mimetype == "text/html"
+    assert gzip.decompress(response.data) == MAP_HTML
+
+    response = client.get("/assets/S1_VEH_AM.html", headers={"Accept-Encoding": "gzip, deflate, br"})
+    assert response.headers["Content-Encoding"] == "br"
+    assert response.headers["ETag"] == f'"{version}-br"'
+    assert response.data == b"brotli " + MAP_HTML
+
+    response = client.get("/assets/S1_VEH_AM.html", headers={"Accept-Encoding": "br;q=0.5, gzip"})
+    assert response.headers["Content-Encoding"] == "gzip"
+
+    response = client.get("/assets/S1_VEH_AM.html", headers={"Accept-Encoding": "identity"})
+    assert "Content-Encoding" not in response.headers
+    assert response.headers["Vary"] == "Accept-Encoding"
+    assert response.data == MAP_HTML
+
+
+def test_copy_of_an_older_map_is_not_served(client, assets):
+    write_map(assets, variants=(".gz",))
+    (assets / "S1_VEH_AM.html").write_bytes(MAP_HTML + b"<!-- rebuilt -->")
+    response = client.get("/assets/S1_VEH_AM.html", headers={"Accept-Encoding": "gzip"})
+    assert "Content-Encoding" not in response.headers
+    assert response.data == MAP_HTML + b"<!-- rebuilt -->"
+
+
+def test_missing_asset_is_404(client, assets):
+    write_map(assets)
+    assert client.get("/assets/S2_VEH_AM.html").status_code == 404
+    assert client.get("/assets/../S1_VEH_AM.html").status_code == 404
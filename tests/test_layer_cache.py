@@ -0,0 +1,92 @@
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Deploy_Display_Dashboard as dashboard
+from Deploy_Display_Dashboard_live import VALUE_COLUMNS, LayerCache, ScenarioStore, StoredScenario, layer_payload
+
+
+def counted(payload, computed):
+    # a compute function recording each call in `computed`
+    def compute():
+        computed.append(payload)
+        return payload
+    return compute
+
+
+def test_hits_and_misses_are_counted():
+    cache = LayerCache(100)
+    computed = []
+    assert cache.get_or_compute("a", counted(b"aaaa", computed)) == b"aaaa"
+    assert cache.get_or_compute("a", counted(b"other", computed)) == b"aaaa"
+    assert computed == [b"aaaa"]
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["entries"], metrics["bytes"]) == (1, 1, 1, 4)
+
+
+def test_least_recently_used_layer_is_evicted():
+    cache = LayerCache(10)
+    cache.get_or_compute("a", lambda: b"aaaa")
+    cache.get_or_compute("b", lambda: b"bbbb")
+    # a hit makes "a" the most recently used
+    cache.get_or_compute("a", lambda: b"aaaa")
+    cache.get_or_compute("c", lambda: b"cccc")
+    assert list(cache.entries) == ["a", "c"]
+    assert cache.metrics()["evictions"] == 1
+    assert cache.metrics()["bytes"] == 8
+
+
+def test_layer_larger_than_the_cache_is_not_kept():
+    cache = LayerCache(10)
+    cache.get_or_compute("a", lambda: b"aaaa")
+    assert cache.get_or_compute("big", lambda: b"x" * 11) == b"x" * 11
+    assert list(cache.entries) == ["a"]
+    assert cache.metrics()["evictions"] == 0
+
+
+def test_prefetch_skips_cached_layers_and_is_counted_apart():
+    cache = LayerCache(100)
+    computed = []
+    cache.get_or_compute("a", counted(b"aaaa", computed))
+    cache.prefetch("a", counted(b"aaaa", computed))
+    cache.prefetch("b", counted(b"bbbb", computed))
+    assert computed == [b"aaaa", b"bbbb"]
+    assert cache.get_or_compute("b", counted(b"bbbb", computed)) == b"bbbb"
+    metrics = cache.metrics()
+    assert (metrics["hits"], metrics["misses"], metrics["prefetches"]) == (1, 1, 1)
+
+
+@pytest.fixture
+def live_client(monkeypatch):
+    # the dashboard with a live scenario store of one scenario over two links
+    linkc = np.array([30.0, 30.0])
+    values = {col: np.ones(2) for col in VALUE_COLUMNS}
+    values["VEH_AM"] = np.array([100.0, 50.0])
+    store = ScenarioStore(
+        "v1", {"A": np.array([1, 2]), "B": np.array([2, 3])},
+        {"S1": StoredScenario(values=values, linkc=linkc, in_filter=np.array([True, True]))}, [b""]
+    )
+    monkeypatch.setattr(dashboard, "scenario_store", store)
+    monkeypatch.setattr(dashboard, "layer_cache", LayerCache(1024 ** 2), raising=False)
+    monkeypatch.setattr(dashboard, "layer_payload", layer_payload, raising=False)
+    return dashboard.server.test_client()
+
+
+def test_live_layer_is_computed_once(live_client):
+    assert live_client.get("/live/layer?scenario=S1&layer=VEH_AM&v=v1").status_code == 200
+    assert live_client.get("/live/layer?scenario=S1&layer=VEH_AM&v=v1").status_code == 200
+    metrics = dashboard.layer_cache.metrics()
+    assert (metrics["hits"], metrics["misses"]) == (1, 1)
+
+
+def test_unknown_selection_is_404(live_client):
+    for query in ("scenario=S2&layer=VEH_AM", "scenario=S1&layer=NOPE", "scenario=S1&base=S2&layer=VEH_AM_DIFF",
+                  "layer=VEH_AM"):
+        response = live_client.get(f"/live/layer?{query}")
+        assert response.status_code == 404
+        assert response.data == b"No map for this selection"
+    assert dashboard.layer_cache.metrics()["entries"] == 0
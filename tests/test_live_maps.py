@@ -0,0 +1,65 @@
+import os
+import sys
+import subprocess
+import gzip
+import json
+import base64
+
+import numpy as np
+import shapely
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Deploy_Display_Dashboard_live import (
+    VALUE_COLUMNS, ScenarioStore, StoredScenario, links_payloads, live_layer, pair_frame
+)
+
+
+def stored_scenario(volumes, link_classes):
+    # volumes and LINKC_AM over the store's links, NaN where the scenario lacks the link
+    volumes = np.asarray(volumes, dtype=np.float64)
+    linkc = np.asarray(link_classes, dtype=np.float64)
+    values = {col: np.where(np.isnan(linkc), np.nan, 1.0) for col in VALUE_COLUMNS}
+    values["VEH_AM"] = volumes
+    return StoredScenario(values=values, linkc=linkc, in_filter=~np.isnan(linkc) & (linkc != 1))
+
+
+def test_pair_frame_keeps_links_of_either_scenario():
+    base = stored_scenario([100.0, 50.0, np.nan, 10.0], [30, 30, np.nan, 1])
+    compare = stored_scenario([150.0, np.nan, 80.0, 20.0], [30, np.nan, 34, 1])
+    frame = pair_frame(base, compare, ["VEH_AM_DIFF"])
+    np.testing.assert_array_equal(frame["VEH_AM_DIFF"], [50.0, np.nan, np.nan, np.nan])
+    # the base-only link is in the frame with the base's attributes, the filtered link is not
+    np.testing.assert_array_equal(frame["LINKC_AM"], [30.0, 30.0, 34.0, np.nan])
+
+
+def test_self_diff_layer_is_valid_json():
+    store = ScenarioStore("", {}, {"S": stored_scenario([100.0, 50.0], [30, 30])}, [])
+    spec, _ = live_layer(store, "S", "VEH_AM_DIFF", base_name="S")
+    assert spec["width_scale"] == 1
+    json.dumps(spec, allow_nan=False)
+
+
+def test_links_payload_only_holds_the_coarsest_geometry_level():
+    # a winding link simplified away at the coarse levels, and a 2-vertex link no level changes
+    winding = shapely.LineString([(144.9 + i * 1e-4, -37.8 + (i % 2) * 1e-5) for i in range(50)])
+    straight = shapely.LineString([(144.9, -37.8), (145.0, -37.7)])
+    payloads = links_payloads("v1", {
+        "A": np.array([1, 2]), "B": np.array([2, 3]), "geometry": shapely.to_wkb(np.array([winding, straight])),
+    })
+    links = json.loads(gzip.decompress(payloads[0]))
+    assert "coordinates" in links["geometry_levels"][0]
+    assert all(set(level) == {"min_zoom"} for level in links["geometry_levels"][1:])
+    assert len(payloads) == len(links["geometry_levels"]) > 1
+    for payload in payloads[1:]:
+        level = json.loads(gzip.decompress(payload))
+        assert np.frombuffer(base64.b64decode(level["path_links"]), dtype=np.uint32).tolist() == [0]
+
+
+def test_import_leaves_the_warning_filters_alone():
+    # in a fresh interpreter, as the dashboard imports the module; numpy and pandas set filters of their own
+    code = (
+        "import warnings, numpy, pandas, duckdb, shapely; before = list(warnings.filters); "
+        "import Deploy_Display_Dashboard_live; assert warnings.filters == before, warnings.filters"
+    )
+    subprocess.run([sys.executable, "-c", code], cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))), check=True)
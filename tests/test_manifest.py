@@ -0,0 +1,119 @@
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Generate_Network_HTML_manifest
+from Generate_Network_HTML_functions import MapJob, file_sha256
+from Generate_Network_HTML_manifest import (
+    bundle_inputs, damaged_assets, is_up_to_date, map_inputs, record_output, scenario_source_hashes
+)
+
+SOURCES = {"S1": {".shp": "aa", ".dbf": "bb"}}
+
+
+def built_map(tmp_path, job, sources=SOURCES, base_network_asset=None):
+    # a written map recorded in a fresh manifest
+    with open(job.file_name, "w") as f:
+        f.write("<html></html>")
+    if base_network_asset is not None:
+        with open(tmp_path / base_network_asset, "w") as f:
+            f.write("(function () {})();")
+    manifest = {}
+    record_output(manifest, job.file_name, map_inputs(job, sources, base_network_asset is not None), base_network_asset)
+    return manifest
+
+
+def volume_job(tmp_path, min_abs_vol=100):
+    return MapJob("volume", "VEH_AM", min_abs_vol, str(tmp_path / "S1_VEH_AM.html"))
+
+
+def test_recorded_map_is_up_to_date(tmp_path):
+    job = volume_job(tmp_path)
+    manifest = built_map(tmp_path, job)
+    assert is_up_to_date(manifest, job.file_name, map_inputs(job, SOURCES))
+
+
+def test_source_change_makes_map_stale(tmp_path):
+    job = volume_job(tmp_path)
+    manifest = built_map(tmp_path, job)
+    changed_sources = {"S1": {".shp": "aa", ".dbf": "cc"}}
+    assert not is_up_to_date(manifest, job.file_name, map_inputs(job, changed_sources))
+
+
+def test_style_change_makes_map_stale(tmp_path):
+    job = volume_job(tmp_path)
+    manifest = built_map(tmp_path, job)
+    assert not is_up_to_date(manifest, job.file_name, map_inputs(volume_job(tmp_path, min_abs_vol=50), SOURCES))
+    assert not is_up_to_date(manifest, job.file_name, map_inputs(job, SOURCES, shared_base_network=True))
+
+
+def test_code_version_change_makes_map_stale(tmp_path, monkeypatch):
+    job = volume_job(tmp_path)
+    manifest = built_map(tmp_path, job)
+    monkeypatch.setattr(Generate_Network_HTML_manifest, "code_version", lambda: "another version")
+    assert not is_up_to_date(manifest, job.file_name, map_inputs(job, SOURCES))
+
+
+def test_missing_map_is_stale(tmp_path):
+    job = volume_job(tmp_path)
+    manifest = built_map(tmp_path, job)
+    os.remove(job.file_name)
+    assert not is_up_to_date(manifest, job.file_name, map_inputs(job, SOURCES))
+
+
+def test_damaged_base_network_asset_makes_its_maps_stale(tmp_path):
+    job = volume_job(tmp_path)
+    asset_name = "_BASE_NETWORK_0123456789abcdef.js"
+    manifest = built_map(tmp_path, job, base_network_asset=asset_name)
+    inputs = map_inputs(job, SOURCES, shared_base_network=True)
+    assert damaged_assets(manifest, str(tmp_path)) == set()
+    assert is_up_to_date(manifest, job.file_name, inputs, damaged_assets(manifest, str(tmp_path)))
+
+    with open(tmp_path / asset_name, "a") as f:
+        f.write("corrupted")
+    assert damaged_assets(manifest, str(tmp_path)) == {asset_name}
+    assert not is_up_to_date(manifest, job.file_name, inputs, damaged_assets(manifest, str(tmp_path)))
+
+    os.remove(tmp_path / asset_name)
+    assert damaged_assets(manifest, str(tmp_path)) == {asset_name}
+
+
+def test_copied_asset_with_the_same_content_is_not_damaged(tmp_path):
+    job = volume_job(tmp_path)
+    asset_name = "_BASE_NETWORK_0123456789abcdef.js"
+    manifest = built_map(tmp_path, job, base_network_asset=asset_name)
+    os.utime(tmp_path / asset_name, ns=(0, 0))
+    assert damaged_assets(manifest, str(tmp_path)) == set()
+
+
+def test_missing_geometry_level_makes_its_bundle_stale(tmp_path):
+    job = volume_job(tmp_path)
+    bundle_path = tmp_path / "S1_BUNDLE.html"
+    level_path = tmp_path / "S1_BUNDLE_Z12.js"
+    bundle_path.write_text("<html></html>")
+    level_path.write_text("bundleGeometryLevel(1, {});")
+    manifest = {}
+    inputs = bundle_inputs([job], SOURCES)
+    record_output(manifest, str(bundle_path), inputs, assets=[str(level_path)])
+    assert is_up_to_date(manifest, str(bundle_path), inputs, damaged_assets(manifest, str(tmp_path)))
+
+    os.remove(level_path)
+    assert damaged_assets(manifest, str(tmp_path)) == {"S1_BUNDLE_Z12.js"}
+    assert not is_up_to_date(manifest, str(bundle_path), inputs, damaged_assets(manifest, str(tmp_path)))
+
+
+def test_sources_with_recorded_mtime_and_size_are_not_hashed_again(tmp_path):
+    shp_path = tmp_path / "SUMMARY_LOADED_NETWORK_LINKS_S1.shp"
+    dbf_path = tmp_path / "SUMMARY_LOADED_NETWORK_LINKS_S1.dbf"
+    shp_path.write_bytes(b"shp")
+    dbf_path.write_bytes(b"dbf")
+    recorded = {
+        extension: (os.stat(path).st_mtime_ns, os.stat(path).st_size, f"recorded {extension}")
+        for extension, path in ((".shp", shp_path), (".dbf", dbf_path))
+    }
+    assert scenario_source_hashes(str(shp_path), recorded) == {".shp": "recorded .shp", ".dbf": "recorded .dbf"}
+
+    dbf_path.write_bytes(b"changed dbf")
+    hashes = scenario_source_hashes(str(shp_path), recorded)
+    assert hashes == {".shp": "recorded .shp", ".dbf": file_sha256(str(dbf_path))}
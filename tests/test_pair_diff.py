@@ -0,0 +1,71 @@
+import os
+import sys
+import math
+
+import duckdb
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Generate_Network_HTML_functions import (
+    SCENARIO_COLUMNS, build_scenario_values, compute_pair_diffs, query_pair_diff
+)
+
+
+def create_scenario_table(con, table_name, links):
+    # links: (A, B, LINKC_AM, VEH_AM); every other value column is 1.0
+    columns = ", ".join(f"{col} DOUBLE" for col in SCENARIO_COLUMNS[2:])
+    con.sql(f"CREATE TABLE {table_name} (A INTEGER, B INTEGER, {columns}, LINKC_AM INTEGER, SL_AM DOUBLE, geometry BLOB)")
+    for a, b, link_class, volume in links:
+        values = [a, b] + [volume if col == "VEH_AM" else 1.0 for col in SCENARIO_COLUMNS[2:]] + [link_class, 60.0, None]
+        con.execute(f"INSERT INTO {table_name} VALUES ({', '.join('?' * len(values))})", values)
+    return table_name
+
+
+def pair_diff_rows(base_links, compare_links, reverse=False):
+    con = duckdb.connect()
+    registry = {
+        "BASE": create_scenario_table(con, "scenario_base", base_links),
+        "COMPARE": create_scenario_table(con, "scenario_compare", compare_links),
+    }
+    pair = ("COMPARE", "BASE") if reverse else ("BASE", "COMPARE")
+    build_scenario_values(con, registry)
+    compute_pair_diffs(con, [pair])
+    pair_diff = query_pair_diff(con, registry, *pair).df()
+    con.close()
+    return {
+        (a, b): (veh, link_class)
+        for a, b, veh, link_class in pair_diff[["A", "B", "VEH_AM_DIFF", "LINKC_AM"]].itertuples(index=False)
+    }
+
+
+def test_pair_diff_keeps_links_of_either_scenario():
+    rows = pair_diff_rows(
+        base_links=[(1, 2, 30, 100.0), (2, 3, 30, 50.0), (3, 4, 30, 10.0)],
+        compare_links=[(1, 2, 30, 150.0), (3, 4, 30, 10.0), (4, 5, 34, 80.0)],
+    )
+    assert set(rows) == {(1, 2), (2, 3), (3, 4), (4, 5)}
+    assert rows[(1, 2)][0] == 50.0
+    assert rows[(3, 4)][0] == 0.0
+    # removed in the compare scenario, added in it: no difference, but the link is drawn
+    assert math.isnan(rows[(2, 3)][0])
+    assert math.isnan(rows[(4, 5)][0])
+
+
+def test_pair_diff_filters_link_classes_of_both_scenarios():
+    rows = pair_diff_rows(
+        base_links=[(1, 2, 1, 100.0), (2, 3, 30, 50.0)],
+        compare_links=[(1, 2, 1, 150.0), (2, 3, 1, 60.0)],
+    )
+    # a link passing the class filter in either scenario is kept, with that scenario's attributes
+    assert set(rows) == {(2, 3)}
+    assert rows[(2, 3)] == (10.0, 30)
+
+
+def test_pair_diff_reverse_negates():
+    base_links = [(1, 2, 30, 100.0), (2, 3, 30, 50.0)]
+    compare_links = [(1, 2, 30, 150.0)]
+    forward = pair_diff_rows(base_links, compare_links)
+    reverse = pair_diff_rows(base_links, compare_links, reverse=True)
+    assert set(forward) == set(reverse) == {(1, 2), (2, 3)}
+    assert forward[(1, 2)][0] == 50.0
+    assert reverse[(1, 2)][0] == -50.0